@@ -0,0 +1,112 @@
+"""
+Approximate representatives of big synsets from a stratified sample of their images.
+
+The images are sampled label by label (proportionally to the size of each label), the mode of every feature
+is estimated from the sample and, for each feature, the confidence that the sampled mode is the true one is
+computed from the gap between the two most frequent categories and its stratified standard error. Only the
+features whose confidence is below the target are refined, by sampling more images and looking only at those
+columns, until they are confident or the whole synset has been read.
+"""
+import math
+import numpy as np
+from Code import fne_core
+
+
+def label_rows(labels, n_labels):
+	"""
+	Filas de cada label.
+	:return: (order, bounds) con las filas del label l en order[bounds[l]:bounds[l + 1]]
+	"""
+	labels = np.asarray(labels)
+	order = np.argsort(labels, kind='stable')
+	bounds = np.zeros(n_labels + 1, dtype=np.int64)
+	np.cumsum(np.bincount(labels, minlength=n_labels), out=bounds[1:])
+	return order, bounds
+
+
+def normal_cdf(z):
+	"""
+	Función de distribución de la normal estándar, vectorizada (Abramowitz y Stegun 7.1.26, error < 1.5e-7).
+	"""
+	z = np.asarray(z, dtype=np.float64)
+	x = np.abs(z) / math.sqrt(2)
+	t = 1 / (1 + 0.3275911 * x)
+	poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+	erf = 1 - poly * np.exp(-x * x)
+	return 0.5 * (1 + np.sign(z) * erf)
+
+
+def _mode_confidence(counts, sampled, sizes):
+	"""
+	:param counts: [estratos, features, 3] conteos de la muestra de cada estrato
+	:param sampled: [estratos] imágenes muestreadas de cada estrato
+	:param sizes: [estratos] imágenes de cada estrato
+	:return: (estimated [features, 3] conteos estimados de todo el synset, confidence [features])
+	"""
+	weights = sizes / sizes.sum()
+	proportions = counts / sampled[:, np.newaxis, np.newaxis]
+	estimated = np.tensordot(weights, proportions, axes=1)
+	mode = np.argmax(estimated, axis=-1)
+	masked = estimated.copy()
+	np.put_along_axis(masked, mode[:, np.newaxis], -np.inf, axis=-1)
+	second = np.argmax(masked, axis=-1)
+	features = np.arange(estimated.shape[0])
+	gap = estimated[features, mode] - estimated[features, second]
+	# varianza de (X_mode - X_second) en cada estrato, con la corrección de población finita
+	p1 = proportions[:, features, mode]
+	p2 = proportions[:, features, second]
+	strata_var = (p1 + p2) - (p1 - p2) ** 2
+	with np.errstate(divide='ignore', invalid='ignore'):
+		fpc = np.where(sizes > 1, (sizes - sampled) / (sizes - 1), 0.0)
+	variance = np.sum((weights ** 2 * fpc / sampled)[:, np.newaxis] * strata_var, axis=0)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		confidence = np.where(variance > 0, normal_cdf(gap / np.sqrt(variance)), 1.0)
+	return estimated * sizes.sum(), confidence
+
+
+def approximate_representative(matrix, order, bounds, synset_labels, fraction=0.05, min_per_label=20,
+                               target=0.99, max_rounds=6, seed=0):
+	"""
+	:param matrix: dmatrix (o un memmap)
+	:param order, bounds: de label_rows
+	:param synset_labels: labels del synset
+	:param fraction: proporción de imágenes de cada label en la primera muestra
+	:param min_per_label: mínimo de imágenes por label en la primera muestra
+	:param target: confianza a partir de la cual una feature no se refina
+	:param max_rounds: rondas de refinamiento, en cada una se dobla la muestra de las features dudosas
+	:return: (rep int8 [features], confidence [features], celdas leídas), [] si el synset no tiene imágenes
+	"""
+	synset_labels = np.asarray(synset_labels, dtype=np.int64)
+	synset_labels = synset_labels[bounds[synset_labels + 1] > bounds[synset_labels]]
+	if synset_labels.shape[0] == 0:
+		return [], np.zeros(0), 0
+	random = np.random.RandomState(seed)
+	sizes = (bounds[synset_labels + 1] - bounds[synset_labels]).astype(np.float64)
+	# las filas de cada label en orden aleatorio, la muestra de cada ronda es el siguiente trozo
+	shuffled = [random.permutation(order[bounds[l]:bounds[l + 1]]) for l in synset_labels.tolist()]
+	taken = np.minimum(sizes, np.maximum(min_per_label, np.ceil(sizes * fraction))).astype(np.int64)
+	n_features = matrix.shape[1]
+	counts = np.zeros((synset_labels.shape[0], n_features, 3), dtype=np.int64)
+	for i, rows in enumerate(shuffled):
+		counts[i] = fne_core.category_counts(matrix[np.sort(rows[:taken[i]])])
+	cells_read = int(taken.sum()) * n_features
+	estimated, confidence = _mode_confidence(counts, taken.astype(np.float64), sizes)
+	# una feature que ya es segura no se vuelve a mirar, sus conteos se quedan con la muestra de entonces
+	doubtful = np.arange(n_features)
+	for _ in range(max_rounds):
+		doubtful = doubtful[confidence[doubtful] < target]
+		if doubtful.shape[0] == 0 or np.all(taken == sizes):
+			break
+		new_taken = np.minimum(sizes, taken * 2).astype(np.int64)
+		for i, rows in enumerate(shuffled):
+			if new_taken[i] > taken[i]:
+				extra = matrix[np.ix_(np.sort(rows[taken[i]:new_taken[i]]), doubtful)]
+				counts[i, doubtful] += fne_core.category_counts(extra)
+		cells_read += int((new_taken - taken).sum()) * doubtful.shape[0]
+		taken = new_taken
+		# las features ya seguras se quedan con la estimación anterior
+		refined_estimated, refined_confidence = _mode_confidence(counts[:, doubtful], taken.astype(np.float64),
+		                                                         sizes)
+		estimated[doubtful] = refined_estimated
+		confidence[doubtful] = refined_confidence
+	return fne_core.representative_from_counts(estimated), confidence, cells_read
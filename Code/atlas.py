@@ -0,0 +1,195 @@
+"""
+Atlas of the representatives of every WordNet noun that has ImageNet images below it.
+
+The atlas is built bottom-up in one post-order pass over the hyponym DAG: each ImageNet class starts from
+its own label, every parent takes the union of the labels of its children (so a label reached through two
+paths is only counted once) and the per-feature category counts of all nodes come out of one product with
+the per-label counts. The representative and the ones-proportion of every node are derived from those
+counts and saved as arrays indexed by offset, so asking for the representative of a synset is a lookup.
+"""
+import numpy as np
+from os import path
+from os import makedirs
+from Code import fne_core
+from Code import hierarchy
+
+_atlas_path = '../Data/Atlas/'
+_files = ['offsets', 'own_labels', 'membership', 'sizes', 'label_counts', 'counts', 'representatives',
+          'ones_proportion']
+# arrays big enough to keep on disk and map only the rows that are used
+_mapped = ['label_counts', 'counts', 'representatives']
+
+
+def node_membership(ids, dag):
+	"""
+	Labels que hay debajo de cada nodo con imágenes, en una pasada en post-orden por el DAG.
+	:param ids: IdTables
+	:param dag: HyponymDag
+	:return: (offsets ordenados, own_labels [nodos], membership bool [nodos, labels])
+	"""
+	offsets = dag.ancestor_closure(ids.offsets)
+	row = dict(zip(offsets.tolist(), range(offsets.shape[0])))
+	own_labels = ids.offsets_to_labels(offsets)
+	membership = np.zeros((offsets.shape[0], len(ids)), dtype=bool)
+	for node in dag.post_order(offsets):
+		i = row[node]
+		if own_labels[i] >= 0:
+			membership[i, own_labels[i]] = True
+		for child in dag.get_children(node):
+			if child in row:
+				membership[i] |= membership[row[child]]
+	return offsets, own_labels, membership
+
+
+class Atlas:
+	"""
+	Attributes:
+		offsets (np.array): offsets ordenados de los nodos del atlas
+		own_labels (np.array): own_labels[nodo] = label del nodo si es una clase de imagenet, -1 si no
+		membership (np.array): membership[nodo, label] = True si el label esta en el nodo o debajo
+		sizes (np.array): sizes[nodo] = cantidad de imagenes del nodo
+		label_counts (np.array): label_counts[label, feature, category]
+		counts (np.array): counts[nodo, feature, category]
+		representatives (np.array): representatives[nodo, feature] = moda de la feature (-1, 0 o 1)
+		ones_proportion (np.array): ones_proportion[nodo] = proporción de 1 del representante
+	"""
+
+	def __init__(self, offsets, own_labels, membership, sizes, label_counts, counts, representatives,
+	             ones_proportion):
+		self.offsets = offsets
+		self.own_labels = own_labels
+		self.membership = membership
+		self.sizes = sizes
+		self.label_counts = label_counts
+		self.counts = counts
+		self.representatives = representatives
+		self.ones_proportion = ones_proportion
+
+	@staticmethod
+	def atlas_dir(version):
+		return _atlas_path + str(version) + '/'
+
+	@classmethod
+	def build(cls, data, dag=None, chunk_nodes=64):
+		"""
+		:param data: Data con el embedding cargado
+		:param dag: HyponymDag, el compartido por defecto
+		:param chunk_nodes: nodos por bloque al multiplicar membership por los conteos por label
+		"""
+		if dag is None:
+			dag = hierarchy.get_hyponym_dag()
+		atlas_dir = cls.atlas_dir(data.version)
+		if not path.exists(atlas_dir):
+			makedirs(atlas_dir)
+		n_labels = len(data.ids)
+		label_counts = data.label_category_counts()
+		np.save(atlas_dir + 'label_counts.npy', label_counts)
+
+		offsets, own_labels, membership = node_membership(data.ids, dag)
+		sizes = membership @ np.bincount(data.labels, minlength=n_labels)
+		n_features = label_counts.shape[1]
+		flat_counts = label_counts.reshape(n_labels, -1).astype(np.float64)
+		counts = np.lib.format.open_memmap(atlas_dir + 'counts.npy', mode='w+', dtype=np.int32,
+		                                   shape=(offsets.shape[0], n_features, 3))
+		representatives = np.empty((offsets.shape[0], n_features), dtype=np.int8)
+		for start in range(0, offsets.shape[0], chunk_nodes):
+			block = membership[start:start + chunk_nodes].astype(np.float64) @ flat_counts
+			block = np.rint(block).astype(np.int32).reshape(-1, n_features, 3)
+			counts[start:start + chunk_nodes] = block
+			representatives[start:start + chunk_nodes] = fne_core.representative_from_counts(block)
+		counts.flush()
+		ones_proportion = np.count_nonzero(representatives == 1, axis=1) / n_features
+		atlas = cls(offsets, own_labels, membership, sizes, label_counts, counts, representatives,
+		            ones_proportion)
+		atlas.save(atlas_dir, skip=['label_counts', 'counts'])
+		return atlas
+
+	def save(self, atlas_dir, skip=()):
+		for name in _files:
+			if name not in skip:
+				np.save(atlas_dir + name + '.npy', getattr(self, name))
+
+	@classmethod
+	def load(cls, atlas_dir):
+		arrays = {}
+		for name in _files:
+			mode = 'r' if name in _mapped else None
+			arrays[name] = np.load(atlas_dir + name + '.npy', mmap_mode=mode)
+		return cls(**arrays)
+
+	@classmethod
+	def load_or_build(cls, data):
+		atlas_dir = cls.atlas_dir(data.version)
+		if path.isfile(atlas_dir + 'ones_proportion.npy'):
+			return cls.load(atlas_dir)
+		return cls.build(data)
+
+	def row(self, offset):
+		"""
+		:return: fila del offset en el atlas, -1 si no tiene imagenes
+		"""
+		i = int(np.searchsorted(self.offsets, offset))
+		if i < self.offsets.shape[0] and self.offsets[i] == offset:
+			return i
+		return -1
+
+	def node_counts(self, offset, hyponyms_only=False):
+		"""
+		Per-feature category counts [features, 3] of the images of the synset.
+		:param hyponyms_only: leave out the images of the synset's own label, like get_index_from_ss does
+		:return: counts, None if the synset has no images
+		"""
+		i = self.row(offset)
+		if i < 0:
+			return None
+		counts = np.asarray(self.counts[i])
+		if hyponyms_only and self.own_labels[i] >= 0:
+			counts = counts - self.label_counts[self.own_labels[i]]
+		return counts
+
+	def membership_of(self, offsets, hyponyms_only=False):
+		"""
+		Labels de varios synsets a la vez.
+		:param hyponyms_only: sin el label del propio synset, como get_index_from_ss
+		:return: bool [synsets, labels], fila vacía para los synsets sin imágenes
+		"""
+		membership = np.zeros((len(offsets), self.membership.shape[1]), dtype=bool)
+		for i, offset in enumerate(offsets):
+			row = self.row(offset)
+			if row >= 0:
+				membership[i] = self.membership[row]
+				if hyponyms_only and self.own_labels[row] >= 0:
+					membership[i, self.own_labels[row]] = False
+		return membership
+
+	def size(self, offset, hyponyms_only=False):
+		counts = self.node_counts(offset, hyponyms_only)
+		if counts is None:
+			return 0
+		return int(counts[0].sum())
+
+	def representative(self, offset, hyponyms_only=False):
+		"""
+		rep[feature] = 1, -1 o 0 según el valor que se repite más veces en el synset.
+		:return: rep, [] si el synset no tiene imagenes
+		"""
+		i = self.row(offset)
+		if i < 0 or self.sizes[i] == 0:
+			return []
+		if hyponyms_only and self.own_labels[i] >= 0:
+			counts = self.node_counts(offset, hyponyms_only)
+			if counts[0].sum() == 0:
+				return []
+			return fne_core.representative_from_counts(counts)
+		return np.asarray(self.representatives[i])
+
+	def ones_proportion_of(self, offset, hyponyms_only=False):
+		i = self.row(offset)
+		if i < 0:
+			return None
+		if hyponyms_only and self.own_labels[i] >= 0:
+			rep = self.representative(offset, hyponyms_only)
+			if len(rep) == 0:
+				return None
+			return np.count_nonzero(rep == 1) / len(rep)
+		return self.ones_proportion[i]
@@ -0,0 +1,95 @@
+"""
+Benchmarks of the compute paths of the FNE code. Run from the repository root:
+
+	python -m Code.benchmarks
+
+The benchmarks that load the embedding use the relative data paths, so run those from the Code directory:
+
+	PYTHONPATH=.. python -m Code.benchmarks approximate
+"""
+import subprocess
+import sys
+import time
+import numpy as np
+from os import path
+
+_repo_root = path.dirname(path.dirname(path.abspath(__file__)))
+_heavy_modules = ['matplotlib.pyplot', 'scipy.stats', 'nltk.corpus', 'pygraphviz']
+
+
+def import_time(module, repeat=5):
+	"""
+	Mide cuanto tarda en importarse module en un interprete nuevo.
+	:param module: nombre del modulo
+	:param repeat: cantidad de repeticiones, se queda con la mejor
+	:return: (segundos, lista de modulos pesados que ha cargado)
+	"""
+	code = 'import sys, time\n' \
+	       't = time.perf_counter()\n' \
+	       'import ' + module + '\n' \
+	       'print(time.perf_counter() - t)\n' \
+	       'print(",".join(m for m in ' + repr(_heavy_modules) + ' if m in sys.modules))\n'
+	best = None
+	heavy = []
+	for _ in range(repeat):
+		out = subprocess.run([sys.executable, '-c', code], cwd=_repo_root, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+		                     universal_newlines=True, check=True).stdout.split('\n')
+		seconds = float(out[0])
+		heavy = [m for m in out[1].split(',') if m]
+		if best is None or seconds < best:
+			best = seconds
+	return best, heavy
+
+
+def bench_imports():
+	"""
+	Compara el tiempo de import de los modulos de computo con el de las dependencias pesadas.
+	"""
+	modules = ['Code.fne_core', 'Code.wordnet_imagenet_connections', 'Code.synset_tree'] + _heavy_modules
+	for module in modules:
+		try:
+			seconds, heavy = import_time(module)
+		except subprocess.CalledProcessError:
+			print('{:40s} not available'.format(module))
+			continue
+		print('{:40s} {:8.3f} s  heavy modules loaded: {}'.format(module, seconds, heavy))
+
+
+def bench_approximate(version=25, synsets=('living_thing.n.01', 'artifact.n.01', 'mammal.n.01', 'dog.n.01'),
+                      targets=(0.9, 0.99, 0.999)):
+	"""
+	Representantes exactos (moda de todas las filas) contra los aproximados de approximate, para varias
+	confianzas objetivo: tiempo, celdas leídas y proporción de features en las que coinciden.
+	"""
+	from Code import approximate, fne_core, hierarchy
+	from Code.lazy_imports import wn
+	from Code.wordnet_imagenet_connections import Data
+	data = Data('', version)
+	order, bounds = data.get_label_rows()
+	dag = hierarchy.get_hyponym_dag()
+	for name in synsets:
+		labels = data.ids.labels_of_offsets(dag.hyponym_offsets(wn.synset(name).offset()))
+		rows = fne_core.rows_of_labels(data.labels, labels, len(data.ids))
+		ini_time = time.perf_counter()
+		exact = fne_core.representative(data.dmatrix[rows])
+		exact_time = time.perf_counter() - ini_time
+		print('{:25s} {:8d} images  exact {:8.3f} s'.format(name, rows.shape[0], exact_time))
+		for target in targets:
+			ini_time = time.perf_counter()
+			rep, confidence, cells = approximate.approximate_representative(data.dmatrix, order, bounds, labels,
+			                                                                target=target)
+			seconds = time.perf_counter() - ini_time
+			print('    target {:6.3f}  {:8.3f} s  x{:6.1f}  cells read {:6.1%}  agreement {:8.4%}'.format(
+				target, seconds, exact_time / seconds, cells / max(exact.size * rows.shape[0], 1),
+				np.mean(rep == exact)))
+
+
+def main():
+	if len(sys.argv) > 1 and sys.argv[1] == 'approximate':
+		bench_approximate()
+	else:
+		bench_imports()
+
+
+if __name__ == "__main__":
+	main()
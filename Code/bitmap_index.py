@@ -0,0 +1,365 @@
+"""
+Bitmap index of the discretized FNE and a small boolean query engine on top of it.
+
+For every feature there is one bitmap with the images (rows of dmatrix) where it is 1 and another one where
+it is -1; the rows where it is 0 are the ones in neither. Synsets are bitmaps of the rows of their images.
+Bitmaps are compressed roaring-style: the rows are split in chunks of 65536 and each chunk is kept either as
+a sorted array of uint16 (up to 4096 rows) or as an 8 KB bitmap, whichever is smaller.
+
+Queries are expressions over features and synsets combined with &, | and ~:
+
+	index.count(Feature(9000, 1) & Feature(4300, -1) & Synset(dog.offset()))
+	index.rows(~Feature(10, 0) | Synset(cat.offset()))
+"""
+import numpy as np
+from os import path
+from os import makedirs
+from Code import fne_core
+from Code import hierarchy
+
+CHUNK_BITS = 16
+CHUNK_ROWS = 1 << CHUNK_BITS
+# a partir de aquí un bitmap de 8 KB ocupa menos que el array de uint16
+ARRAY_LIMIT = 4096
+_bitmap_index_path = '../Data/Bitmaps/'
+
+
+def _to_container(chunk_rows):
+	"""
+	:param chunk_rows: uint16 ordenados, filas dentro del chunk
+	:return: array de uint16 o bitmap de uint8 [8192]
+	"""
+	if chunk_rows.shape[0] <= ARRAY_LIMIT:
+		return chunk_rows.astype(np.uint16)
+	bits = np.zeros(CHUNK_ROWS, dtype=bool)
+	bits[chunk_rows] = True
+	return np.packbits(bits, bitorder='little')
+
+
+def _container_rows(container):
+	if container.dtype == np.uint16:
+		return container
+	return np.flatnonzero(np.unpackbits(container, bitorder='little')).astype(np.uint16)
+
+
+def _container_bits(container):
+	if container.dtype == np.uint8:
+		return container
+	bits = np.zeros(CHUNK_ROWS, dtype=bool)
+	bits[container] = True
+	return np.packbits(bits, bitorder='little')
+
+
+def _container_len(container):
+	if container.dtype == np.uint16:
+		return container.shape[0]
+	return int(_POPCOUNT[container].sum())
+
+
+def _normalize(bits):
+	"""
+	Bitmap de un chunk -> el contenedor más pequeño, None si está vacío.
+	"""
+	n = int(_POPCOUNT[bits].sum())
+	if n == 0:
+		return None
+	if n <= ARRAY_LIMIT:
+		return _container_rows(bits)
+	return bits
+
+
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+
+
+class RoaringBitmap:
+	"""
+	Conjunto de filas comprimido por chunks de 65536.
+
+	Attributes:
+		n_rows (int): cantidad de filas del universo (para ~)
+		containers (dict): containers[chunk] = array uint16 o bitmap uint8, solo los chunks no vacíos
+	"""
+
+	def __init__(self, n_rows, containers=None):
+		self.n_rows = n_rows
+		self.containers = containers if containers is not None else {}
+
+	@classmethod
+	def from_rows(cls, rows, n_rows):
+		"""
+		:param rows: índices de las filas, ordenados
+		"""
+		rows = np.asarray(rows, dtype=np.int64)
+		containers = {}
+		if rows.shape[0] > 0:
+			chunks = rows >> CHUNK_BITS
+			bounds = np.flatnonzero(np.r_[True, chunks[1:] != chunks[:-1], True])
+			for start, end in zip(bounds[:-1], bounds[1:]):
+				low = (rows[start:end] & (CHUNK_ROWS - 1)).astype(np.uint16)
+				containers[int(chunks[start])] = _to_container(low)
+		return cls(n_rows, containers)
+
+	def rows(self):
+		"""
+		:return: np array ordenado con los índices de las filas
+		"""
+		parts = [(chunk << CHUNK_BITS) + _container_rows(self.containers[chunk]).astype(np.int64)
+		         for chunk in sorted(self.containers)]
+		if len(parts) == 0:
+			return np.zeros(0, dtype=np.int64)
+		return np.concatenate(parts)
+
+	def __len__(self):
+		return sum(_container_len(c) for c in self.containers.values())
+
+	def __and__(self, other):
+		containers = {}
+		for chunk in self.containers.keys() & other.containers.keys():
+			a = self.containers[chunk]
+			b = other.containers[chunk]
+			if a.dtype == np.uint16 and b.dtype == np.uint16:
+				both = np.intersect1d(a, b, assume_unique=True)
+				if both.shape[0] > 0:
+					containers[chunk] = both
+			elif a.dtype == np.uint16 or b.dtype == np.uint16:
+				rows, bits = (a, b) if a.dtype == np.uint16 else (b, a)
+				inside = (bits[rows >> 3] >> (rows & 7).astype(np.uint8)) & 1
+				both = rows[inside == 1]
+				if both.shape[0] > 0:
+					containers[chunk] = both
+			else:
+				both = _normalize(a & b)
+				if both is not None:
+					containers[chunk] = both
+		return RoaringBitmap(self.n_rows, containers)
+
+	def __or__(self, other):
+		containers = dict(self.containers)
+		for chunk, b in other.containers.items():
+			a = containers.get(chunk)
+			if a is None:
+				containers[chunk] = b
+			elif a.dtype == np.uint16 and b.dtype == np.uint16 and a.shape[0] + b.shape[0] <= ARRAY_LIMIT:
+				containers[chunk] = np.union1d(a, b).astype(np.uint16)
+			else:
+				containers[chunk] = _normalize(_container_bits(a) | _container_bits(b))
+		return RoaringBitmap(self.n_rows, containers)
+
+	def __invert__(self):
+		containers = {}
+		n_chunks = (self.n_rows + CHUNK_ROWS - 1) >> CHUNK_BITS
+		for chunk in range(n_chunks):
+			bits = np.full(CHUNK_ROWS // 8, 255, dtype=np.uint8)
+			if chunk in self.containers:
+				bits &= ~_container_bits(self.containers[chunk])
+			if chunk == n_chunks - 1 and self.n_rows % CHUNK_ROWS:
+				valid = np.zeros(CHUNK_ROWS, dtype=bool)
+				valid[:self.n_rows % CHUNK_ROWS] = True
+				bits &= np.packbits(valid, bitorder='little')
+			inverted = _normalize(bits)
+			if inverted is not None:
+				containers[chunk] = inverted
+		return RoaringBitmap(self.n_rows, containers)
+
+	def __sub__(self, other):
+		return self & ~other
+
+
+class Query:
+	"""
+	Expresión booleana sobre features y synsets, se combina con &, | y ~.
+	"""
+
+	def __and__(self, other):
+		return _Op('and', self, other)
+
+	def __or__(self, other):
+		return _Op('or', self, other)
+
+	def __invert__(self):
+		return _Op('not', self)
+
+
+class Feature(Query):
+	"""
+	Imágenes que tienen value (-1, 0 o 1) en la feature.
+	"""
+
+	def __init__(self, feature, value):
+		if value not in fne_core.CATEGORIES:
+			raise ValueError('value tiene que ser -1, 0 o 1, no ' + str(value))
+		self.feature = feature
+		self.value = value
+
+	def evaluate(self, index):
+		if self.value == 1:
+			return index.positive[self.feature]
+		if self.value == -1:
+			return index.negative[self.feature]
+		return ~(index.positive[self.feature] | index.negative[self.feature])
+
+
+class Synset(Query):
+	"""
+	Imágenes del synset, por defecto solo de sus hipónimos como get_index_from_ss.
+	"""
+
+	def __init__(self, offset, hyponyms_only=True):
+		self.offset = int(offset)
+		self.hyponyms_only = hyponyms_only
+
+	def evaluate(self, index):
+		return index.synset(self.offset, self.hyponyms_only)
+
+
+class _Op(Query):
+	def __init__(self, op, *args):
+		self.op = op
+		self.args = args
+
+	def evaluate(self, index):
+		if self.op == 'not':
+			return ~self.args[0].evaluate(index)
+		left = self.args[0].evaluate(index)
+		right = self.args[1].evaluate(index)
+		if self.op == 'and':
+			return left & right
+		return left | right
+
+
+class BitmapIndex:
+	"""
+	Attributes:
+		n_rows (int): cantidad de imágenes
+		positive (list): positive[feature] = RoaringBitmap de las imágenes con 1 en la feature
+		negative (list): negative[feature] = RoaringBitmap de las imágenes con -1 en la feature
+		labels (np.array): label de cada imagen
+		ids (IdTables): para pasar de offsets de synsets a labels
+		synset_cache (dict): synset_cache[(offset, hyponyms_only)] = RoaringBitmap
+	"""
+
+	def __init__(self, n_rows, positive, negative, labels, ids):
+		self.n_rows = n_rows
+		self.positive = positive
+		self.negative = negative
+		self.labels = labels
+		self.ids = ids
+		self.synset_cache = {}
+
+	@staticmethod
+	def index_path(version, layout_suffix=''):
+		"""
+		:param layout_suffix: data.layout_suffix, los números de fila dependen del orden de las filas
+		"""
+		return _bitmap_index_path + str(version) + layout_suffix + '/index.npz'
+
+	@classmethod
+	def build(cls, data):
+		"""
+		Un solo recorrido de dmatrix, de chunk en chunk de filas.
+		"""
+		n_rows, n_features = data.dmatrix.shape
+		positive = [RoaringBitmap(n_rows) for _ in range(n_features)]
+		negative = [RoaringBitmap(n_rows) for _ in range(n_features)]
+		for chunk in range((n_rows + CHUNK_ROWS - 1) >> CHUNK_BITS):
+			block = np.asarray(data.dmatrix[chunk * CHUNK_ROWS:(chunk + 1) * CHUNK_ROWS])
+			for value, bitmaps in ((1, positive), (-1, negative)):
+				# features en filas para que cada flatnonzero lea memoria contigua
+				hits = np.ascontiguousarray((block == value).T)
+				for feature in range(n_features):
+					rows = np.flatnonzero(hits[feature])
+					if rows.shape[0] > 0:
+						bitmaps[feature].containers[chunk] = _to_container(rows.astype(np.uint16))
+		return cls(n_rows, positive, negative, data.labels, data.ids)
+
+	def save(self, index_path):
+		"""
+		Todos los contenedores en dos blobs (arrays y bitmaps) y una tabla con dónde está cada uno.
+		"""
+		directory = path.dirname(index_path)
+		if not path.exists(directory):
+			makedirs(directory)
+		table = []
+		arrays = []
+		bitmaps = []
+		array_pos = 0
+		bitmap_pos = 0
+		for sign, bitmap_list in ((1, self.positive), (-1, self.negative)):
+			for feature, bitmap in enumerate(bitmap_list):
+				for chunk, container in sorted(bitmap.containers.items()):
+					if container.dtype == np.uint16:
+						table.append((sign, feature, chunk, 0, array_pos, container.shape[0]))
+						arrays.append(container)
+						array_pos += container.shape[0]
+					else:
+						table.append((sign, feature, chunk, 1, bitmap_pos, container.shape[0]))
+						bitmaps.append(container)
+						bitmap_pos += container.shape[0]
+		np.savez(index_path, n_rows=self.n_rows, n_features=len(self.positive),
+		         table=np.array(table, dtype=np.int64).reshape(-1, 6),
+		         arrays=np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.uint16),
+		         bitmaps=np.concatenate(bitmaps) if bitmaps else np.zeros(0, dtype=np.uint8))
+
+	@classmethod
+	def load(cls, index_path, data):
+		stored = np.load(index_path)
+		n_rows = int(stored['n_rows'])
+		n_features = int(stored['n_features'])
+		arrays = stored['arrays']
+		bitmaps = stored['bitmaps']
+		positive = [RoaringBitmap(n_rows) for _ in range(n_features)]
+		negative = [RoaringBitmap(n_rows) for _ in range(n_features)]
+		for sign, feature, chunk, kind, start, length in stored['table'].tolist():
+			blob = bitmaps if kind else arrays
+			target = positive if sign == 1 else negative
+			target[feature].containers[chunk] = blob[start:start + length]
+		return cls(n_rows, positive, negative, data.labels, data.ids)
+
+	@classmethod
+	def load_or_build(cls, data):
+		index_path = cls.index_path(data.version, data.layout_suffix)
+		if path.isfile(index_path):
+			return cls.load(index_path, data)
+		index = cls.build(data)
+		index.save(index_path)
+		return index
+
+	def synset(self, offset, hyponyms_only=True):
+		"""
+		RoaringBitmap de las imágenes del synset.
+		:param hyponyms_only: sin las imágenes del label del propio synset, como get_index_from_ss
+		"""
+		key = (int(offset), hyponyms_only)
+		if key not in self.synset_cache:
+			dag = hierarchy.get_hyponym_dag()
+			offsets = dag.hyponym_offsets(offset) if hyponyms_only else dag.descendants(offset)
+			synset_labels = self.ids.labels_of_offsets(offsets)
+			rows = fne_core.rows_of_labels(self.labels, synset_labels, len(self.ids))
+			self.synset_cache[key] = RoaringBitmap.from_rows(rows, self.n_rows)
+		return self.synset_cache[key]
+
+	def evaluate(self, query):
+		return query.evaluate(self)
+
+	def count(self, query):
+		"""
+		:return: cantidad de imágenes que cumplen query
+		"""
+		return len(self.evaluate(query))
+
+	def rows(self, query):
+		"""
+		:return: np array ordenado con las filas de dmatrix que cumplen query
+		"""
+		return self.evaluate(query).rows()
+
+	def rows_without_zero(self):
+		"""
+		Imágenes que no tienen ningún 0, es decir, que tienen 1 o -1 en todas las features.
+		"""
+		result = ~RoaringBitmap(self.n_rows)
+		for feature in range(len(self.positive)):
+			result = result & (self.positive[feature] | self.negative[feature])
+			if len(result.containers) == 0:
+				break
+		return result.rows()
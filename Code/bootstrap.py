@@ -0,0 +1,187 @@
+"""
+Bootstrap confidence intervals for the distances between synset representatives
+(NEW_distance_between_synsets_reps, fne_core.ones_distance).
+
+Every replicate is built from the per-label count arrays of the atlas, never from the matrix:
+	'label'  two levels: each ImageNet label gets a Poisson(1) weight w (Poisson bootstrap of the labels) and
+	         then its images are resampled, w * size draws from the label's per-feature proportions (the sum of
+	         w multinomial resamples of the label). The same label resamples are used for all synsets of a
+	         replicate, so a synset and its hypernym, which share images, are resampled consistently, and a
+	         synset with a single label still varies. The counts of every synset are one matrix product of the
+	         label membership with the resampled label counts.
+	'image'  the images of each synset are resampled: the per-feature category counts of a resample follow a
+	         multinomial with the synset's proportions, drawn as two binomials. Each feature is drawn
+	         independently of the others (the correlation between features of the same images is lost) and
+	         each synset independently of its hypernyms.
+'image' is the default. With 'label' a synset that covers few labels loses all of them in a good part of the
+replicates (a weight is 0 with probability 1/e), so it is only useful for synsets with many labels.
+In both methods the categories of a feature are drawn as two binomials: -1 with p(-1), and 0 among the rest
+with p(0) / (1 - p(-1)).
+
+Representatives and distances are computed for a batch of replicates at once, and batches run on a pool of
+threads (the matrix products release the GIL).
+"""
+import warnings
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from Code import fne_core
+
+METHODS = ('image', 'label')
+CI_DTYPE = np.dtype([('first', np.int64), ('second', np.int64), ('distance', np.float64), ('low', np.float64),
+                     ('high', np.float64), ('std', np.float64), ('valid', np.float64)])
+
+
+def _ones_from_margins(margins):
+	"""
+	La moda es 1 si el conteo de 1 supera estrictamente los de -1 y 0 (los empates van a la categoría menor).
+	:param margins: [..., features, 2] con (c1 - c_-1, c1 - c0)
+	"""
+	return (margins[..., 0] > 0) & (margins[..., 1] > 0)
+
+
+def _split_proportions(counts):
+	"""
+	:param counts: [..., features, 3] conteos de -1, 0 y 1
+	:return: (p(-1), p(0) / (1 - p(-1))) para sacar los conteos como dos binomiales, 0 donde no hay imágenes
+	"""
+	counts = counts.astype(np.float64)
+	sizes = counts.sum(axis=-1)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		p_neg = np.where(sizes > 0, counts[..., 0] / sizes, 0.0)
+		rest = sizes - counts[..., 0]
+		p_zero_rest = np.where(rest > 0, counts[..., 1] / rest, 0.0)
+	return np.clip(p_neg, 0, 1), np.clip(p_zero_rest, 0, 1)
+
+
+def _pair_distances(ones, valid, first, second):
+	"""
+	ones_distance de los pares para un lote de réplicas.
+	:param ones: bool [réplicas, synsets, features]
+	:param valid: bool [réplicas, synsets]
+	:return: float [réplicas, pares], nan donde algún representante está vacío
+	"""
+	ones_f = ones.astype(np.float32)
+	ones_count = ones_f.sum(axis=-1)
+	# los 1 compartidos de todos los pares de synsets de cada réplica, sin copiar las filas de cada par
+	shared = np.empty((ones.shape[0], first.shape[0]), dtype=np.float32)
+	for r in range(ones.shape[0]):
+		shared[r] = (ones_f[r] @ ones_f[r].T)[first, second]
+	total = ones_count[:, first] + ones_count[:, second]
+	with np.errstate(divide='ignore', invalid='ignore'):
+		distance = 1 - shared / (total - shared)
+	return np.where(valid[:, first] & valid[:, second], distance, np.nan)
+
+
+class _LabelResampler:
+	def __init__(self, atlas, offsets):
+		membership = atlas.membership_of(offsets, hyponyms_only=True)
+		self.labels = np.flatnonzero(membership.any(axis=0))
+		self.membership = membership[:, self.labels].astype(np.float64)
+		label_counts = np.asarray(atlas.label_counts[self.labels], dtype=np.int64)
+		self.n_features = label_counts.shape[1]
+		self.sizes = label_counts[:, 0, :].sum(axis=-1)
+		self.p_neg, self.p_zero_rest = _split_proportions(label_counts)
+
+	def replicates(self, random, n):
+		weights = random.poisson(1.0, size=(n, self.labels.shape[0]))
+		ones = np.empty((n, self.membership.shape[0], self.n_features), dtype=bool)
+		valid = np.empty((n, self.membership.shape[0]), dtype=bool)
+		for r in range(n):
+			trials = np.broadcast_to((weights[r] * self.sizes)[:, np.newaxis], self.p_neg.shape)
+			negones = random.binomial(trials, self.p_neg)
+			zeros = random.binomial(trials - negones, self.p_zero_rest)
+			label_ones = trials - negones - zeros
+			# solo hace falta c1 - c_-1 y c1 - c0 de cada synset para saber si la moda es 1
+			margins = np.stack([label_ones - negones, label_ones - zeros], axis=-1).reshape(self.labels.shape[0], -1)
+			margins = (self.membership @ margins.astype(np.float64)).reshape(-1, self.n_features, 2)
+			ones[r] = _ones_from_margins(margins)
+			valid[r] = self.membership @ (weights[r] * self.sizes) > 0
+		return ones, valid
+
+
+class _ImageResampler:
+	def __init__(self, atlas, offsets):
+		counts = np.zeros((len(offsets), atlas.counts.shape[1], 3), dtype=np.int64)
+		for i, offset in enumerate(offsets):
+			node = atlas.node_counts(offset, hyponyms_only=True)
+			if node is not None:
+				counts[i] = node
+		self.sizes = counts[:, :1, :].sum(axis=-1)
+		self.p_neg, self.p_zero_rest = _split_proportions(counts)
+		self.valid = self.sizes[:, 0] > 0
+
+	def replicates(self, random, n):
+		shape = (n,) + self.p_neg.shape
+		negones = random.binomial(np.broadcast_to(self.sizes, shape), np.broadcast_to(self.p_neg, shape))
+		zeros = random.binomial(self.sizes - negones, np.broadcast_to(self.p_zero_rest, shape))
+		ones = self.sizes - negones - zeros
+		return (ones > negones) & (ones > zeros), np.broadcast_to(self.valid, (n,) + self.valid.shape)
+
+
+def bootstrap_pairs(atlas, first, second, n_boot=1000, method='image', alpha=0.05, workers=4, batch=25, seed=0,
+                    min_valid=0.9):
+	"""
+	Intervalos de confianza percentil de la distancia entre first[i] y second[i].
+	:param atlas: Atlas de la versión
+	:param first, second: offsets de los pares
+	:param n_boot: cantidad de réplicas
+	:param method: uno de METHODS
+	:param alpha: el intervalo es del (1 - alpha) * 100 %
+	:param workers: hilos que calculan lotes de réplicas a la vez
+	:param batch: réplicas por lote
+	:param min_valid: si la proporción de réplicas válidas de un par es menor, su intervalo se deja en nan (las
+		réplicas que quedan no son una muestra del bootstrap, sino las que han tenido suerte)
+	:return: array con CI_DTYPE, distance es la del representante de todas las imágenes y valid la proporción de
+		réplicas en las que los dos representantes no están vacíos
+	"""
+	first = np.asarray(first, dtype=np.int64)
+	second = np.asarray(second, dtype=np.int64)
+	nodes, inverse = np.unique(np.concatenate([first, second]), return_inverse=True)
+	pair_first = inverse[:first.shape[0]]
+	pair_second = inverse[first.shape[0]:]
+	if method == 'label':
+		resampler = _LabelResampler(atlas, nodes)
+	elif method == 'image':
+		resampler = _ImageResampler(atlas, nodes)
+	else:
+		raise ValueError('method tiene que ser uno de ' + str(METHODS) + ', no ' + str(method))
+
+	def run(job):
+		job_seed, n = job
+		ones, valid = resampler.replicates(np.random.RandomState(job_seed), n)
+		return _pair_distances(ones, valid, pair_first, pair_second)
+
+	jobs = [(seed + i, min(batch, n_boot - start)) for i, start in enumerate(range(0, n_boot, batch))]
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		distances = np.concatenate(list(pool.map(run, jobs)), axis=0)
+
+	reps = np.zeros((nodes.shape[0], atlas.counts.shape[1]), dtype=np.int8)
+	valid = np.zeros(nodes.shape[0], dtype=bool)
+	for i, offset in enumerate(nodes.tolist()):
+		rep = atlas.representative(offset, hyponyms_only=True)
+		if len(rep) > 0:
+			reps[i] = rep
+			valid[i] = True
+	result = np.zeros(first.shape[0], dtype=CI_DTYPE)
+	result['first'] = first
+	result['second'] = second
+	point = fne_core.ones_distance_pairs(reps, valid, pair_first, pair_second)
+	result['distance'] = np.where(point == 9999, np.nan, point)
+	with warnings.catch_warnings():
+		# los pares sin ninguna réplica válida se quedan en nan
+		warnings.simplefilter('ignore', RuntimeWarning)
+		result['low'] = np.nanpercentile(distances, 100 * alpha / 2, axis=0)
+		result['high'] = np.nanpercentile(distances, 100 * (1 - alpha / 2), axis=0)
+		result['std'] = np.nanstd(distances, axis=0)
+	result['valid'] = np.mean(np.isfinite(distances), axis=0)
+	unreliable = result['valid'] < min_valid
+	for field in ('low', 'high', 'std'):
+		result[field][unreliable] = np.nan
+	return result
+
+
+def bootstrap_edges(atlas, edges, **kwargs):
+	"""
+	bootstrap_pairs de las aristas (hierarchy.EDGE_DTYPE) de un subárbol, por ejemplo las de subtree_edges.
+	"""
+	return bootstrap_pairs(atlas, edges['parent'], edges['child'], **kwargs)
@@ -0,0 +1,132 @@
+"""
+Checkpoints for the generators and traversals that take hours.
+
+A Checkpoint keeps a snapshot of the partial results together with a cursor (how many work items are done).
+Snapshots are written to a temporary file and moved over the previous one with os.replace, so a run killed
+in the middle of a write still finds the last complete snapshot. When the job is started again it resumes
+from the cursor, and the checkpoint is removed once the final result has been saved.
+"""
+import _pickle as pickle
+import os
+import time
+import datetime
+from os import path
+
+
+class Progress:
+	"""
+	Imprime el avance y el tiempo estimado que falta.
+
+	Attributes:
+		total (int): cantidad de elementos de trabajo
+		start (int): elementos que ya estaban hechos al empezar (al reanudar no cuentan para la velocidad)
+	"""
+
+	def __init__(self, total, start=0, name='', every_seconds=30):
+		self.total = total
+		self.start = start
+		self.name = name
+		self.every_seconds = every_seconds
+		self.ini_time = time.time()
+		self.last_print = 0
+
+	def eta(self, done):
+		"""
+		:return: timedelta que falta, None si todavía no se puede estimar
+		"""
+		if done <= self.start:
+			return None
+		per_item = (time.time() - self.ini_time) / (done - self.start)
+		return datetime.timedelta(seconds=int(per_item * (self.total - done)))
+
+	def update(self, done, force=False):
+		now = time.time()
+		if not force and now - self.last_print < self.every_seconds:
+			return
+		self.last_print = now
+		percent = 100 * done / self.total if self.total else 100
+		print(self.name + ' [' + str(done) + '/' + str(self.total) + '] ' + '%.1f' % percent + '% falta',
+		      self.eta(done))
+
+
+class Checkpoint:
+	"""
+	Attributes:
+		checkpoint_path (str): fichero del snapshot
+		total (int): cantidad de elementos de trabajo, None si solo se sabe después de empezar (se toma del
+			snapshot al reanudar)
+		every_items (int): guarda como mucho cada every_items elementos...
+		every_seconds (float): ...o cada every_seconds segundos, lo que pase antes
+	"""
+
+	def __init__(self, checkpoint_path, total, every_items=None, every_seconds=300, name=''):
+		self.checkpoint_path = checkpoint_path
+		self.total = total
+		self.every_items = every_items
+		self.every_seconds = every_seconds
+		self.name = name
+		self.cursor = 0
+		self.last_save_cursor = 0
+		self.last_save_time = time.time()
+		self.progress = None
+
+	def load(self, default=None):
+		"""
+		Carga el último snapshot si existe.
+		:param default: estado inicial si no hay checkpoint
+		:return: (cursor, state)
+		"""
+		cursor, state = 0, default
+		if path.isfile(self.checkpoint_path):
+			with open(self.checkpoint_path, 'rb') as handle:
+				snapshot = pickle.load(handle)
+			if self.total is None or snapshot['total'] == self.total:
+				self.total = snapshot['total']
+				cursor, state = snapshot['cursor'], snapshot['state']
+				print('Reanudando ' + self.name + ' desde ' + str(cursor) + '/' + str(self.total))
+			else:
+				print('Checkpoint de ' + self.name + ' con otro total, se empieza de cero')
+		self.cursor = self.last_save_cursor = cursor
+		if self.total is not None:
+			self.progress = Progress(self.total, cursor, self.name)
+		return cursor, state
+
+	def save(self, cursor, state):
+		"""
+		Escribe el snapshot de forma atómica.
+		"""
+		directory = path.dirname(self.checkpoint_path)
+		if directory and not path.exists(directory):
+			os.makedirs(directory)
+		tmp_path = self.checkpoint_path + '.tmp'
+		with open(tmp_path, 'wb') as handle:
+			pickle.dump({'cursor': cursor, 'total': self.total, 'state': state}, handle)
+			handle.flush()
+			os.fsync(handle.fileno())
+		os.replace(tmp_path, self.checkpoint_path)
+		self.last_save_cursor = cursor
+		self.last_save_time = time.time()
+
+	def step(self, cursor, state):
+		"""
+		Marca cursor elementos como hechos, guarda si toca e imprime el avance.
+		:param state: resultados parciales hasta cursor (solo se serializa al guardar)
+		"""
+		self.cursor = cursor
+		due_items = self.every_items is not None and cursor - self.last_save_cursor >= self.every_items
+		due_time = time.time() - self.last_save_time >= self.every_seconds
+		if due_items or due_time:
+			self.save(cursor, state)
+		if self.progress is None:
+			self.progress = Progress(self.total, 0, self.name)
+		self.progress.update(cursor)
+
+	def done(self):
+		"""
+		Borra el checkpoint, llamar después de guardar el resultado final.
+		"""
+		if self.progress is not None:
+			self.progress.update(self.total, force=True)
+		for leftover in (self.checkpoint_path, self.checkpoint_path + '.tmp'):
+			if path.isfile(leftover):
+				os.remove(leftover)
@@ -0,0 +1,401 @@
+"""
+Agglomerative clustering of the synset representatives and its comparison with the WordNet hypernym tree.
+
+The distance between two synsets is NEW_distance_between_synsets_reps (fne_core.ones_distance). The
+pairwise distances are kept as a condensed float32 matrix memory-mapped on disk, so tens of thousands of
+synsets fit, and average linkage is computed with the nearest-neighbour chain algorithm, which only needs
+one row of the matrix at a time and updates it in place.
+
+The dendrogram is compared with WordNet in two ways:
+	- cophenetic correlation: correlation between the height at which two synsets are joined in the dendrogram
+	  and their shortest path distance in WordNet, over a random sample of pairs
+	- adjusted Rand index between the flat clusters of the dendrogram and the partition given by the
+	  hypernyms at a fixed depth of WordNet
+
+Everything is saved under Data/Clustering/<version>/ and loaded from there the next time.
+"""
+import json
+import os
+import shutil
+import numpy as np
+from os import path
+from os import makedirs
+from Code import hierarchy
+
+_clustering_path = '../Data/Clustering/'
+
+
+def condensed_index(n, i, j):
+	"""
+	Posición del par (i, j), i < j, en la matriz condensada de n elementos (el orden de scipy).
+	"""
+	return n * i - i * (i + 1) // 2 + (j - i - 1)
+
+
+def condensed_size(n):
+	return n * (n - 1) // 2
+
+
+def representative_distances(reps, distances_path=None, chunk=512):
+	"""
+	Matriz condensada de ones_distance entre todos los representantes.
+	:param reps: int8 [n, features], todos con al menos un 1
+	:param distances_path: si no es None la matriz se escribe en un .npy mapeado en memoria
+	:return: float32 [n * (n - 1) / 2]
+	"""
+	ones = (np.asarray(reps) == 1).astype(np.float32)
+	ones_count = ones.sum(axis=1)
+	n = ones.shape[0]
+	if distances_path is None:
+		condensed = np.empty(condensed_size(n), dtype=np.float32)
+	else:
+		condensed = np.lib.format.open_memmap(distances_path, mode='w+', dtype=np.float32,
+		                                      shape=(condensed_size(n),))
+	for start in range(0, n, chunk):
+		shared = ones[start:start + chunk] @ ones.T
+		total = ones_count[start:start + chunk, np.newaxis] + ones_count[np.newaxis, :]
+		block = 1 - shared / (total - shared)
+		for i in range(start, min(start + chunk, n - 1)):
+			begin = condensed_index(n, i, i + 1)
+			condensed[begin:begin + n - i - 1] = block[i - start, i + 1:]
+	if distances_path is not None:
+		condensed.flush()
+	return condensed
+
+
+class _CondensedRows:
+	"""
+	Acceso por filas a una matriz condensada, para leer y escribir todas las distancias de un elemento.
+	"""
+
+	def __init__(self, condensed, n):
+		self.condensed = condensed
+		self.n = n
+		self.all = np.arange(n, dtype=np.int64)
+
+	def positions(self, i):
+		j = self.all
+		low = np.minimum(i, j)
+		high = np.maximum(i, j)
+		positions = self.n * low - low * (low + 1) // 2 + (high - low - 1)
+		positions[i] = 0
+		return positions
+
+	def row(self, i):
+		row = self.condensed[self.positions(i)].astype(np.float64)
+		row[i] = np.inf
+		return row
+
+
+def nn_chain_average(condensed, n):
+	"""
+	Average linkage (UPGMA) con el algoritmo de la cadena de vecinos más cercanos. La matriz condensada se
+	modifica: al unir dos clusters las distancias del nuevo se escriben en el sitio del primero.
+	:return: linkage [n - 1, 4] con el mismo formato que scipy.cluster.hierarchy.linkage
+	"""
+	rows = _CondensedRows(condensed, n)
+	active = np.ones(n, dtype=bool)
+	size = np.ones(n, dtype=np.int64)
+	merges = []
+	chain = []
+	for _ in range(n - 1):
+		if len(chain) == 0:
+			chain.append(int(np.flatnonzero(active)[0]))
+		while True:
+			a = chain[-1]
+			row = rows.row(a)
+			row[~active] = np.inf
+			b = int(np.argmin(row))
+			# con empates se prefiere el anterior de la cadena, así siempre termina
+			if len(chain) > 1 and row[chain[-2]] == row[b]:
+				b = chain[-2]
+			if len(chain) > 1 and b == chain[-2]:
+				break
+			chain.append(b)
+		chain.pop()
+		chain.pop()
+		distance = row[b]
+		a, b = min(a, b), max(a, b)
+		merges.append((a, b, distance, size[a] + size[b]))
+		positions_a = rows.positions(a)
+		row_b = rows.row(b)
+		row_a = rows.row(a)
+		updated = (size[a] * row_a + size[b] * row_b) / (size[a] + size[b])
+		others = np.flatnonzero(active)
+		others = others[(others != a) & (others != b)]
+		condensed[positions_a[others]] = updated[others]
+		active[b] = False
+		size[a] += size[b]
+	return _relabel(merges, n)
+
+
+def _relabel(merges, n):
+	"""
+	Ordena las uniones por altura y les da los ids de cluster de scipy (n + número de unión).
+	"""
+	merges = sorted(merges, key=lambda m: m[2])
+	parent = np.arange(n, dtype=np.int64)
+	cluster_id = np.arange(n, dtype=np.int64)
+
+	def find(x):
+		while parent[x] != x:
+			parent[x] = parent[parent[x]]
+			x = parent[x]
+		return x
+
+	linkage = np.zeros((n - 1, 4), dtype=np.float64)
+	for k, (a, b, distance, count) in enumerate(merges):
+		ra = find(a)
+		rb = find(b)
+		linkage[k] = [min(cluster_id[ra], cluster_id[rb]), max(cluster_id[ra], cluster_id[rb]), distance, count]
+		parent[rb] = ra
+		cluster_id[ra] = n + k
+	return linkage
+
+
+def flat_clusters(linkage, k):
+	"""
+	Corta el dendrograma en k clusters.
+	:return: label del cluster (0..k-1) de cada elemento
+	"""
+	n = linkage.shape[0] + 1
+	parent = np.arange(2 * n - 1, dtype=np.int64)
+	for step in range(n - k):
+		a, b = int(linkage[step, 0]), int(linkage[step, 1])
+		parent[a] = n + step
+		parent[b] = n + step
+	roots = np.arange(n, dtype=np.int64)
+	while True:
+		up = parent[roots]
+		if np.array_equal(up, roots):
+			break
+		roots = up
+	return np.unique(roots, return_inverse=True)[1]
+
+
+def cophenetic_of_pairs(linkage, first, second):
+	"""
+	Altura a la que se unen first[q] y second[q] en el dendrograma, para una lista de pares.
+	Se repiten las uniones en orden moviendo siempre el cluster pequeño al grande, y cada consulta se mira
+	solo cuando se mueve uno de sus elementos.
+	"""
+	n = linkage.shape[0] + 1
+	first = np.asarray(first, dtype=np.int64)
+	second = np.asarray(second, dtype=np.int64)
+	height = np.full(first.shape[0], np.nan)
+	queries = [[] for _ in range(n)]
+	for q, (i, j) in enumerate(zip(first.tolist(), second.tolist())):
+		if i == j:
+			height[q] = 0.0
+		else:
+			queries[i].append((q, j))
+			queries[j].append((q, i))
+	# cada cluster guarda sus elementos en la lista de uno de ellos (key), la del grande al unir dos
+	group_of = np.arange(n, dtype=np.int64)
+	members = {i: [i] for i in range(n)}
+	key_of = {i: i for i in range(n)}
+	for step in range(n - 1):
+		ka = key_of.pop(int(linkage[step, 0]))
+		kb = key_of.pop(int(linkage[step, 1]))
+		small, large = (ka, kb) if len(members[ka]) <= len(members[kb]) else (kb, ka)
+		for element in members[small]:
+			for q, other in queries[element]:
+				if np.isnan(height[q]) and group_of[other] == large:
+					height[q] = linkage[step, 2]
+		moved = members.pop(small)
+		group_of[moved] = large
+		members[large].extend(moved)
+		key_of[n + step] = large
+	return height
+
+
+def adjusted_rand_index(labels_a, labels_b):
+	"""
+	Adjusted Rand index entre dos particiones de los mismos elementos.
+	"""
+	_, a = np.unique(labels_a, return_inverse=True)
+	_, b = np.unique(labels_b, return_inverse=True)
+	table = np.zeros((a.max() + 1, b.max() + 1), dtype=np.int64)
+	np.add.at(table, (a, b), 1)
+
+	def pairs(x):
+		return (x * (x - 1) // 2).sum()
+
+	index = pairs(table)
+	sum_a = pairs(table.sum(axis=1))
+	sum_b = pairs(table.sum(axis=0))
+	total = pairs(np.array([a.shape[0]]))
+	expected = sum_a * sum_b / total if total else 0.0
+	maximum = (sum_a + sum_b) / 2
+	if maximum == expected:
+		return 1.0
+	return float((index - expected) / (maximum - expected))
+
+
+class WordNetDistances:
+	"""
+	Distancia de camino más corto entre synsets de WordNet (como synset.shortest_path_distance) con los
+	hiperónimos del HyponymDag. Las distancias a los ancestros de cada synset se calculan una vez.
+	"""
+
+	def __init__(self, dag=None):
+		self.dag = dag if dag is not None else hierarchy.get_hyponym_dag()
+		self.ancestors_memo = {}
+
+	def ancestors(self, offset):
+		"""
+		:return: dict ancestro -> distancia mínima, incluido el propio offset a distancia 0
+		"""
+		if offset not in self.ancestors_memo:
+			distances = {offset: 0}
+			frontier = [offset]
+			while frontier:
+				following = []
+				for node in frontier:
+					for parent in self.dag.get_parents(node):
+						if parent not in distances:
+							distances[parent] = distances[node] + 1
+							following.append(parent)
+				frontier = following
+			self.ancestors_memo[offset] = distances
+		return self.ancestors_memo[offset]
+
+	def distance(self, a, b):
+		da = self.ancestors(int(a))
+		db = self.ancestors(int(b))
+		if len(da) > len(db):
+			da, db = db, da
+		common = [da[x] + db[x] for x in da if x in db]
+		return min(common) if common else np.nan
+
+	def depth(self, offset):
+		"""
+		:return: distancia mínima de offset a una raíz (un ancestro sin hiperónimos)
+		"""
+		return min(d for a, d in self.ancestors(int(offset)).items() if not self.dag.get_parents(a))
+
+	def partition(self, offsets, depth):
+		"""
+		Agrupa los synsets por su hiperónimo a profundidad depth desde la raíz (por el camino más corto),
+		los que están más arriba forman su propio grupo.
+		"""
+		groups = []
+		for offset in offsets:
+			ancestors = self.ancestors(int(offset))
+			own_depth = self.depth(offset)
+			# con varios hiperónimos el camino más largo no da la profundidad: el ancestro tiene que estar a depth
+			# de la raíz y en un camino más corto del synset a la raíz
+			candidates = [a for a, d in ancestors.items() if d + depth == own_depth and self.depth(a) == depth]
+			groups.append(min(candidates) if candidates else int(offset))
+		return np.array(groups, dtype=np.int64)
+
+
+class Clustering:
+	"""
+	Attributes:
+		offsets (np.array): synsets agrupados, en el orden de las filas de linkage
+		linkage (np.array): [n - 1, 4] formato de scipy
+		metrics (dict): comparación con WordNet
+	"""
+
+	def __init__(self, offsets, linkage, metrics=None):
+		self.offsets = offsets
+		self.linkage = linkage
+		self.metrics = metrics if metrics is not None else {}
+
+	@staticmethod
+	def clustering_dir(version):
+		return _clustering_path + str(version) + '/'
+
+	@classmethod
+	def build(cls, reps, offsets, clustering_dir):
+		"""
+		:param reps: int8 [n, features], representantes válidos (con algún 1)
+		:param offsets: offset de cada representante
+		"""
+		if not path.exists(clustering_dir):
+			makedirs(clustering_dir)
+		distances_path = clustering_dir + 'distances.npy'
+		work_path = clustering_dir + 'distances_work.npy'
+		representative_distances(reps, distances_path)
+		# nn_chain_average sobrescribe la matriz, trabaja sobre una copia para poder reutilizar distances.npy
+		shutil.copyfile(distances_path, work_path)
+		condensed = np.load(work_path, mmap_mode='r+')
+		linkage = nn_chain_average(condensed, len(offsets))
+		del condensed
+		os.remove(work_path)
+		return cls(np.asarray(offsets, dtype=np.int64), linkage)
+
+	def compare_with_wordnet(self, n_pairs=20000, depths=(3, 4, 5, 6), seed=0, wordnet=None):
+		"""
+		:param n_pairs: pares aleatorios para la correlación cofenética
+		:param depths: profundidades de WordNet para el ARI, el dendrograma se corta en tantos clusters como
+			grupos haya a esa profundidad
+		:return: metrics
+		"""
+		wordnet = wordnet if wordnet is not None else WordNetDistances()
+		n = self.offsets.shape[0]
+		random = np.random.RandomState(seed)
+		first = random.randint(0, n, n_pairs)
+		second = random.randint(0, n, n_pairs)
+		keep = first != second
+		first, second = first[keep], second[keep]
+		cophenetic = cophenetic_of_pairs(self.linkage, first, second)
+		path_distance = np.array([wordnet.distance(self.offsets[i], self.offsets[j])
+		                          for i, j in zip(first.tolist(), second.tolist())], dtype=np.float64)
+		valid = np.isfinite(path_distance) & np.isfinite(cophenetic)
+		self.metrics = {'pairs': int(valid.sum()),
+		                'cophenetic_pearson': float(np.corrcoef(cophenetic[valid], path_distance[valid])[0, 1]),
+		                'cophenetic_spearman': float(np.corrcoef(_ranks(cophenetic[valid]),
+		                                                         _ranks(path_distance[valid]))[0, 1]),
+		                'ari': {}}
+		for depth in depths:
+			groups = wordnet.partition(self.offsets, depth)
+			k = int(np.unique(groups).shape[0])
+			k = min(max(k, 1), n)
+			self.metrics['ari'][str(depth)] = {'clusters': k, 'ari': adjusted_rand_index(
+				flat_clusters(self.linkage, k), groups)}
+		return self.metrics
+
+	def save(self, clustering_dir):
+		np.save(clustering_dir + 'offsets.npy', self.offsets)
+		np.save(clustering_dir + 'linkage.npy', self.linkage)
+		with open(clustering_dir + 'metrics.json', 'w') as f:
+			json.dump(self.metrics, f, indent=4)
+
+	@classmethod
+	def load(cls, clustering_dir):
+		with open(clustering_dir + 'metrics.json') as f:
+			metrics = json.load(f)
+		return cls(np.load(clustering_dir + 'offsets.npy'), np.load(clustering_dir + 'linkage.npy'), metrics)
+
+	@classmethod
+	def load_or_build(cls, data):
+		"""
+		Clustering de todos los synsets del atlas con representante (solo hipónimos, como
+		get_represention_fast), con las métricas contra WordNet.
+		"""
+		clustering_dir = cls.clustering_dir(data.version)
+		if path.isfile(clustering_dir + 'metrics.json'):
+			return cls.load(clustering_dir)
+		atlas = data.get_atlas()
+		offsets = []
+		reps = []
+		for offset in atlas.offsets.tolist():
+			rep = atlas.representative(offset, hyponyms_only=True)
+			if len(rep) > 0 and np.any(np.equal(rep, 1)):
+				offsets.append(offset)
+				reps.append(rep)
+		clustering = cls.build(np.array(reps, dtype=np.int8), offsets, clustering_dir)
+		clustering.compare_with_wordnet()
+		clustering.save(clustering_dir)
+		return clustering
+
+
+def _ranks(values):
+	"""
+	Rangos con los empates promediados, para la correlación de Spearman.
+	"""
+	_, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+	ends = np.cumsum(counts)
+	return ((ends - counts + ends - 1) / 2)[inverse]
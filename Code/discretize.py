@@ -0,0 +1,272 @@
+"""
+Discretization of the continuous full-network embedding into a new ternary version.
+
+The continuous embedding (vgg16_ImageNet_ALLlayers_C1avg_imagenet_train.npz, array 'data_matrix') is read in
+chunks of rows, straight from the zip, so it never has to fit in memory. Two passes:
+	1. per-feature mean and standard deviation, chunk statistics merged with Chan's formula
+	2. z = (x - mean) / std and ternary thresholds: 1 if z > sp, -1 if z < -n, 0 otherwise
+Both passes process the chunks on a pool of threads with a bounded number of chunks in flight, and the
+result is written as an int8 .npy. The statistics are kept next to the embedding, so other sp/n values only
+need the second pass. The new version is added to the registry (versions.json) that Data reads.
+"""
+import argparse
+import json
+import os
+import shutil
+import zipfile
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+from Code.atlas import Atlas
+from Code.bitmap_index import BitmapIndex
+from Code.feature_correlation import FeatureCorrelation
+
+EMBEDDINGS_DIR = '../Data/Embeddings/'
+CONTINUOUS_PATH = EMBEDDINGS_DIR + 'vgg16_ImageNet_ALLlayers_C1avg_imagenet_train.npz'
+REGISTRY_PATH = EMBEDDINGS_DIR + 'versions.json'
+# versiones que ya venían calculadas, la versión es n * 100
+BUILTIN_VERSIONS = {
+	19: {'file': 'vgg16_ImageNet_imagenet_C1avg_E_FN_KSBsp0.11n0.19_Gall_train_.npy', 'sp': 0.11, 'n': 0.19},
+	25: {'file': 'vgg16_ImageNet_imagenet_C1avg_E_FN_KSBsp0.15n0.25_Gall_train_.npy', 'sp': 0.15, 'n': 0.25},
+	31: {'file': 'vgg16_ImageNet_imagenet_C1avg_E_FN_KSBsp0.19n0.31_Gall_train_.npy', 'sp': 0.19, 'n': 0.31},
+}
+DEFAULT_VERSION = 25
+
+
+def embedding_name(sp, n):
+	return 'vgg16_ImageNet_imagenet_C1avg_E_FN_KSBsp' + '%g' % sp + 'n' + '%g' % n + '_Gall_train_.npy'
+
+
+def load_registry(registry_path=REGISTRY_PATH):
+	"""
+	:return: dict version -> {'file', 'sp', 'n', ...}, con las versiones de BUILTIN_VERSIONS y las registradas
+	"""
+	versions = dict(BUILTIN_VERSIONS)
+	if path.isfile(registry_path):
+		with open(registry_path) as f:
+			versions.update({int(v): entry for v, entry in json.load(f).items()})
+	return versions
+
+
+def register_version(version, entry, registry_path=REGISTRY_PATH):
+	registered = {}
+	if path.isfile(registry_path):
+		with open(registry_path) as f:
+			registered = json.load(f)
+	registered[str(version)] = entry
+	tmp_path = registry_path + '.tmp'
+	with open(tmp_path, 'w') as f:
+		json.dump(registered, f, indent=1, sort_keys=True)
+	os.replace(tmp_path, registry_path)
+
+
+def version_entry(version, registry_path=REGISTRY_PATH):
+	"""
+	:return: la entrada del registro de version, None si no existe
+	"""
+	return load_registry(registry_path).get(version)
+
+
+class RowReader:
+	"""
+	Lee un array 2D de un .npz (comprimido o no) o de un .npy por trozos de filas, sin cargarlo entero.
+
+	Attributes:
+		source_path (str): .npz o .npy
+		key (str): nombre del array dentro del .npz
+		shape (tuple), dtype (np.dtype): los del array
+	"""
+
+	def __init__(self, source_path, key='data_matrix'):
+		self.source_path = source_path
+		self.key = key
+		with self._open() as f:
+			self.shape, self.dtype, _ = self._read_header(f)
+
+	def _open(self):
+		if self.source_path.endswith('.npz'):
+			archive = zipfile.ZipFile(self.source_path)
+			member = archive.open(self.key + '.npy')
+			# al cerrar el miembro se cierra también el zip
+			close = member.close
+			member.close = lambda: (close(), archive.close())
+			return member
+		return open(self.source_path, 'rb')
+
+	@staticmethod
+	def _read_header(f):
+		major, _ = np.lib.format.read_magic(f)
+		if major == 1:
+			shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+		else:
+			shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+		if fortran_order or len(shape) != 2:
+			raise ValueError('Hace falta una matriz 2D en orden C, no ' + str(shape))
+		return shape, dtype, fortran_order
+
+	def chunks(self, chunk_rows):
+		"""
+		:return: generador de (start, chunk) con chunk = filas start:start + chunk_rows
+		"""
+		row_bytes = self.shape[1] * self.dtype.itemsize
+		with self._open() as f:
+			self._read_header(f)
+			for start in range(0, self.shape[0], chunk_rows):
+				n = min(chunk_rows, self.shape[0] - start)
+				buffer = f.read(n * row_bytes)
+				if len(buffer) != n * row_bytes:
+					raise IOError(self.source_path + ' está truncado en la fila ' + str(start))
+				yield start, np.frombuffer(buffer, dtype=self.dtype).reshape(n, self.shape[1])
+
+
+def bounded_map(func, items, workers):
+	"""
+	pool.map con como mucho 2 * workers elementos a la vez en memoria, los resultados en orden.
+	"""
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		pending = []
+		for item in items:
+			pending.append(pool.submit(func, item))
+			if len(pending) >= 2 * workers:
+				yield pending.pop(0).result()
+		for future in pending:
+			yield future.result()
+
+
+def _chunk_moments(item):
+	_, chunk = item
+	chunk = chunk.astype(np.float64)
+	mean = chunk.mean(axis=0)
+	return chunk.shape[0], mean, ((chunk - mean) ** 2).sum(axis=0)
+
+
+def feature_stats(reader, chunk_rows=2048, workers=4):
+	"""
+	Media y desviación estándar de cada feature en una pasada.
+	:return: (mean, std) float64 [features]
+	"""
+	n = 0
+	mean = np.zeros(reader.shape[1])
+	m2 = np.zeros(reader.shape[1])
+	for chunk_n, chunk_mean, chunk_m2 in bounded_map(_chunk_moments, reader.chunks(chunk_rows), workers):
+		delta = chunk_mean - mean
+		total = n + chunk_n
+		mean = mean + delta * chunk_n / total
+		m2 = m2 + chunk_m2 + delta ** 2 * n * chunk_n / total
+		n = total
+	return mean, np.sqrt(m2 / max(n, 1))
+
+
+def ternary(chunk, mean, std, sp, n):
+	"""
+	:return: int8 con 1 donde el z-value > sp, -1 donde < -n y 0 en el resto (y en las features constantes)
+	"""
+	with np.errstate(divide='ignore', invalid='ignore'):
+		z = np.where(std > 0, (chunk - mean) / std, 0.0)
+	out = np.zeros(chunk.shape, dtype=np.int8)
+	out[z > sp] = 1
+	out[z < -n] = -1
+	return out
+
+
+def stats_path(source_path):
+	return path.splitext(source_path)[0] + '_feature_stats.npz'
+
+
+def get_feature_stats(reader, chunk_rows=2048, workers=4):
+	"""
+	feature_stats guardadas junto al embedding continuo, se calculan la primera vez.
+	"""
+	cache_path = stats_path(reader.source_path)
+	if path.isfile(cache_path):
+		cached = np.load(cache_path)
+		return cached['mean'], cached['std']
+	mean, std = feature_stats(reader, chunk_rows, workers)
+	np.savez(cache_path, mean=mean, std=std)
+	return mean, std
+
+
+def invalidate_version_caches(file_name):
+	"""
+	Borra lo que se ha calculado a partir del embedding file_name (atlas, índices, CSR, matriz ordenada por
+	labels, correlaciones) para todas las versiones registradas que lo usan.
+	"""
+	base = EMBEDDINGS_DIR + file_name[:-len('.npy')]
+	for suffix in ['_csr.npz', '_bylabel.npy', '_bylabel_csr.npz']:
+		if path.isfile(base + suffix):
+			os.remove(base + suffix)
+	for version, entry in load_registry().items():
+		if entry['file'] != file_name:
+			continue
+		directories = [Atlas.atlas_dir(version), FeatureCorrelation.correlation_dir(version),
+		               path.dirname(BitmapIndex.index_path(version)),
+		               path.dirname(BitmapIndex.index_path(version, '_bylabel'))]
+		for directory in directories:
+			if path.isdir(directory):
+				shutil.rmtree(directory)
+
+
+def discretize(sp, n, version=None, source_path=CONTINUOUS_PATH, key='data_matrix', chunk_rows=2048, workers=4,
+               overwrite=False):
+	"""
+	Genera y registra una versión discretizada del embedding continuo.
+	:param sp: umbral de los z-values para 1
+	:param n: umbral de los z-values para -1 (se compara con -n)
+	:param version: número de la versión, por defecto round(n * 100) como 19, 25 y 31
+	:param overwrite: recalcular el embedding si ya existe (y borrar lo que se había calculado con él). Las
+		versiones de BUILTIN_VERSIONS no se pueden regenerar y nunca se sobrescriben.
+	:return: la versión registrada
+	"""
+	if version is None:
+		version = int(round(n * 100))
+	known = version_entry(version)
+	if known is not None and (known['sp'], known['n']) != (sp, n):
+		raise ValueError('La versión ' + str(version) + ' ya existe con sp ' + str(known['sp']) + ' y n ' +
+		                 str(known['n']))
+	file_name = embedding_name(sp, n)
+	out_path = EMBEDDINGS_DIR + file_name
+	builtin_files = set(entry['file'] for entry in BUILTIN_VERSIONS.values())
+	if version in BUILTIN_VERSIONS or file_name in builtin_files:
+		raise ValueError('sp ' + str(sp) + ' y n ' + str(n) + ' son los de una versión precalculada, que no se '
+		                 'puede regenerar')
+	if path.isfile(out_path):
+		if not overwrite:
+			raise ValueError(out_path + ' ya existe, usa overwrite para recalcularlo')
+		invalidate_version_caches(file_name)
+	reader = RowReader(source_path, key)
+	mean, std = get_feature_stats(reader, chunk_rows, workers)
+	tmp_path = out_path[:-len('.npy')] + '_tmp.npy'
+	out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.int8, shape=reader.shape)
+
+	def write(item):
+		start, chunk = item
+		out[start:start + chunk.shape[0]] = ternary(chunk, mean, std, sp, n)
+		return chunk.shape[0]
+
+	for _ in bounded_map(write, reader.chunks(chunk_rows), workers):
+		pass
+	out.flush()
+	del out
+	os.replace(tmp_path, out_path)
+	register_version(version, {'file': file_name, 'sp': sp, 'n': n, 'source': path.basename(source_path)})
+	return version
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Discretiza el embedding continuo en una nueva versión')
+	parser.add_argument('--sp', type=float, required=True)
+	parser.add_argument('--n', type=float, required=True)
+	parser.add_argument('--version', type=int, default=None)
+	parser.add_argument('--source', default=CONTINUOUS_PATH)
+	parser.add_argument('--chunk-rows', type=int, default=2048)
+	parser.add_argument('--workers', type=int, default=4)
+	parser.add_argument('--overwrite', action='store_true',
+	                    help='recalcula el embedding si ya existe y borra sus atlas, índices y CSR')
+	args = parser.parse_args()
+	version = discretize(args.sp, args.n, args.version, args.source, chunk_rows=args.chunk_rows,
+	                     workers=args.workers, overwrite=args.overwrite)
+	print('Versión ' + str(version) + ' registrada')
+
+
+if __name__ == "__main__":
+	main()
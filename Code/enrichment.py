@@ -0,0 +1,120 @@
+"""
+Per-feature enrichment of synsets: which features take a category (-1, 0 or 1) significantly more or less
+often inside a synset than in the rest of the data.
+
+For every synset, feature and category there is a 2x2 table (in the synset / outside) x (has the category /
+has another one), built from the per-synset and global count arrays. The test (chi-square or hypergeometric)
+runs on whole arrays [synsets, features, 3] in one call to scipy.stats, and the p-values are corrected with
+Benjamini-Hochberg inside each synset. Only the significant cells are kept, in a compact structured table.
+"""
+import numpy as np
+from Code import outliers
+from Code.lazy_imports import stats
+
+TESTS = ('chi2', 'hypergeom')
+ENRICHMENT_DTYPE = np.dtype([('synset', np.int64), ('feature', np.int32), ('category', np.int8),
+                             ('layer', np.int8), ('observed', np.int32), ('expected', np.float32),
+                             ('log2_ratio', np.float32), ('p', np.float64), ('q', np.float64)])
+
+
+def contingency(synset_counts, global_counts):
+	"""
+	:param synset_counts: [synsets, features, 3]
+	:param global_counts: [features, 3], conteos de todas las imágenes
+	:return: (observed, synset_size, category_total, total) listos para los tests, con broadcasting
+	"""
+	observed = np.asarray(synset_counts, dtype=np.int64)
+	global_counts = np.asarray(global_counts, dtype=np.int64)
+	synset_size = observed[:, :1, :].sum(axis=-1, keepdims=True)
+	category_total = global_counts[np.newaxis]
+	total = global_counts[:1].sum()
+	return observed, synset_size, category_total, total
+
+
+def chi2_test(observed, synset_size, category_total, total):
+	"""
+	Chi-cuadrado de la tabla 2x2 (sin corrección de Yates), un grado de libertad.
+	"""
+	a = observed.astype(np.float64)
+	b = synset_size - a
+	c = category_total - a
+	d = total - synset_size - c
+	denominator = (a + b) * (c + d) * (a + c) * (b + d)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		chi2 = np.where(denominator > 0, total * (a * d - b * c) ** 2 / denominator, 0.0)
+	return stats.chi2.sf(chi2, 1)
+
+
+def hypergeom_test(observed, synset_size, category_total, total):
+	"""
+	Test exacto hipergeométrico de dos colas (el doble de la cola del lado observado).
+	"""
+	over = stats.hypergeom.sf(observed - 1, total, category_total, synset_size)
+	under = stats.hypergeom.cdf(observed, total, category_total, synset_size)
+	return np.minimum(1.0, 2 * np.minimum(over, under))
+
+
+def benjamini_hochberg(p, axis=-1):
+	"""
+	q-values de Benjamini-Hochberg a lo largo de axis (cada fila es una familia de tests).
+	"""
+	p = np.moveaxis(np.asarray(p, dtype=np.float64), axis, -1)
+	m = p.shape[-1]
+	order = np.argsort(p, axis=-1)
+	ranked = np.take_along_axis(p, order, axis=-1) * m / np.arange(1, m + 1)
+	ranked = np.minimum.accumulate(ranked[..., ::-1], axis=-1)[..., ::-1]
+	q = np.empty_like(p)
+	np.put_along_axis(q, order, np.minimum(ranked, 1.0), axis=-1)
+	return np.moveaxis(q, -1, axis)
+
+
+def enrichment(synset_counts, global_counts, offsets, layers, test='hypergeom', alpha=0.05):
+	"""
+	:param synset_counts: [synsets, features, 3]
+	:param global_counts: [features, 3]
+	:param offsets: offset de cada synset, para la tabla
+	:param layers: layers sin solaparse, como data.reduced_layers
+	:param test: uno de TESTS
+	:param alpha: umbral de los q-values
+	:return: array con ENRICHMENT_DTYPE, una fila por (synset, feature, categoría) significativa
+	"""
+	observed, synset_size, category_total, total = contingency(synset_counts, global_counts)
+	if test == 'chi2':
+		p = chi2_test(observed, synset_size, category_total, total)
+	elif test == 'hypergeom':
+		p = hypergeom_test(observed, synset_size, category_total, total)
+	else:
+		raise ValueError('test tiene que ser uno de ' + str(TESTS) + ', no ' + str(test))
+	n_synsets = observed.shape[0]
+	q = benjamini_hochberg(p.reshape(n_synsets, -1)).reshape(p.shape)
+	expected = synset_size * category_total / total
+	significant = q < alpha
+	s, f, c = np.nonzero(significant)
+	lookup, _ = outliers.layer_lookup(layers, observed.shape[1])
+	table = np.zeros(s.shape[0], dtype=ENRICHMENT_DTYPE)
+	table['synset'] = np.asarray(offsets, dtype=np.int64)[s]
+	table['feature'] = f
+	table['category'] = np.array([-1, 0, 1], dtype=np.int8)[c]
+	table['layer'] = lookup[f]
+	table['observed'] = observed[s, f, c]
+	table['expected'] = expected[s, f, c]
+	with np.errstate(divide='ignore'):
+		table['log2_ratio'] = np.log2(observed[s, f, c] / expected[s, f, c])
+	table['p'] = p[s, f, c]
+	table['q'] = q[s, f, c]
+	return table
+
+
+def layer_summary(table, layer_names):
+	"""
+	summary[offset][layer] = {'over': features sobrerrepresentadas, 'under': infrarrepresentadas}
+	"""
+	summary = {}
+	for offset in np.unique(table['synset']).tolist():
+		rows = table[table['synset'] == offset]
+		summary[offset] = {}
+		for i, name in enumerate(layer_names):
+			in_layer = rows[rows['layer'] == i]
+			summary[offset][name] = {'over': int(np.count_nonzero(in_layer['log2_ratio'] > 0)),
+			                         'under': int(np.count_nonzero(in_layer['log2_ratio'] < 0))}
+	return summary
@@ -2,8 +2,13 @@
 In this code I make the different experiments in the FNE ussing the class stats and Data.
 """
 
-from Code.wordnet_imagenet_connections import Statistics, Data
-from nltk.corpus import wordnet as wn
+from Code.wordnet_imagenet_connections import Statistics, AggregateData, REDUCED_LAYERS
+from Code.sweep import Sweep
+from Code.version_pool import VersionPool
+from Code.scheduler import Scheduler
+from Code.lazy_imports import wn, plt
+from os import path
+import json
 import sys
 import time
 import datetime
@@ -28,29 +33,206 @@ all = [living_things, mammal, dog, hunting_dogs, artifact, instrum, conv, wheele
 
 def generate_stuff():
     embeddings_version = [19, 25, 31]
-    for version in embeddings_version:
-        print('Loading data...')
-        ini_time = time.time()
-        data = Data('', version)
-        stats_living = Statistics(synsets_living, data)
-        stats_non_living = Statistics(synsets_non_living, data)
-        stats_all = Statistics(all, data)
+    with VersionPool() as pool:
+        for version in embeddings_version:
+            print('Loading data...')
+            ini_time = time.time()
+            with pool.version(version) as data:
+                stats_living = Statistics(synsets_living, data)
+                stats_non_living = Statistics(synsets_non_living, data)
+                stats_all = Statistics(all, data)
 
-        print('Loaded in ', datetime.timedelta(seconds=(time.time() - ini_time)), 'seconds')
-        ini_time = time.time()
-        stats_all.plot_all()
-        stats_living.plot_all()
-        stats_non_living.plot_all()
-        print('plot all time: ', datetime.timedelta(seconds=(time.time() - ini_time)))
+                print('Loaded in ', datetime.timedelta(seconds=(time.time() - ini_time)), 'seconds')
+                ini_time = time.time()
+                stats_all.plot_all()
+                stats_living.plot_all()
+                stats_non_living.plot_all()
+                print('plot all time: ', datetime.timedelta(seconds=(time.time() - ini_time)))
 
-        data.__del__()
+            sys.stdout.write("\n")
 
-        sys.stdout.write("\n")
+
+# plot de Statistics -> generadores que tienen que haber corrido antes ('atlas' es el de Data)
+plot_requirements = {
+    'plot_features_per_image': ['features_per_image_gen'],
+    'plot_all_features': [],
+    'plot_features_per_synset': ['features_per_synset_gen'],
+    'plot_images_per_feature': ['images_per_feature_gen'],
+    'plot_synsets_on_data': ['synset_in_data_gen'],
+    'plot_intra_synset': ['intra_synset_gen'],
+    'plot_images_per_feature_of_synset': ['images_per_feature_per_synset_gen'],
+    'plot_images_per_feature_of_synset_per_layer': ['images_per_feature_per_synset_gen'],
+    'plot_features_per_layer': ['features_per_layer_gen'],
+    'plot_changes_between_all_reps_per_layer': ['features_per_layer_gen'],
+    'plot_features_per_layer_per_synset': ['atlas'],
+    'plot_changes_between_synset': ['atlas'],
+    'plot_matrix': ['atlas'],
+    'plot_changes_between_synset_reps': ['atlas'],
+    'plot_changes_between_synset_reps_per_layer': ['atlas'],
+}
+# generador -> atributo de Statistics con el fichero que genera, si ya existe no se vuelve a generar
+generator_outputs = {
+    'features_per_image_gen': 'features_per_image_path',
+    'features_per_synset_gen': 'features_per_synset_path',
+    'images_per_feature_gen': 'images_per_feature_path',
+    'synset_in_data_gen': 'synset_in_data_path',
+    'intra_synset_gen': 'intra_synset_path',
+    'images_per_feature_per_synset_gen': 'images_per_feature_per_synset_path',
+    'features_per_layer_gen': 'features_per_layer_path',
+}
+# plots que se hacen una vez por synset
+per_synset_plots = ['plot_images_per_feature_of_synset', 'plot_images_per_feature_of_synset_per_layer']
+
+
+def load_job_spec(spec_path=None):
+    """
+    Lee el fichero de configuración del informe (versiones, grupos de synsets y plots).
+    """
+    if spec_path is None:
+        spec_path = path.join(path.dirname(path.abspath(__file__)), 'experiments.json')
+    with open(spec_path) as f:
+        return json.load(f)
+
+
+def _load_data(pool, version):
+    return lambda: pool.acquire(version)
+
+
+def _make_statistics(synsets):
+    return lambda data: Statistics(synsets, data)
+
+
+def _generator(generator):
+    def run(stats):
+        output = getattr(stats, generator_outputs[generator])
+        if not path.isfile(output):
+            getattr(stats, generator)()
+        return stats
+    return run
+
+
+def _plot(plot):
+    def run(stats, *_):
+        if plot in per_synset_plots:
+            for synset in stats.synsets:
+                getattr(stats, plot)(synset)
+        else:
+            getattr(stats, plot)()
+        plt.cla()
+        plt.clf()
+        plt.close("all")
+    return run
+
+
+def _release(pool, version):
+    return lambda *_: pool.release(version)
+
+
+def report_scheduler(spec):
+    """
+    Construye el DAG del informe: datos -> atlas/generadores -> plots/LaTeX, por versión y grupo.
+    Los prerrequisitos compartidos (datos y atlas de cada versión) son una sola tarea. Los plots de un mismo
+    grupo van encadenados para que el fichero latex salga en el orden de la configuración, y todos los plots
+    comparten el lock de pyplot.
+    :param spec: diccionario con workers, budget_gb, versions, groups y plots
+    :return: Scheduler
+    """
+    scheduler = Scheduler(workers=spec.get('workers', 4))
+    # las versiones comparten labels e ids, y las matrices se quedan cargadas mientras quepan en el presupuesto
+    pool = VersionPool(budget_bytes=int(spec.get('budget_gb', 8) * (1 << 30)))
+    plots = spec.get('plots', list(plot_requirements))
+    # los synsets se buscan aquí, en un solo hilo, porque el corpus de nltk no se carga bien desde varios
+    groups = {name: [wn.synset(s) for s in names] for name, names in spec['groups'].items()}
+    for version in spec['versions']:
+        v = str(version)
+        data = scheduler.add('data:' + v, _load_data(pool, version))
+        atlas = scheduler.add('atlas:' + v, lambda d: d.get_atlas(), [data])
+        version_plots = []
+        for group, synsets in groups.items():
+            g = v + ':' + group
+            stats = scheduler.add('stats:' + g, _make_statistics(synsets), [data])
+            previous = None
+            for plot in plots:
+                deps = [stats]
+                for requirement in plot_requirements[plot]:
+                    if requirement == 'atlas':
+                        deps.append(atlas)
+                    else:
+                        deps.append(scheduler.add('gen:' + g + ':' + requirement, _generator(requirement), [stats],
+                                                  locks=['stats:' + g]))
+                if previous is not None:
+                    deps.append(previous)
+                previous = scheduler.add('plot:' + g + ':' + plot, _plot(plot), deps, locks=['pyplot'])
+                version_plots.append(previous)
+        scheduler.add('release:' + v, _release(pool, version), [data] + version_plots)
+    return scheduler
+
+
+def run_report(spec_path=None):
+    """
+    Genera el informe de todas las versiones y grupos de la configuración como un solo trabajo en paralelo.
+    """
+    spec = load_job_spec(spec_path)
+    return report_scheduler(spec).run()
+
+
+def render_report(synsets, version, plots=None):
+    """
+    Vuelve a hacer los plots y el latex de un grupo y una versión solo con los agregados guardados (los pickles de
+    los generadores y el atlas), sin cargar dmatrix.
+    :param plots: plots a hacer, por defecto todos los de plot_requirements en su orden
+    :return: Statistics con los agregados cargados
+    """
+    if plots is None:
+        plots = list(plot_requirements)
+    stats = Statistics(synsets, AggregateData(version))
+    missing = []
+    for plot in plots:
+        for requirement in plot_requirements[plot]:
+            if requirement != 'atlas' and not path.isfile(getattr(stats, generator_outputs[requirement])):
+                missing.append(requirement)
+    if missing:
+        raise IOError('Faltan los agregados de ' + str(sorted(set(missing))) + ' en ' + stats.dir_path +
+                      ', hay que generarlos con Data cargado')
+    for plot in plots:
+        _plot(plot)(stats)
+    return stats
+
+
+def run_render(spec_path=None):
+    """
+    render_report de todas las versiones y grupos de la configuración.
+    """
+    spec = load_job_spec(spec_path)
+    plots = spec.get('plots', list(plot_requirements))
+    for version in spec['versions']:
+        for group, names in spec['groups'].items():
+            ini_time = time.time()
+            render_report([wn.synset(s) for s in names], version, plots)
+            print('render', version, group, datetime.timedelta(seconds=(time.time() - ini_time)))
+
+
+def run_sweep(spec_path=None):
+    """
+    Conteos y representantes de todos los umbrales (sp, n) de la sección sweep de la configuración, en una
+    sola pasada por el embedding continuo (ver sweep).
+    """
+    spec = load_job_spec(spec_path)['sweep']
+    sweep = Sweep.load_or_build(spec['thresholds'], REDUCED_LAYERS, spec.get('name', 'sweep'),
+                                workers=spec.get('workers', 4))
+    for (sp, n), proportions in zip(sweep.thresholds, sweep.proportions()):
+        print('sp', sp, 'n', n, '-1/0/1:', proportions)
+    return sweep
 
 
 def main():
     ini_time = time.time()
-    generate_stuff()
+    if len(sys.argv) > 1 and sys.argv[1] == 'sweep':
+        run_sweep()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'render':
+        run_render()
+    else:
+        run_report()
     print('total time', datetime.timedelta(seconds=(time.time() - ini_time)))
 
 if __name__ == "__main__":
@@ -0,0 +1,185 @@
+"""
+Feature-feature agreement and correlation of the discretized embedding, to find redundant features.
+
+Each feature is stored as two bit-planes over the images (bit set where the value is 1, and where it is -1),
+packed in uint64 words. For a pair of features a, b the popcounts of the four ANDs (++, +-, -+, --) give
+everything, with z the rows where a feature is 0:
+	agreement(a, b) = (|++| + |--| + |z_a & z_b|) / rows,  |z_a & z_b| = rows - nz_a - nz_b + |++| + |+-| + |-+| + |--|
+	correlation(a, b) = Pearson of the -1/0/1 values, from sum(x_a x_b) = |++| + |--| - |+-| - |-+|
+The [features, features] matrices are computed by square tiles on a pool of processes that read the planes
+and write their tile (and its transpose) straight into memory-mapped .npy files. Groups of duplicated
+features are then the connected components of the pairs above a threshold inside each layer.
+"""
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from os import path
+from os import makedirs
+
+_correlation_path = '../Data/Correlation/'
+METRICS = ('agreement', 'correlation')
+
+
+def popcount(words):
+	"""
+	Bits a 1 de cada elemento de un array de uint64.
+	"""
+	if hasattr(np, 'bitwise_count'):
+		return np.bitwise_count(words)
+	table = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+	as_bytes = np.ascontiguousarray(words).view(np.uint8).reshape(words.shape + (8,))
+	return table[as_bytes].sum(axis=-1, dtype=np.uint8)
+
+
+def build_planes(matrix, planes_path, chunk_rows=8192):
+	"""
+	Bit-planes de matrix, uint64 [2, features, palabras] con el plano de 1 y el de -1, guardados en planes_path.
+	Se recorre matrix de chunk en chunk de filas (chunk_rows tiene que ser múltiplo de 64).
+	"""
+	n_rows, n_features = matrix.shape
+	n_words = (n_rows + 63) // 64
+	planes = np.lib.format.open_memmap(planes_path, mode='w+', dtype=np.uint64, shape=(2, n_features, n_words))
+	planes_bytes = planes.view(np.uint8).reshape(2, n_features, n_words * 8)
+	for start in range(0, n_rows, chunk_rows):
+		block = np.asarray(matrix[start:start + chunk_rows])
+		first_byte = start // 8
+		for p, value in enumerate((1, -1)):
+			packed = np.packbits(block == value, axis=0, bitorder='little')
+			planes_bytes[p, :, first_byte:first_byte + packed.shape[0]] = packed.T
+	planes.flush()
+	return planes
+
+
+def _tile(job):
+	"""
+	Calcula el tile [i0:i1, j0:j1] (y su transpuesto) de las dos matrices. Se ejecuta en otro proceso.
+	"""
+	planes_path, agreement_path, correlation_path, n_rows, i0, i1, j0, j1, words_chunk = job
+	planes = np.load(planes_path, mmap_mode='r')
+	a_pos, a_neg = np.asarray(planes[0, i0:i1]), np.asarray(planes[1, i0:i1])
+	b_pos, b_neg = np.asarray(planes[0, j0:j1]), np.asarray(planes[1, j0:j1])
+	products = np.zeros((4, i1 - i0, j1 - j0), dtype=np.int64)
+	for w0 in range(0, a_pos.shape[1], words_chunk):
+		w = slice(w0, w0 + words_chunk)
+		for k, (a, b) in enumerate(((a_pos, b_pos), (a_pos, b_neg), (a_neg, b_pos), (a_neg, b_neg))):
+			products[k] += popcount(a[:, np.newaxis, w] & b[np.newaxis, :, w]).sum(axis=-1, dtype=np.int64)
+	pp, pn, np_, nn = products
+	a_ones = popcount(a_pos).sum(axis=1, dtype=np.int64)[:, np.newaxis]
+	a_negones = popcount(a_neg).sum(axis=1, dtype=np.int64)[:, np.newaxis]
+	b_ones = popcount(b_pos).sum(axis=1, dtype=np.int64)[np.newaxis, :]
+	b_negones = popcount(b_neg).sum(axis=1, dtype=np.int64)[np.newaxis, :]
+	both_zero = n_rows - (a_ones + a_negones) - (b_ones + b_negones) + pp + pn + np_ + nn
+	agreement = (pp + nn + both_zero) / n_rows
+	sum_a = a_ones - a_negones
+	sum_b = b_ones - b_negones
+	# cada factor cabe en int64 pero su producto no (llega a rows^4), se multiplica en float64
+	covariance = (n_rows * (pp + nn - pn - np_) - sum_a * sum_b).astype(np.float64)
+	var_a = (n_rows * (a_ones + a_negones) - sum_a ** 2).astype(np.float64)
+	var_b = (n_rows * (b_ones + b_negones) - sum_b ** 2).astype(np.float64)
+	variance = var_a * var_b
+	with np.errstate(divide='ignore', invalid='ignore'):
+		correlation = np.where(variance > 0, covariance / np.sqrt(variance), np.nan)
+	for out_path, values in ((agreement_path, agreement), (correlation_path, correlation)):
+		out = np.load(out_path, mmap_mode='r+')
+		out[i0:i1, j0:j1] = values
+		out[j0:j1, i0:i1] = values.T
+		out.flush()
+	return i0, j0
+
+
+def duplicate_groups(matrix, layers, threshold=0.99):
+	"""
+	Grupos de features de un mismo layer unidas por pares con matrix >= threshold (componentes conexas).
+	:param matrix: [features, features], agreement o |correlation|
+	:param layers: layers sin solaparse, como data.reduced_layers
+	:return: groups[layer] = lista de grupos (listas de features ordenadas), de más grande a más pequeño
+	"""
+	groups = {}
+	for layer, (start, end) in layers.items():
+		block = np.asarray(matrix[start:end, start:end])
+		first, second = np.nonzero(np.triu(block >= threshold, 1))
+		parent = np.arange(end - start)
+
+		def find(x):
+			while parent[x] != x:
+				parent[x] = parent[parent[x]]
+				x = parent[x]
+			return x
+
+		for a, b in zip(first.tolist(), second.tolist()):
+			root_a, root_b = find(a), find(b)
+			if root_a != root_b:
+				parent[max(root_a, root_b)] = min(root_a, root_b)
+		members = {}
+		for feature in np.unique(np.concatenate([first, second])).tolist():
+			members.setdefault(find(feature), []).append(start + feature)
+		groups[layer] = sorted(members.values(), key=lambda g: (-len(g), g[0]))
+	return groups
+
+
+class FeatureCorrelation:
+	"""
+	Attributes:
+		agreement (np.array): float32 [features, features] mapeada, proporción de imágenes con el mismo valor
+		correlation (np.array): float32 [features, features] mapeada, Pearson (nan si una feature es constante)
+	"""
+
+	def __init__(self, agreement, correlation):
+		self.agreement = agreement
+		self.correlation = correlation
+
+	@staticmethod
+	def correlation_dir(version):
+		return _correlation_path + str(version) + '/'
+
+	@classmethod
+	def build(cls, data, tile=128, workers=4, words_chunk=256):
+		"""
+		:param data: Data con el embedding cargado (dmatrix puede estar mapeada)
+		:param tile: features por lado de cada tile
+		:param workers: procesos que calculan tiles a la vez
+		:param words_chunk: palabras de 64 filas que se cruzan a la vez dentro de un tile
+		"""
+		correlation_dir = cls.correlation_dir(data.version)
+		if not path.exists(correlation_dir):
+			makedirs(correlation_dir)
+		n_rows, n_features = data.dmatrix.shape
+		planes_path = correlation_dir + 'planes.npy'
+		build_planes(data.dmatrix, planes_path)
+		out_paths = {}
+		for metric in METRICS:
+			out_paths[metric] = correlation_dir + metric + '.npy'
+			out = np.lib.format.open_memmap(out_paths[metric], mode='w+', dtype=np.float32,
+			                                shape=(n_features, n_features))
+			del out
+		starts = range(0, n_features, tile)
+		jobs = [(planes_path, out_paths['agreement'], out_paths['correlation'], n_rows, i, min(i + tile, n_features),
+		         j, min(j + tile, n_features), words_chunk) for i in starts for j in starts if j >= i]
+		with ProcessPoolExecutor(max_workers=workers) as pool:
+			for _ in pool.map(_tile, jobs):
+				pass
+		return cls.load(correlation_dir)
+
+	@classmethod
+	def load(cls, correlation_dir):
+		return cls(np.load(correlation_dir + 'agreement.npy', mmap_mode='r'),
+		           np.load(correlation_dir + 'correlation.npy', mmap_mode='r'))
+
+	@classmethod
+	def load_or_build(cls, data, **kwargs):
+		correlation_dir = cls.correlation_dir(data.version)
+		if path.isfile(correlation_dir + 'correlation.npy') and path.isfile(correlation_dir + 'agreement.npy'):
+			return cls.load(correlation_dir)
+		return cls.build(data, **kwargs)
+
+	def duplicate_groups(self, layers, threshold=0.99, metric='correlation'):
+		"""
+		duplicate_groups con la métrica elegida, con 'correlation' se usa el valor absoluto (una feature que es
+		la otra cambiada de signo también es redundante). El agreement cuenta los 0 compartidos, así que dos
+		features independientes que casi siempre son 0 tienen agreement cerca de 1; solo sirve para umbrales
+		por encima de la proporción de 0.
+		"""
+		if metric == 'agreement':
+			return duplicate_groups(self.agreement, layers, threshold)
+		if metric == 'correlation':
+			return duplicate_groups(np.abs(np.nan_to_num(self.correlation)), layers, threshold)
+		raise ValueError('metric tiene que ser una de ' + str(METRICS) + ', no ' + str(metric))
@@ -0,0 +1,187 @@
+"""
+Numpy-only computations over the discretized FNE: feature counts, representatives and distances.
+
+Nothing in here imports matplotlib, scipy, nltk or pygraphviz, so batch jobs that only compute
+(indexes, representatives, distances, statistics aggregates) stay light.
+"""
+import numpy as np
+
+CATEGORIES = (-1, 0, 1)
+_CATEGORY_VALUES = np.array(CATEGORIES, dtype=np.int8)
+
+
+def count_features(matrix):
+	"""
+	Devuelve un diccionario con la cantidad de features de cada tipo de la matriz matrix
+	features[category] = cantidad de category de la matriz
+	"""
+	matrix = np.asarray(matrix)
+	ones = int(np.count_nonzero(matrix == 1))
+	negones = int(np.count_nonzero(matrix == -1))
+	return {-1: negones, 0: matrix.size - ones - negones, 1: ones}
+
+
+def category_counts(matrix):
+	"""
+	Per-feature counts of every category of a (images x features) matrix.
+	:param matrix: discretized submatrix
+	:return: int64 array [features, 3] with the counts of -1, 0 and 1 (CATEGORIES order)
+	"""
+	matrix = np.asarray(matrix)
+	if matrix.ndim == 1:
+		matrix = matrix[np.newaxis, :]
+	counts = np.empty((matrix.shape[1], 3), dtype=np.int64)
+	counts[:, 0] = np.count_nonzero(matrix == -1, axis=0)
+	counts[:, 2] = np.count_nonzero(matrix == 1, axis=0)
+	counts[:, 1] = matrix.shape[0] - counts[:, 0] - counts[:, 2]
+	return counts
+
+
+def representative_from_counts(counts):
+	"""
+	Mode of every feature from its category counts. Ties go to the smallest category, the same
+	as scipy.stats.mode.
+	:param counts: array [..., features, 3] in CATEGORIES order
+	:return: int8 array [..., features] with values -1, 0 or 1
+	"""
+	return _CATEGORY_VALUES[np.argmax(counts, axis=-1)]
+
+
+def representative(sub_matrix):
+	"""
+	rep[feature] = 1, -1 o 0 según el valor que se repite más veces en sub_matrix.
+	"""
+	return representative_from_counts(category_counts(sub_matrix))
+
+
+def ones_distance(r1, r2):
+	"""
+	Distance between two representatives: 1 - shared ones / ones in any of them.
+	:return: distance (float), 9999 if one of the representatives is empty
+	"""
+	if len(r1) == 0 or len(r2) == 0:
+		return 9999
+	r1 = np.asarray(r1)
+	r2 = np.asarray(r2)
+	sharedones = np.sum((r1 == 1) & (r2 == 1))
+	totalones = np.sum(r1 == 1) + np.sum(r2 == 1)
+	return 1 - (sharedones / (totalones - sharedones))
+
+
+def ones_proportion_distance(r1, r2):
+	"""
+	abs(proporcion1(r1) - proporcion1(r2)) * 100, siendo proporcion1 la proporción de 1 del representante.
+	:return: distance (float), 9999 if one of the representatives is empty
+	"""
+	if len(r1) == 0 or len(r2) == 0:
+		return 9999
+	prop1 = np.count_nonzero(np.equal(r1, 1)) / np.size(r1)
+	prop2 = np.count_nonzero(np.equal(r2, 1)) / np.size(r2)
+	return np.abs(prop1 - prop2) * 100
+
+
+def rows_of_labels(labels, synset_labels, n_labels):
+	"""
+	Índices de las filas cuyo label está en synset_labels.
+	:param labels: label de cada imagen
+	:param synset_labels: labels que forman el synset
+	:param n_labels: cantidad total de labels
+	:return: np array con los índices, ordenados
+	"""
+	label_mask = np.zeros(n_labels, dtype=bool)
+	label_mask[np.asarray(synset_labels, dtype=np.int64)] = True
+	return np.flatnonzero(label_mask[labels])
+
+
+def label_category_counts(matrix, labels, n_labels, chunk_rows=2048):
+	"""
+	Per-label and per-feature counts of every category, in one pass over the rows of matrix.
+	:param matrix: discretized embedding (images x features), can be a memmap
+	:param labels: label of each image
+	:param n_labels: cantidad total de labels
+	:param chunk_rows: rows processed at a time, bounds the memory used
+	:return: int32 array [labels, features, 3] in CATEGORIES order
+	"""
+	labels = np.asarray(labels)
+	n_rows, n_features = matrix.shape
+	ones = np.zeros((n_labels, n_features), dtype=np.int64)
+	negones = np.zeros((n_labels, n_features), dtype=np.int64)
+	for start in range(0, n_rows, chunk_rows):
+		chunk = np.asarray(matrix[start:start + chunk_rows])
+		chunk_labels = labels[start:start + chunk_rows]
+		if np.any(chunk_labels[1:] < chunk_labels[:-1]):
+			order = np.argsort(chunk_labels, kind='stable')
+			chunk = chunk[order]
+			chunk_labels = chunk_labels[order]
+		bounds = np.flatnonzero(np.r_[True, chunk_labels[1:] != chunk_labels[:-1]])
+		present = chunk_labels[bounds]
+		ones[present] += np.add.reduceat(chunk == 1, bounds, axis=0, dtype=np.int32)
+		negones[present] += np.add.reduceat(chunk == -1, bounds, axis=0, dtype=np.int32)
+	sizes = np.bincount(labels, minlength=n_labels)
+	counts = np.empty((n_labels, n_features, 3), dtype=np.int32)
+	counts[:, :, 0] = negones
+	counts[:, :, 2] = ones
+	counts[:, :, 1] = sizes[:, np.newaxis] - counts[:, :, 0] - counts[:, :, 2]
+	return counts
+
+
+def containment_matrix(membership, label_sizes, chunk=256):
+	"""
+	Imágenes compartidas por cada par de synsets. Como las imágenes de un synset son las de sus labels, la
+	intersección de dos synsets es la suma de los tamaños de los labels que tienen en común.
+	:param membership: bool [synsets, labels], membership[s, l] = True si el label l está en el synset s
+	:param label_sizes: cantidad de imágenes de cada label
+	:param chunk: synsets por bloque, limita la memoria con grupos grandes
+	:return: int64 [synsets, synsets] con containment[i, j] = imágenes de j que están en i
+	"""
+	membership = np.asarray(membership, dtype=np.float64)
+	weighted = membership * np.asarray(label_sizes, dtype=np.float64)
+	n = membership.shape[0]
+	containment = np.empty((n, n), dtype=np.int64)
+	for start in range(0, n, chunk):
+		containment[start:start + chunk] = np.rint(weighted[start:start + chunk] @ membership.T)
+	return containment
+
+
+def agreeing_pairs(counts):
+	"""
+	Per feature, how many pairs of images have the same value: sum over the categories of C(count, 2).
+	Equivalent to comparing every pair of rows, but O(features) from the counts.
+	:param counts: array [..., features, 3]
+	:return: int64 array [..., features]
+	"""
+	counts = np.asarray(counts, dtype=np.int64)
+	return (counts * (counts - 1) // 2).sum(axis=-1)
+
+
+def counts_to_dict(counts):
+	"""
+	Pasa un array de conteos [..., 3] al diccionario de count_features: features[category] = cantidad
+	"""
+	counts = np.asarray(counts).reshape(-1, 3)
+	totals = counts.sum(axis=0, dtype=np.int64)
+	return {-1: int(totals[0]), 0: int(totals[1]), 1: int(totals[2])}
+
+
+def ones_distance_pairs(reps, valid, first, second, chunk=1024):
+	"""
+	ones_distance for many pairs of representatives at once.
+	:param reps: int8 array [n, features] with one representative per row
+	:param valid: bool array [n], False for the rows whose representative is empty
+	:param first: row of the first representative of each pair
+	:param second: row of the second representative of each pair
+	:return: float array with the distance of each pair, 9999 where one of them is empty
+	"""
+	ones = np.asarray(reps) == 1
+	ones_count = np.count_nonzero(ones, axis=1)
+	first = np.asarray(first, dtype=np.int64)
+	second = np.asarray(second, dtype=np.int64)
+	shared = np.zeros(first.shape[0], dtype=np.int64)
+	for start in range(0, first.shape[0], chunk):
+		a = ones[first[start:start + chunk]]
+		b = ones[second[start:start + chunk]]
+		shared[start:start + chunk] = np.count_nonzero(a & b, axis=1)
+	totalones = ones_count[first] + ones_count[second]
+	with np.errstate(divide='ignore', invalid='ignore'):
+		distance = 1 - (shared / (totalones - shared))
+	return np.where(valid[first] & valid[second], distance, 9999)
@@ -0,0 +1,248 @@
+"""
+Memoized traversal of the noun hyponym DAG of WordNet.
+
+Each node's descendant set is computed once (post-order, children before parents) and shared by every
+ancestor that reaches it, instead of calling synset.closure(hyponyms) separately for each synset.
+Synsets are identified by their integer WordNet offset.
+"""
+import numpy as np
+from collections import deque
+from os import path
+from Code.id_tables import offset_to_synset
+from Code import wordnet_snapshot
+
+_all_synsets_and_sons_path = '../Data/Distances/Common_Data/all_synsets_and_sons.npy'
+# lista de aristas hiperónimo -> hipónimo de un subárbol
+EDGE_DTYPE = np.dtype([('parent', np.int64), ('child', np.int64), ('depth', np.int32), ('distance', np.float64)])
+
+
+def _wordnet_children(offset):
+	return [h.offset() for h in offset_to_synset(offset).hyponyms()]
+
+
+def _wordnet_parents(offset):
+	return [h.offset() for h in offset_to_synset(offset).hypernyms()]
+
+
+class OffsetBitset:
+	"""
+	Conjunto de offsets de WordNet guardado como un bitset, membership en O(1), también vectorizado.
+	"""
+
+	def __init__(self, offsets):
+		offsets = np.unique(np.asarray(offsets, dtype=np.int64))
+		size = int(offsets[-1]) + 1 if offsets.shape[0] > 0 else 0
+		bits = np.zeros(size, dtype=bool)
+		bits[offsets] = True
+		self.bits = np.packbits(bits)
+		self.offsets = offsets
+
+	def contains(self, offsets):
+		"""
+		:param offsets: array de offsets
+		:return: array de bool
+		"""
+		offsets = np.asarray(offsets, dtype=np.int64)
+		if self.bits.shape[0] == 0:
+			return np.zeros(offsets.shape, dtype=bool)
+		inside = (offsets >= 0) & (offsets < self.bits.shape[0] * 8)
+		safe = np.where(inside, offsets, 0)
+		found = (self.bits[safe >> 3] >> (7 - (safe & 7))) & 1
+		return inside & (found == 1)
+
+	def __contains__(self, offset):
+		offset = int(offset)
+		if offset < 0 or offset >= self.bits.shape[0] * 8:
+			return False
+		return bool((self.bits[offset >> 3] >> (7 - (offset & 7))) & 1)
+
+	def __len__(self):
+		return self.offsets.shape[0]
+
+
+class HyponymDag:
+	"""
+	Vista memoizada del DAG de hipónimos.
+
+	Attributes:
+		children (callable): children(offset) = lista de offsets de los hipónimos directos
+		parents (callable): parents(offset) = lista de offsets de los hiperónimos directos
+		snapshot (WordNetSnapshot): si se da, children, parents y descendants salen de sus arrays, sin nltk
+		descendants_memo (dict): descendants_memo[offset] = array ordenado con el offset y todos sus hipónimos
+	"""
+
+	def __init__(self, children=None, parents=None, snapshot=None):
+		self.snapshot = snapshot
+		if snapshot is not None:
+			children = snapshot.children if children is None else children
+			parents = snapshot.parents if parents is None else parents
+		self.children = children if children is not None else _wordnet_children
+		self.parents = parents if parents is not None else _wordnet_parents
+		self.children_memo = {}
+		self.parents_memo = {}
+		self.descendants_memo = {}
+
+	def get_children(self, offset):
+		if offset not in self.children_memo:
+			self.children_memo[offset] = list(self.children(offset))
+		return self.children_memo[offset]
+
+	def get_parents(self, offset):
+		if offset not in self.parents_memo:
+			self.parents_memo[offset] = list(self.parents(offset))
+		return self.parents_memo[offset]
+
+	def descendants(self, offset):
+		"""
+		Offset and all its hyponyms (sorted, no duplicates). Every node below is computed once and reused.
+		"""
+		offset = int(offset)
+		memo = self.descendants_memo
+		if offset in memo:
+			return memo[offset]
+		if self.snapshot is not None:
+			memo[offset] = self.snapshot.descendants(offset)
+			return memo[offset]
+		stack = [(offset, False)]
+		while stack:
+			node, expanded = stack.pop()
+			if node in memo:
+				continue
+			kids = self.get_children(node)
+			if expanded:
+				parts = [np.array([node], dtype=np.int64)] + [memo[k] for k in kids]
+				memo[node] = np.unique(np.concatenate(parts))
+			else:
+				stack.append((node, True))
+				stack.extend((k, False) for k in kids if k not in memo)
+		return memo[offset]
+
+	def hyponym_offsets(self, offset):
+		"""
+		Same as synset.closure(hyponyms): every hyponym, without the synset itself.
+		"""
+		desc = self.descendants(offset)
+		return desc[desc != int(offset)]
+
+	def closure_of(self, offsets):
+		"""
+		Union of the descendants of all offsets, as a sorted array without duplicates.
+		"""
+		parts = [self.descendants(o) for o in offsets]
+		if len(parts) == 0:
+			return np.zeros(0, dtype=np.int64)
+		return np.unique(np.concatenate(parts))
+
+	def ancestor_closure(self, offsets):
+		"""
+		The offsets and all their hypernyms, as a sorted array. Each node is expanded once.
+		"""
+		seen = set(int(o) for o in offsets)
+		stack = list(seen)
+		while stack:
+			for parent in self.get_parents(stack.pop()):
+				if parent not in seen:
+					seen.add(parent)
+					stack.append(parent)
+		return np.array(sorted(seen), dtype=np.int64)
+
+	def post_order(self, offsets):
+		"""
+		Orders the offsets so that every node comes after all its children inside offsets.
+		"""
+		inside = set(int(o) for o in offsets)
+		done = set()
+		order = []
+		for root in offsets:
+			stack = [(int(root), False)]
+			while stack:
+				node, expanded = stack.pop()
+				if node in done:
+					continue
+				if expanded:
+					done.add(node)
+					order.append(node)
+				else:
+					stack.append((node, True))
+					stack.extend((k, False) for k in self.get_children(node) if k in inside and k not in done)
+		return order
+
+	def bfs_edges(self, root, keep=None):
+		"""
+		Breadth-first traversal from root. Each node is reached once, through the first parent that finds it.
+		:param keep: keep(offset) -> bool, edges to children that fail it are dropped together with their
+			subtree, which only works for properties that also fail for every hyponym
+		:return: edge array with EDGE_DTYPE, distances set to 0
+		"""
+		blocks = list(self.iter_bfs_edges(root, keep))
+		if len(blocks) == 0:
+			return np.zeros(0, dtype=EDGE_DTYPE)
+		return np.concatenate(blocks)
+
+	def iter_bfs_edges(self, root, keep=None, batch=4096):
+		"""
+		Same traversal as bfs_edges, yielding the edges in blocks of at most batch as they are found, so
+		the caller can process and write them without holding the whole subtree.
+		"""
+		root = int(root)
+		depth = {root: 0}
+		block = []
+		open_set = deque([root])
+		while open_set:
+			parent = open_set.popleft()
+			for child in self.get_children(parent):
+				if child in depth:
+					continue
+				depth[child] = depth[parent] + 1
+				if keep is not None and not keep(child):
+					continue
+				open_set.append(child)
+				block.append((parent, child, depth[child], 0.0))
+				if len(block) == batch:
+					yield np.array(block, dtype=EDGE_DTYPE)
+					block = []
+		if block:
+			yield np.array(block, dtype=EDGE_DTYPE)
+
+	def has_hyponym_in(self, offset, offset_set):
+		"""
+		True si algún hipónimo de offset (sin contarse a sí mismo) está en offset_set (OffsetBitset).
+		"""
+		return bool(np.any(offset_set.contains(self.hyponym_offsets(offset))))
+
+
+_dag = None
+_snapshot = None
+
+
+def get_snapshot(snapshot_path=wordnet_snapshot.SNAPSHOT_PATH):
+	"""
+	WordNetSnapshot del proceso, None si no se ha generado (wordnet_snapshot.main).
+	"""
+	global _snapshot
+	if _snapshot is None and path.isfile(snapshot_path):
+		_snapshot = wordnet_snapshot.WordNetSnapshot.load(snapshot_path)
+	return _snapshot
+
+
+def get_hyponym_dag():
+	"""
+	Process-wide DAG, so the memo is shared by Data, Statistics, Distances and synset_tree. It runs on the
+	WordNet snapshot when there is one, and on nltk otherwise.
+	"""
+	global _dag
+	if _dag is None:
+		_dag = HyponymDag(snapshot=get_snapshot())
+	return _dag
+
+
+def all_synsets_and_sons(imagenet_offsets, synsets_path=_all_synsets_and_sons_path):
+	"""
+	Sorted offsets of every ImageNet synset and all its hyponyms, loaded from disk or computed in one
+	memoized pass and saved.
+	"""
+	if path.isfile(synsets_path):
+		return np.load(synsets_path)
+	synsets = get_hyponym_dag().closure_of(imagenet_offsets)
+	np.save(synsets_path, synsets)
+	return synsets
@@ -0,0 +1,161 @@
+"""
+Conversion tables between the four ways we name a class:
+	label (0:999, the value stored in labels.npy)
+	ImageNet id ('n01440764')
+	WordNet offset (int, 1440764)
+	display name ('tench', the same text ss_to_text returned)
+
+The tables are built once from synsets_in_imagenet.txt and saved in Common_Data/id_tables.npz, so
+only the build needs nltk. Everything internal keys dicts and caches by the integer offset.
+"""
+import numpy as np
+from os import path
+from Code.lazy_imports import wn
+
+_common_data_path = '../Data/Distances/Common_Data/'
+_imagenet_id_path = _common_data_path + 'synsets_in_imagenet.txt'
+_id_tables_path = _common_data_path + 'id_tables.npz'
+
+
+def imagenet_ids_to_offsets(imagenet_ids):
+	"""
+	Vectorized 'n01440764' -> 1440764
+	"""
+	imagenet_ids = np.asarray(imagenet_ids, dtype=np.str_)
+	return np.char.lstrip(imagenet_ids, 'n').astype(np.int64)
+
+
+def offsets_to_imagenet_ids(offsets):
+	"""
+	Vectorized 1440764 -> 'n01440764'
+	"""
+	offsets = np.asarray(offsets, dtype=np.int64)
+	return np.char.add('n', np.char.zfill(offsets.astype(np.str_), 8))
+
+
+def get_in_id(wordnet_ss):
+	"""
+	Input: Synset
+	:return: imagenet id (string)
+	"""
+	return 'n%08d' % wordnet_ss.offset()
+
+
+def get_wn_id(imagenet_id):
+	return imagenet_id[1:] + '-' + imagenet_id[0]
+
+
+def get_wn_ss(imagenet_id):
+	return offset_to_synset(int(imagenet_id[1:]))
+
+
+def offset_to_synset(offset):
+	return wn.synset_from_pos_and_offset('n', int(offset))
+
+
+def ss_to_text(synset):
+	""" returns the string of the name of the input synset"""
+	return synset.name().rsplit('.', 2)[0]
+
+
+class IdTables:
+	"""
+	Tablas de conversión label <-> ImageNet id <-> offset de WordNet <-> nombre.
+
+	Attributes:
+		imagenet_ids (np.array): imagenet_ids[label] = 'n01440764'
+		offsets (np.array): offsets[label] = offset de WordNet (int64)
+		names (np.array): names[label] = nombre del synset
+		names_by_offset (dict): names_by_offset[offset] = nombre, también para synsets que no son labels
+	"""
+
+	def __init__(self, imagenet_ids, offsets, names):
+		self.imagenet_ids = np.asarray(imagenet_ids)
+		self.offsets = np.asarray(offsets, dtype=np.int64)
+		self.names = np.asarray(names)
+		self._order = np.argsort(self.offsets, kind='mergesort')
+		self._sorted_offsets = self.offsets[self._order]
+		self.names_by_offset = dict(zip(self.offsets.tolist(), self.names.tolist()))
+		self._synsets = {}
+
+	@classmethod
+	def build(cls, imagenet_id_path=_imagenet_id_path):
+		"""
+		Builds the tables from the list of ImageNet ids. This is the only step that needs WordNet.
+		"""
+		imagenet_ids = np.genfromtxt(imagenet_id_path, dtype=np.str_)
+		offsets = imagenet_ids_to_offsets(imagenet_ids)
+		names = np.array([ss_to_text(offset_to_synset(o)) for o in offsets])
+		return cls(imagenet_ids, offsets, names)
+
+	@classmethod
+	def load(cls, tables_path=_id_tables_path):
+		tables = np.load(tables_path)
+		return cls(tables['imagenet_ids'], tables['offsets'], tables['names'])
+
+	def save(self, tables_path=_id_tables_path):
+		np.savez(tables_path, imagenet_ids=self.imagenet_ids, offsets=self.offsets, names=self.names)
+
+	def __len__(self):
+		return self.offsets.shape[0]
+
+	def labels_to_offsets(self, labels):
+		return self.offsets[np.asarray(labels)]
+
+	def labels_to_imagenet_ids(self, labels):
+		return self.imagenet_ids[np.asarray(labels)]
+
+	def labels_to_names(self, labels):
+		return self.names[np.asarray(labels)]
+
+	def offsets_to_labels(self, offsets):
+		"""
+		Vectorized offset -> label, -1 for the offsets that are not ImageNet classes.
+		"""
+		offsets = np.asarray(offsets, dtype=np.int64)
+		pos = np.searchsorted(self._sorted_offsets, offsets)
+		pos = np.minimum(pos, len(self) - 1)
+		found = self._sorted_offsets[pos] == offsets
+		return np.where(found, self._order[pos], -1)
+
+	def imagenet_ids_to_labels(self, imagenet_ids):
+		return self.offsets_to_labels(imagenet_ids_to_offsets(imagenet_ids))
+
+	def labels_of_offsets(self, offsets):
+		"""
+		:return: sorted labels of the offsets that are ImageNet classes
+		"""
+		labels = self.offsets_to_labels(offsets)
+		return np.unique(labels[labels >= 0])
+
+	def synset(self, offset):
+		offset = int(offset)
+		if offset not in self._synsets:
+			self._synsets[offset] = offset_to_synset(offset)
+		return self._synsets[offset]
+
+	def name(self, offset):
+		"""
+		Nombre de cualquier offset de WordNet, los que no son labels se buscan una vez y se guardan.
+		"""
+		offset = int(offset)
+		if offset not in self.names_by_offset:
+			self.names_by_offset[offset] = ss_to_text(self.synset(offset))
+		return self.names_by_offset[offset]
+
+
+_id_tables = None
+
+
+def get_id_tables(tables_path=_id_tables_path, imagenet_id_path=_imagenet_id_path):
+	"""
+	Returns the process-wide tables, loading them from disk or building and saving them the first time.
+	"""
+	global _id_tables
+	if _id_tables is None:
+		if path.isfile(tables_path):
+			_id_tables = IdTables.load(tables_path)
+		else:
+			_id_tables = IdTables.build(imagenet_id_path)
+			_id_tables.save(tables_path)
+	return _id_tables
@@ -0,0 +1,62 @@
+"""
+Lazy access to the heavy dependencies (matplotlib, nltk's WordNet, pygraphviz, scipy).
+
+The compute paths only need numpy, so the plotting and corpus stacks are imported the first time
+one of their attributes is actually used instead of at module load.
+"""
+import importlib
+import threading
+
+
+class LazyModule:
+	"""
+	Stand-in for a module that is imported on first attribute access.
+
+	Attributes:
+		name (str): name of the module to import, e.g. 'matplotlib.pyplot'
+		attribute (str): optional attribute of the module to expose instead of the module itself,
+			e.g. LazyModule('nltk.corpus', 'wordnet')
+		on_load (callable): optional function called once with the loaded object
+	"""
+
+	def __init__(self, name, attribute=None, on_load=None):
+		self._name = name
+		self._attribute = attribute
+		self._on_load = on_load
+		self._module = None
+		self._lock = threading.Lock()
+
+	def _load(self):
+		if self._module is None:
+			with self._lock:
+				if self._module is None:
+					module = importlib.import_module(self._name)
+					if self._attribute is not None:
+						module = getattr(module, self._attribute)
+					if self._on_load is not None:
+						self._on_load(module)
+					self._module = module
+		return self._module
+
+	def is_loaded(self):
+		return self._module is not None
+
+	def __getattr__(self, item):
+		return getattr(self._load(), item)
+
+	def __repr__(self):
+		target = self._name if self._attribute is None else self._name + '.' + self._attribute
+		state = 'loaded' if self.is_loaded() else 'not loaded'
+		return '<LazyModule ' + target + ' (' + state + ')>'
+
+
+def _default_figsize(pyplot):
+	pyplot.rcParams['figure.figsize'] = [8.0, 8.0]
+
+
+wn = LazyModule('nltk.corpus', 'wordnet')
+# para WordNetError, lo que lanza wn.synset con un nombre que no existe
+wordnet_reader = LazyModule('nltk.corpus.reader.wordnet')
+plt = LazyModule('matplotlib.pyplot', on_load=_default_figsize)
+PG = LazyModule('pygraphviz')
+stats = LazyModule('scipy.stats')
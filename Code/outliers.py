@@ -0,0 +1,155 @@
+"""
+Outlier features of the discretized FNE, from the per-feature category counts.
+
+Everything works on dense count arrays [..., features, 3] (CATEGORIES order): thresholds are computed along
+the feature axis, outliers are boolean masks and the distribution over the layers is one bincount with a
+feature -> layer lookup array. A leading axis of synsets is processed in the same call, so the outliers of
+every synset of a group, or of every node of the atlas, come out of one batch.
+"""
+import numpy as np
+from Code import fne_core
+
+# constante que hace la MAD comparable con la desviación estándar de una normal
+_MAD_SCALE = 1.4826
+METHODS = ('mean_std', 'median_mad')
+
+
+def layer_lookup(layers, n_features):
+	"""
+	:param layers: layers[nombre] = [inicio, final], sin solaparse (como data.reduced_layers)
+	:param n_features: cantidad de features del embedding
+	:return: (lookup, names) con lookup[feature] = índice del layer en names, -1 si no está en ningún layer
+	"""
+	names = list(layers.keys())
+	lookup = np.full(n_features, -1, dtype=np.int64)
+	for i, name in enumerate(names):
+		start, end = layers[name]
+		lookup[start:end] = i
+	return lookup, names
+
+
+def thresholds(values, method='mean_std', k=4):
+	"""
+	Límites de los outliers a lo largo del eje de las features (el penúltimo de values).
+	:param values: conteos [..., features, categorías]
+	:param method: 'mean_std' (media +- k desviaciones) o 'median_mad' (mediana +- k MAD escaladas)
+	:return: (low, high, spread) con forma [..., 1, categorías]
+	"""
+	values = np.asarray(values, dtype=np.float64)
+	if method == 'mean_std':
+		center = values.mean(axis=-2, keepdims=True)
+		spread = values.std(axis=-2, keepdims=True)
+	elif method == 'median_mad':
+		center = np.median(values, axis=-2, keepdims=True)
+		spread = _MAD_SCALE * np.median(np.abs(values - center), axis=-2, keepdims=True)
+	else:
+		raise ValueError('method tiene que ser uno de ' + str(METHODS) + ', no ' + str(method))
+	return center - k * spread, center + k * spread, spread
+
+
+def find_outliers(counts, method='mean_std', k=4):
+	"""
+	Features cuyo conteo de una categoría se aleja de lo normal en esa categoría.
+	Si todas las features tienen el mismo conteo (spread 0) no hay outliers.
+	:param counts: conteos [..., features, 3]
+	:return: (downliers, upliers) máscaras bool [..., features, 3]
+	"""
+	counts = np.asarray(counts)
+	low, high, spread = thresholds(counts, method, k)
+	spread_ok = spread > 0
+	downliers = (counts <= low) & spread_ok
+	upliers = (counts >= high) & spread_ok
+	return downliers, upliers
+
+
+def layer_distribution(mask, lookup, n_layers):
+	"""
+	Cantidad de features marcadas en cada layer.
+	:param mask: bool [..., features, 3]
+	:param lookup: lookup[feature] = layer, de layer_lookup
+	:return: int array [..., 3, layers]
+	"""
+	mask = np.asarray(mask)
+	lead = mask.shape[:-2]
+	n_groups = int(np.prod(lead, dtype=np.int64)) * 3
+	# una fila por (synset, categoría), con las features en el último eje
+	rows = np.moveaxis(mask, -1, -2).reshape(n_groups, mask.shape[-2])
+	group, feature = np.nonzero(rows)
+	layer = lookup[feature]
+	inside = layer >= 0
+	flat = group[inside] * n_layers + layer[inside]
+	distribution = np.bincount(flat, minlength=n_groups * n_layers)
+	return distribution.reshape(lead + (3, n_layers))
+
+
+class OutlierReport:
+	"""
+	Attributes:
+		method (str): estadístico usado, uno de METHODS
+		k (float): cuántas desviaciones se alejan los outliers
+		names (list): nombres de los layers
+		downliers (np.array): bool [..., features, 3]
+		upliers (np.array): bool [..., features, 3]
+		distribution (np.array): distribution[..., category, layer] = outliers de la categoría en el layer
+	"""
+
+	def __init__(self, method, k, names, downliers, upliers, distribution):
+		self.method = method
+		self.k = k
+		self.names = names
+		self.downliers = downliers
+		self.upliers = upliers
+		self.distribution = distribution
+
+	@classmethod
+	def from_counts(cls, counts, layers, method='mean_std', k=4):
+		counts = np.asarray(counts)
+		lookup, names = layer_lookup(layers, counts.shape[-2])
+		downliers, upliers = find_outliers(counts, method, k)
+		distribution = layer_distribution(downliers | upliers, lookup, len(names))
+		return cls(method, k, names, downliers, upliers, distribution)
+
+	def outliers(self, category, index=()):
+		"""
+		:param category: -1, 0 o 1
+		:param index: posición en los ejes de batch (el synset), () si no hay batch
+		:return: lista ordenada de features outlier de la categoría
+		"""
+		c = fne_core.CATEGORIES.index(category)
+		mask = self.downliers[index][..., c] | self.upliers[index][..., c]
+		return np.flatnonzero(mask).tolist()
+
+	def layer_outliers(self, category, index=()):
+		"""
+		:return: dict layer -> cantidad de outliers, como el layeroutlier de find_outlier_in_images_per_feature
+		"""
+		c = fne_core.CATEGORIES.index(category)
+		row = self.distribution[index][..., c, :]
+		return dict(zip(self.names, row.tolist()))
+
+
+def synset_counts(atlas, offsets, hyponyms_only=True):
+	"""
+	Conteos [synsets, features, 3] de varios synsets, en ceros los que no tienen imágenes.
+	"""
+	counts = np.zeros((len(offsets),) + atlas.counts.shape[1:], dtype=np.int32)
+	for i, offset in enumerate(offsets):
+		node = atlas.node_counts(offset, hyponyms_only)
+		if node is not None:
+			counts[i] = node
+	return counts
+
+
+def atlas_distributions(atlas, layers, method='mean_std', k=4, chunk_nodes=256):
+	"""
+	Distribución por layer de los outliers de todos los nodos del atlas, por bloques de nodos.
+	:return: int array [nodos, 3, layers], en el orden de atlas.offsets
+	"""
+	lookup, names = layer_lookup(layers, atlas.counts.shape[1])
+	n_nodes = atlas.offsets.shape[0]
+	distributions = np.zeros((n_nodes, 3, len(names)), dtype=np.int64)
+	for start in range(0, n_nodes, chunk_nodes):
+		block = np.asarray(atlas.counts[start:start + chunk_nodes])
+		downliers, upliers = find_outliers(block, method, k)
+		distributions[start:start + chunk_nodes] = layer_distribution(downliers | upliers, lookup, len(names))
+	return distributions, names
@@ -0,0 +1,278 @@
+"""
+Local HTTP service that keeps Data, the atlas and the indexes loaded between queries.
+
+Run from the Code directory (the data paths are relative to it), with the repository root on the path:
+
+	PYTHONPATH=.. python -m Code.query_service --version 25 --port 8765
+
+and ask it from a script, a notebook or curl:
+
+	curl 'localhost:8765/representative?synset=dog.n.01&format=npy' > dog.npy
+	curl 'localhost:8765/distance?a=dog.n.01&b=cat.n.01'
+	curl 'localhost:8765/knn?synset=dog.n.01&k=10'
+	curl 'localhost:8765/subtree_edges?synset=mammal.n.01'
+	curl 'localhost:8765/stats?synset=dog.n.01'
+	curl 'localhost:8765/count?features=9000:1,4300:-1&synset=dog.n.01'
+
+Synsets are given by name (synset=dog.n.01) or by WordNet offset (synset=2084071 or offset=2084071). Every answer is JSON,
+except format=npy, which returns the array as an .npy file. Requests are served by a pool of worker threads
+that share the warm state.
+"""
+import argparse
+import io
+import json
+import time
+import datetime
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from Code import fne_core
+from Code.bitmap_index import Feature, Synset
+from Code.lazy_imports import wn, wordnet_reader
+from Code.wordnet_imagenet_connections import Data, Distances
+
+
+class QueryService:
+	"""
+	Estado caliente y las consultas, sin nada de HTTP.
+
+	Attributes:
+		data (Data): embedding cargado
+		distances (Distances): para las aristas de los subárboles
+		atlas (Atlas): conteos y representantes de todos los synsets con imágenes
+		ones (np.array): ones[nodo, feature] = 1.0 si el representante (solo hipónimos) del nodo tiene un 1
+		ones_count (np.array): cantidad de 1 de cada representante
+		valid (np.array): False para los nodos cuyo representante está vacío
+	"""
+
+	def __init__(self, data):
+		self.data = data
+		self.distances = Distances(data)
+		self.atlas = data.get_atlas()
+		self.bitmap_index = None
+		self.ones = None
+		self.ones_count = None
+		self.valid = None
+
+	def warm(self):
+		"""
+		Carga todo lo que las consultas comparten antes de aceptar la primera.
+		"""
+		atlas = self.atlas
+		reps = np.array(atlas.representatives)
+		self.valid = atlas.sizes > 0
+		# los representantes de las consultas son solo de los hipónimos, como get_represention_fast
+		for i in np.flatnonzero(atlas.own_labels >= 0):
+			rep = atlas.representative(atlas.offsets[i], hyponyms_only=True)
+			if len(rep) == 0:
+				self.valid[i] = False
+			else:
+				reps[i] = rep
+		self.ones = (reps == 1).astype(np.float32)
+		self.ones_count = self.ones.sum(axis=1)
+		self.bitmap_index = self.data.get_bitmap_index()
+		# el corpus de nltk se carga una vez aquí y no en varios hilos a la vez
+		wn.synset('entity.n.01')
+
+	def offset_of(self, params, key='synset'):
+		"""
+		Offset del synset de params[key], que puede ser un nombre (dog.n.01) o directamente el offset.
+		"""
+		if key in params:
+			if params[key].isdigit():
+				return int(params[key])
+			try:
+				return wn.synset(params[key]).offset()
+			except wordnet_reader.WordNetError as e:
+				raise KeyError(str(e))
+		if key == 'synset' and 'offset' in params:
+			return int(params['offset'])
+		raise KeyError('Falta el parámetro ' + key)
+
+	def representative(self, offset):
+		return self.atlas.representative(offset, hyponyms_only=True)
+
+	def distance(self, a, b):
+		r1 = self.representative(a)
+		r2 = self.representative(b)
+		return {'distance': float(fne_core.ones_distance(r1, r2)),
+		        'ones_proportion_distance': float(fne_core.ones_proportion_distance(r1, r2))}
+
+	def knn(self, offset, k=10):
+		"""
+		Los k synsets del atlas más cercanos con la distancia de NEW_distance_between_synsets_reps.
+		"""
+		rep = self.representative(offset)
+		if len(rep) == 0:
+			return []
+		query = (np.asarray(rep) == 1).astype(np.float32)
+		shared = self.ones @ query
+		with np.errstate(divide='ignore', invalid='ignore'):
+			distance = 1 - shared / (self.ones_count + query.sum() - shared)
+		distance = np.where(self.valid, distance, np.inf)
+		distance[self.atlas.offsets == offset] = np.inf
+		k = min(k, int(np.count_nonzero(np.isfinite(distance))))
+		nearest = np.argpartition(distance, k - 1)[:k] if k > 0 else np.zeros(0, dtype=np.int64)
+		nearest = nearest[np.argsort(distance[nearest], kind='stable')]
+		return [{'offset': int(self.atlas.offsets[i]), 'name': self.data.synset_name(self.atlas.offsets[i]),
+		         'distance': float(distance[i])} for i in nearest]
+
+	def subtree_edges(self, offset):
+		return self.distances.subtree_edges(self.data.ids.synset(offset))
+
+	def stats(self, offset):
+		counts = self.atlas.node_counts(offset, hyponyms_only=True)
+		if counts is None:
+			return {'offset': offset, 'name': self.data.synset_name(offset), 'size': 0}
+		rep = self.representative(offset)
+		return {'offset': offset, 'name': self.data.synset_name(offset), 'size': int(counts[0].sum()),
+		        'features': fne_core.counts_to_dict(counts),
+		        'ones_proportion': float(np.count_nonzero(np.equal(rep, 1)) / len(rep)) if len(rep) else None}
+
+	def count(self, features, offset=None, rows=False):
+		"""
+		:param features: lista de (feature, valor) que tienen que cumplirse todas
+		:param offset: si no es None, solo las imágenes del synset
+		"""
+		query = Synset(offset) if offset is not None else None
+		for feature, value in features:
+			term = Feature(feature, value)
+			query = term if query is None else query & term
+		if query is None:
+			raise KeyError('Falta features o synset')
+		if rows:
+			return self.bitmap_index.rows(query)
+		return {'count': self.bitmap_index.count(query)}
+
+
+def _parse_features(text):
+	features = []
+	for term in text.split(','):
+		if term:
+			feature, value = term.split(':')
+			features.append((int(feature), int(value)))
+	return features
+
+
+def _to_json(value):
+	"""
+	Tipos de numpy a tipos de Python, con None en lugar de nan (que no es JSON válido).
+	"""
+	if isinstance(value, np.ndarray):
+		if value.dtype.names is not None:
+			return [{name: _to_json(row[name]) for name in value.dtype.names} for row in value]
+		if value.dtype.kind == 'f':
+			return _to_json(value.tolist())
+		return value.tolist()
+	if isinstance(value, np.generic):
+		return _to_json(value.item())
+	if isinstance(value, (list, tuple)):
+		return [_to_json(v) for v in value]
+	if isinstance(value, dict):
+		return {k: _to_json(v) for k, v in value.items()}
+	if isinstance(value, float) and value != value:
+		return None
+	return value
+
+
+class _Handler(BaseHTTPRequestHandler):
+	service = None
+
+	def do_GET(self):
+		url = urlparse(self.path)
+		params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+		service = self.service
+		try:
+			endpoint = url.path.strip('/')
+			if endpoint == 'representative':
+				result = np.asarray(service.representative(service.offset_of(params)), dtype=np.int8)
+			elif endpoint == 'distance':
+				result = service.distance(service.offset_of(params, 'a'), service.offset_of(params, 'b'))
+			elif endpoint == 'knn':
+				result = service.knn(service.offset_of(params), int(params.get('k', 10)))
+			elif endpoint == 'subtree_edges':
+				result = service.subtree_edges(service.offset_of(params))
+			elif endpoint == 'stats':
+				result = service.stats(service.offset_of(params))
+			elif endpoint == 'count':
+				offset = service.offset_of(params) if 'synset' in params or 'offset' in params else None
+				result = service.count(_parse_features(params.get('features', '')), offset,
+				                       rows=params.get('rows') == '1')
+			else:
+				self.send_error(404, 'No existe ' + url.path)
+				return
+		except (KeyError, ValueError) as e:
+			self.send_error(400, str(e))
+			return
+		except Exception as e:
+			self.send_error(500, type(e).__name__ + ': ' + str(e))
+			return
+		if params.get('format') == 'npy' and isinstance(result, np.ndarray):
+			buffer = io.BytesIO()
+			np.save(buffer, result)
+			self._send(buffer.getvalue(), 'application/octet-stream')
+		else:
+			self._send(json.dumps(_to_json(result), allow_nan=False).encode(), 'application/json')
+
+	def _send(self, body, content_type):
+		self.send_response(200)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+
+class QueryServer(HTTPServer):
+	"""
+	HTTPServer que atiende cada petición en un pool de hilos de tamaño fijo.
+	"""
+
+	def __init__(self, address, service, workers=8):
+		handler = type('Handler', (_Handler,), {'service': service})
+		super().__init__(address, handler)
+		self.pool = ThreadPoolExecutor(max_workers=workers)
+
+	def process_request(self, request, client_address):
+		self.pool.submit(self._process, request, client_address)
+
+	def _process(self, request, client_address):
+		try:
+			self.finish_request(request, client_address)
+		except Exception:
+			self.handle_error(request, client_address)
+		finally:
+			self.shutdown_request(request)
+
+	def server_close(self):
+		super().server_close()
+		self.pool.shutdown(wait=True)
+
+
+def serve(version=25, host='localhost', port=8765, workers=8):
+	ini_time = time.time()
+	service = QueryService(Data('', version))
+	service.warm()
+	print('Servicio listo en ', datetime.timedelta(seconds=(time.time() - ini_time)), ' http://' + host + ':' +
+	      str(port))
+	server = QueryServer((host, port), service, workers)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Servicio local de consultas sobre el FNE')
+	parser.add_argument('--version', type=int, default=25)
+	parser.add_argument('--host', default='localhost')
+	parser.add_argument('--port', type=int, default=8765)
+	parser.add_argument('--workers', type=int, default=8)
+	args = parser.parse_args()
+	serve(args.version, args.host, args.port, args.workers)
+
+
+if __name__ == "__main__":
+	main()
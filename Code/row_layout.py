@@ -0,0 +1,143 @@
+"""
+Label-sorted row layout of the embedding.
+
+The rows are reordered once so that the images of each label are contiguous, and the labels follow the
+order in which a depth-first traversal of WordNet (from entity) reaches them. The images of any synset are
+then a few contiguous ranges of rows (one if all its labels are only below it, a few more where the DAG has
+several parents), and its counts can be computed on views of the matrix instead of on a fancy-indexed copy.
+
+The permutation only depends on the labels, so it is shared by all versions. The reordered matrix of each
+version is written once next to the original, chunk by chunk.
+"""
+import numpy as np
+import os
+from os import path
+from Code import fne_core
+
+# entity.n.01, raíz de los sustantivos
+ROOT_OFFSET = 1740
+LAYOUT_PATH = '../Data/Embeddings/label_layout.npz'
+
+
+def dfs_label_order(ids, dag, root=ROOT_OFFSET):
+	"""
+	Labels en el orden en que los alcanza un recorrido en profundidad desde root. Los que no cuelgan de root
+	van al final.
+	:param ids: IdTables
+	:param dag: HyponymDag
+	:return: array con los labels ordenados
+	"""
+	offset_label = dict(zip(ids.offsets.tolist(), range(len(ids))))
+	order = []
+	seen = set()
+	stack = [int(root)]
+	while stack:
+		node = stack.pop()
+		if node in seen:
+			continue
+		seen.add(node)
+		if node in offset_label:
+			order.append(offset_label[node])
+		# al revés para que los hijos salgan en el orden de WordNet
+		stack.extend(reversed(dag.get_children(node)))
+	reached = set(order)
+	order.extend(label for label in range(len(ids)) if label not in reached)
+	return np.array(order, dtype=np.int64)
+
+
+class RowLayout:
+	"""
+	Attributes:
+		permutation (np.array): la fila i de la matriz reordenada es la fila permutation[i] de la original
+		label_order (np.array): labels en el orden en que aparecen en la matriz reordenada
+		bounds (np.array): las filas del label label_order[k] son bounds[k]:bounds[k + 1]
+		rank (np.array): rank[label] = posición del label en label_order
+	"""
+
+	def __init__(self, permutation, label_order, bounds):
+		self.permutation = permutation
+		self.label_order = label_order
+		self.bounds = bounds
+		self.rank = np.empty_like(label_order)
+		self.rank[label_order] = np.arange(label_order.shape[0])
+
+	@classmethod
+	def build(cls, labels, label_order):
+		labels = np.asarray(labels)
+		rank = np.empty_like(label_order)
+		rank[label_order] = np.arange(label_order.shape[0])
+		permutation = np.argsort(rank[labels], kind='stable')
+		bounds = np.zeros(label_order.shape[0] + 1, dtype=np.int64)
+		np.cumsum(np.bincount(labels, minlength=label_order.shape[0])[label_order], out=bounds[1:])
+		return cls(permutation, label_order, bounds)
+
+	def save(self, layout_path=LAYOUT_PATH):
+		np.savez(layout_path, permutation=self.permutation, label_order=self.label_order, bounds=self.bounds)
+
+	@classmethod
+	def load(cls, layout_path=LAYOUT_PATH):
+		stored = np.load(layout_path)
+		return cls(stored['permutation'], stored['label_order'], stored['bounds'])
+
+	@classmethod
+	def load_or_build(cls, labels, ids, dag, layout_path=LAYOUT_PATH):
+		if path.isfile(layout_path):
+			return cls.load(layout_path)
+		layout = cls.build(labels, dfs_label_order(ids, dag))
+		layout.save(layout_path)
+		return layout
+
+	def label_slices(self, synset_labels):
+		"""
+		Rangos de filas (en la matriz reordenada) de un conjunto de labels, juntando los consecutivos.
+		:return: lista de slices
+		"""
+		ranks = np.unique(self.rank[np.asarray(synset_labels, dtype=np.int64)])
+		if ranks.shape[0] == 0:
+			return []
+		# un rango nuevo empieza donde el rank no sigue al anterior
+		starts = np.flatnonzero(np.diff(ranks, prepend=ranks[0] - 2) != 1)
+		ends = np.append(starts[1:], ranks.shape[0]) - 1
+		slices = []
+		for first, last in zip(ranks[starts].tolist(), ranks[ends].tolist()):
+			if self.bounds[last + 1] > self.bounds[first]:
+				slices.append(slice(int(self.bounds[first]), int(self.bounds[last + 1])))
+		return slices
+
+	def reorder(self, matrix, out_path, chunk_rows=8192):
+		"""
+		Escribe matrix con las filas en este orden, de chunk en chunk de filas de salida.
+		"""
+		tmp_path = out_path[:-len('.npy')] + '_tmp.npy'
+		out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=matrix.dtype, shape=matrix.shape)
+		for start in range(0, matrix.shape[0], chunk_rows):
+			rows = self.permutation[start:start + chunk_rows]
+			# las filas de un chunk de salida se leen en orden para que la lectura sea secuencial
+			order = np.argsort(rows)
+			block = np.empty((rows.shape[0], matrix.shape[1]), dtype=matrix.dtype)
+			block[order] = matrix[rows[order]]
+			out[start:start + rows.shape[0]] = block
+		out.flush()
+		del out
+		os.replace(tmp_path, out_path)
+
+
+def slice_rows(slices):
+	"""
+	Los índices de filas de una lista de slices, para lo que necesite un array de filas.
+	"""
+	if len(slices) == 0:
+		return np.zeros(0, dtype=np.int64)
+	return np.concatenate([np.arange(s.start, s.stop) for s in slices])
+
+
+def slices_category_counts(matrix, slices, chunk_rows=8192):
+	"""
+	fne_core.category_counts de las filas de slices, sumando los conteos de vistas de como mucho chunk_rows
+	filas, sin copiar la submatriz.
+	"""
+	counts = np.zeros((matrix.shape[1], 3), dtype=np.int64)
+	for s in slices:
+		for start in range(s.start, s.stop, chunk_rows):
+			counts += fne_core.category_counts(matrix[start:min(start + chunk_rows, s.stop)])
+	return counts
@@ -0,0 +1,139 @@
+"""
+Scheduler for jobs described as a DAG of tasks.
+
+Each task runs as soon as all its dependencies have finished, on a pool of threads or processes, and
+receives their results as arguments. A task that several others depend on runs only once. Tasks that share
+a lock name never run at the same time (e.g. everything that draws with pyplot, which is not thread safe).
+"""
+import time
+import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+
+class Task:
+	"""
+	Attributes:
+		name (str): nombre único de la tarea
+		func (callable): func(*resultados de deps)
+		deps (list): nombres de las tareas de las que depende
+		locks (list): nombres de los recursos que no se pueden compartir mientras corre
+	"""
+
+	def __init__(self, name, func, deps=(), locks=()):
+		self.name = name
+		self.func = func
+		self.deps = list(deps)
+		self.locks = list(locks)
+
+
+def _run_task(func, args):
+	ini_time = time.time()
+	result = func(*args)
+	return result, time.time() - ini_time
+
+
+class Scheduler:
+	"""
+	Attributes:
+		workers (int): cantidad de tareas que pueden correr a la vez
+		executor (str): 'thread' o 'process', en 'process' las funciones y los resultados tienen que ser picklables
+		tasks (dict): tasks[name] = Task, en orden de inserción
+		results (dict): results[name] = lo que ha devuelto la tarea
+	"""
+
+	def __init__(self, workers=4, executor='thread', verbose=True):
+		if executor not in ('thread', 'process'):
+			raise ValueError('executor tiene que ser thread o process, no ' + str(executor))
+		self.workers = workers
+		self.executor = executor
+		self.verbose = verbose
+		self.tasks = {}
+		self.results = {}
+
+	def add(self, name, func, deps=(), locks=()):
+		"""
+		Añade una tarea. Si ya existe una con ese nombre no hace nada, así los prerrequisitos compartidos
+		se pueden añadir desde cualquier sitio y solo se calculan una vez.
+		:return: name
+		"""
+		if name not in self.tasks:
+			self.tasks[name] = Task(name, func, deps, locks)
+		return name
+
+	def _check(self):
+		for task in self.tasks.values():
+			for dep in task.deps:
+				if dep not in self.tasks:
+					raise KeyError('La tarea ' + task.name + ' depende de ' + dep + ' que no existe')
+		# detecta ciclos con un orden topológico
+		missing = {name: len(task.deps) for name, task in self.tasks.items()}
+		users = {name: [] for name in self.tasks}
+		for task in self.tasks.values():
+			for dep in task.deps:
+				users[dep].append(task.name)
+		ready = [name for name, n in missing.items() if n == 0]
+		seen = 0
+		while ready:
+			name = ready.pop()
+			seen += 1
+			for user in users[name]:
+				missing[user] -= 1
+				if missing[user] == 0:
+					ready.append(user)
+		if seen != len(self.tasks):
+			raise ValueError('Las dependencias de las tareas tienen un ciclo')
+		return users
+
+	def run(self):
+		"""
+		Ejecuta todas las tareas respetando las dependencias y los locks.
+		:return: results
+		"""
+		users = self._check()
+		missing = {}
+		for name, task in self.tasks.items():
+			if name not in self.results:
+				missing[name] = len([dep for dep in task.deps if dep not in self.results])
+		order = {name: i for i, name in enumerate(self.tasks)}
+		ready = [name for name, n in missing.items() if n == 0]
+		held = set()
+		running = {}
+		pool_class = ThreadPoolExecutor if self.executor == 'thread' else ProcessPoolExecutor
+		ini_time = time.time()
+		with pool_class(max_workers=self.workers) as pool:
+			while ready or running:
+				ready.sort(key=order.get)
+				for name in list(ready):
+					if len(running) >= self.workers:
+						break
+					task = self.tasks[name]
+					if held.intersection(task.locks):
+						continue
+					ready.remove(name)
+					held.update(task.locks)
+					args = [self.results[dep] for dep in task.deps]
+					running[pool.submit(_run_task, task.func, args)] = name
+				if not running:
+					raise RuntimeError('No se puede lanzar ninguna tarea: ' + str(ready))
+				done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+				for future in done:
+					name = running.pop(future)
+					held.difference_update(self.tasks[name].locks)
+					try:
+						result, seconds = future.result()
+					except Exception:
+						for other in running:
+							other.cancel()
+						raise
+					self.results[name] = result
+					if self.verbose:
+						print('[' + str(len(self.results)) + '/' + str(len(self.tasks)) + '] ' + name + ' en ',
+						      datetime.timedelta(seconds=seconds))
+					for user in users[name]:
+						if user in missing:
+							missing[user] -= 1
+							if missing[user] == 0:
+								ready.append(user)
+		if self.verbose:
+			print('Todas las tareas en ', datetime.timedelta(seconds=(time.time() - ini_time)))
+		return self.results
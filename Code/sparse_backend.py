@@ -0,0 +1,199 @@
+"""
+Sparse layout of the discretized FNE: two CSR boolean matrices, one with the 1 entries and one with the -1
+entries of every image. The 0s are implicit, so counts, per-label aggregates, row selection and ones-based
+distances only touch the nonzero cells.
+
+The CSR arrays are plain numpy (indptr, indices), so this stays in the numpy-only compute core.
+choose_backend measures the density of the matrix and decides whether the sparse layout pays off.
+"""
+import numpy as np
+from Code import fne_core
+
+# con menos de esta proporción de celdas no nulas el CSR es más pequeño y más rápido que la matriz densa
+DENSITY_THRESHOLD = 0.1
+
+
+def density(matrix, sample_rows=4096, seed=0):
+	"""
+	Proporción de celdas distintas de 0, medida sobre una muestra de filas.
+	"""
+	n_rows = matrix.shape[0]
+	if n_rows > sample_rows:
+		rows = np.sort(np.random.RandomState(seed).choice(n_rows, sample_rows, replace=False))
+		sample = np.asarray(matrix[rows])
+	else:
+		sample = np.asarray(matrix)
+	if sample.size == 0:
+		return 0.0
+	return np.count_nonzero(sample) / sample.size
+
+
+def choose_backend(matrix, threshold=DENSITY_THRESHOLD):
+	"""
+	:return: 'sparse' si la densidad medida está por debajo de threshold, 'dense' si no
+	"""
+	return 'sparse' if density(matrix) < threshold else 'dense'
+
+
+class _BoolCSR:
+	"""
+	Matriz booleana en CSR: las columnas a True de la fila r son indices[indptr[r]:indptr[r + 1]].
+	"""
+
+	def __init__(self, indptr, indices, shape):
+		self.indptr = indptr
+		self.indices = indices
+		self.shape = shape
+
+	@property
+	def nnz(self):
+		return int(self.indptr[-1])
+
+	def row_nnz(self):
+		return np.diff(self.indptr)
+
+	def row(self, r):
+		return self.indices[self.indptr[r]:self.indptr[r + 1]]
+
+	def take_rows(self, rows):
+		rows = np.asarray(rows, dtype=np.int64)
+		lengths = self.indptr[rows + 1] - self.indptr[rows]
+		indptr = np.zeros(rows.shape[0] + 1, dtype=np.int64)
+		np.cumsum(lengths, out=indptr[1:])
+		# posición de cada elemento nuevo dentro de indices: inicio de su fila + posición dentro de la fila
+		starts = np.repeat(self.indptr[rows] - indptr[:-1], lengths)
+		indices = self.indices[starts + np.arange(indptr[-1])]
+		return _BoolCSR(indptr, indices, (rows.shape[0], self.shape[1]))
+
+	def column_counts(self):
+		return np.bincount(self.indices, minlength=self.shape[1])
+
+	def to_dense(self):
+		dense = np.zeros(self.shape, dtype=bool)
+		row_of = np.repeat(np.arange(self.shape[0]), self.row_nnz())
+		dense[row_of, self.indices] = True
+		return dense
+
+
+class TernaryCSR:
+	"""
+	Attributes:
+		positive (_BoolCSR): celdas a 1
+		negative (_BoolCSR): celdas a -1
+		shape (tuple): (imágenes, features)
+	"""
+
+	def __init__(self, positive, negative):
+		self.positive = positive
+		self.negative = negative
+		self.shape = positive.shape
+
+	@classmethod
+	def from_dense(cls, matrix, chunk_rows=4096):
+		"""
+		Se construye de chunk en chunk de filas, matrix puede ser un memmap.
+		"""
+		n_rows, n_features = matrix.shape
+		parts = {1: ([np.zeros(1, dtype=np.int64)], []), -1: ([np.zeros(1, dtype=np.int64)], [])}
+		totals = {1: 0, -1: 0}
+		for start in range(0, n_rows, chunk_rows):
+			chunk = np.asarray(matrix[start:start + chunk_rows])
+			for value in (1, -1):
+				rows, cols = np.nonzero(chunk == value)
+				counts = np.bincount(rows, minlength=chunk.shape[0])
+				parts[value][0].append(totals[value] + np.cumsum(counts))
+				parts[value][1].append(cols.astype(np.int32))
+				totals[value] += cols.shape[0]
+		csr = {}
+		for value in (1, -1):
+			indptr = np.concatenate(parts[value][0])
+			indices = np.concatenate(parts[value][1]) if parts[value][1] else np.zeros(0, dtype=np.int32)
+			csr[value] = _BoolCSR(indptr, indices, (n_rows, n_features))
+		return cls(csr[1], csr[-1])
+
+	def save(self, csr_path):
+		np.savez(csr_path, shape=np.array(self.shape), pos_indptr=self.positive.indptr,
+		         pos_indices=self.positive.indices, neg_indptr=self.negative.indptr,
+		         neg_indices=self.negative.indices)
+
+	@classmethod
+	def load(cls, csr_path):
+		stored = np.load(csr_path)
+		shape = tuple(stored['shape'].tolist())
+		return cls(_BoolCSR(stored['pos_indptr'], stored['pos_indices'], shape),
+		           _BoolCSR(stored['neg_indptr'], stored['neg_indices'], shape))
+
+	def density(self):
+		return (self.positive.nnz + self.negative.nnz) / (self.shape[0] * self.shape[1])
+
+	def take_rows(self, rows):
+		return TernaryCSR(self.positive.take_rows(rows), self.negative.take_rows(rows))
+
+	def _select(self, rows):
+		return self if rows is None else self.take_rows(rows)
+
+	def count_features(self, rows=None):
+		"""
+		Lo mismo que fne_core.count_features sobre las filas rows (todas si es None).
+		"""
+		sub = self._select(rows)
+		ones = sub.positive.nnz
+		negones = sub.negative.nnz
+		return {-1: negones, 0: sub.shape[0] * sub.shape[1] - ones - negones, 1: ones}
+
+	def category_counts(self, rows=None):
+		"""
+		Lo mismo que fne_core.category_counts: array [features, 3] con los conteos de -1, 0 y 1.
+		"""
+		sub = self._select(rows)
+		counts = np.empty((self.shape[1], 3), dtype=np.int64)
+		counts[:, 0] = sub.negative.column_counts()
+		counts[:, 2] = sub.positive.column_counts()
+		counts[:, 1] = sub.shape[0] - counts[:, 0] - counts[:, 2]
+		return counts
+
+	def representative(self, rows=None):
+		return fne_core.representative_from_counts(self.category_counts(rows))
+
+	def label_category_counts(self, labels, n_labels, chunk_rows=65536):
+		"""
+		Lo mismo que fne_core.label_category_counts: int32 [labels, features, 3]. Se recorre de chunk en chunk
+		de filas para no crear arrays auxiliares del tamaño de nnz.
+		"""
+		labels = np.asarray(labels, dtype=np.int64)
+		n_rows, n_features = self.shape
+		counts = np.empty((n_labels, n_features, 3), dtype=np.int32)
+		for c, csr in ((0, self.negative), (2, self.positive)):
+			flat = np.zeros(n_labels * n_features, dtype=np.int64)
+			for start in range(0, n_rows, chunk_rows):
+				end = min(start + chunk_rows, n_rows)
+				label_of = np.repeat(labels[start:end], np.diff(csr.indptr[start:end + 1]))
+				keys = label_of * n_features + csr.indices[csr.indptr[start]:csr.indptr[end]]
+				flat += np.bincount(keys, minlength=n_labels * n_features)
+			counts[:, :, c] = flat.reshape(n_labels, n_features)
+		sizes = np.bincount(labels, minlength=n_labels)
+		counts[:, :, 1] = sizes[:, np.newaxis] - counts[:, :, 0] - counts[:, :, 2]
+		return counts
+
+	def to_dense(self, rows=None):
+		sub = self._select(rows)
+		dense = sub.positive.to_dense().astype(np.int8)
+		dense -= sub.negative.to_dense().astype(np.int8)
+		return dense
+
+	def shared_ones(self, a, b):
+		"""
+		Cantidad de features que valen 1 en las dos filas a y b.
+		"""
+		return np.intersect1d(self.positive.row(a), self.positive.row(b), assume_unique=True).shape[0]
+
+	def ones_distance(self, a, b):
+		"""
+		fne_core.ones_distance entre las filas a y b, sin pasarlas a densas.
+		"""
+		shared = self.shared_ones(a, b)
+		totalones = self.positive.indptr[a + 1] - self.positive.indptr[a] + \
+			self.positive.indptr[b + 1] - self.positive.indptr[b]
+		if totalones == shared:
+			return np.nan
+		return 1 - shared / (totalones - shared)
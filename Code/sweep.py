@@ -0,0 +1,215 @@
+"""
+Sweep of many discretization thresholds in one pass over the continuous embedding.
+
+Instead of building a discretized matrix per (sp, n), the z-value of every cell is placed in a histogram
+whose bin edges are all the thresholds of the sweep (each edge has its own bin, so z == edge is counted
+exactly as in discretize.ternary). Only the histogram per label and feature is accumulated, and after the
+pass the counts of every threshold come out of its cumulative sum:
+	c(-1) = cells with z < -n        c(1) = cells with z > sp        c(0) = the rest
+From the per-label counts of each threshold come the global counts, the per-layer counts and the
+representatives of all the atlas nodes, without reading the data again.
+"""
+import json
+import os
+import numpy as np
+from os import path
+from os import makedirs
+from Code import discretize
+from Code import fne_core
+from Code import hierarchy
+from Code import outliers
+from Code.atlas import node_membership
+from Code.id_tables import get_id_tables
+
+_sweep_path = '../Data/Sweeps/'
+LABELS_PATH = '../Data/Embeddings/labels.npy'
+
+
+def threshold_edges(thresholds):
+	"""
+	:param thresholds: lista de (sp, n)
+	:return: (edges ordenados, posición de cada sp en edges, posición de cada -n en edges)
+	"""
+	thresholds = np.asarray(thresholds, dtype=np.float64).reshape(-1, 2)
+	edges = np.unique(np.concatenate([thresholds[:, 0], -thresholds[:, 1]]))
+	return edges, np.searchsorted(edges, thresholds[:, 0]), np.searchsorted(edges, -thresholds[:, 1])
+
+
+def bin_index(z, edges):
+	"""
+	Bin de cada z: 2k si está entre edges[k - 1] y edges[k], 2k + 1 si es igual a edges[k].
+	"""
+	return np.searchsorted(edges, z, side='left') + np.searchsorted(edges, z, side='right')
+
+
+def label_histograms(chunk, chunk_labels, mean, std, edges):
+	"""
+	:return: dict label -> int64 [features, 2 * len(edges) + 1] con el histograma de los z-values del chunk
+	"""
+	n_bins = 2 * edges.shape[0] + 1
+	n_features = chunk.shape[1]
+	with np.errstate(divide='ignore', invalid='ignore'):
+		z = np.where(std > 0, (chunk - mean) / std, 0.0)
+	keys = bin_index(z, edges) + np.arange(n_features) * n_bins
+	histograms = {}
+	for label in np.unique(chunk_labels).tolist():
+		rows = keys[chunk_labels == label]
+		histograms[label] = np.bincount(rows.ravel(), minlength=n_features * n_bins).reshape(n_features, n_bins)
+	return histograms
+
+
+def counts_from_histogram(histogram, sp_bins, n_bins):
+	"""
+	:param histogram: [..., features, bins]
+	:return: [..., thresholds, features, 3] conteos de -1, 0 y 1 de cada umbral
+	"""
+	cumulative = np.cumsum(histogram, axis=-1)
+	total = cumulative[..., -1:]
+	negones = cumulative[..., 2 * n_bins]
+	ones = total - cumulative[..., 2 * sp_bins + 1]
+	counts = np.stack([negones, total - negones - ones, ones], axis=-1)
+	# [..., features, thresholds, 3] -> [..., thresholds, features, 3]
+	return np.swapaxes(counts, -3, -2)
+
+
+class Sweep:
+	"""
+	Attributes:
+		thresholds (np.array): float [umbrales, 2] con (sp, n)
+		label_counts (np.array): int32 [umbrales, labels, features, 3]
+		global_counts (np.array): int64 [umbrales, features, 3]
+		layer_counts (np.array): int64 [umbrales, layers, 3], en el orden de layer_names
+		layer_names (list): nombres de los layers
+		offsets (np.array): nodos del atlas, ordenados
+		representatives (np.array): int8 [umbrales, nodos, features]
+	"""
+	_files = ['thresholds', 'label_counts', 'global_counts', 'layer_counts', 'offsets', 'representatives']
+	_mapped = ['label_counts', 'representatives']
+
+	def __init__(self, thresholds, label_counts, global_counts, layer_counts, layer_names, offsets,
+	             representatives):
+		self.thresholds = thresholds
+		self.label_counts = label_counts
+		self.global_counts = global_counts
+		self.layer_counts = layer_counts
+		self.layer_names = layer_names
+		self.offsets = offsets
+		self.representatives = representatives
+
+	@staticmethod
+	def sweep_dir(name):
+		return _sweep_path + name + '/'
+
+	@classmethod
+	def build(cls, thresholds, layers, name='sweep', source_path=discretize.CONTINUOUS_PATH, key='data_matrix',
+	          labels_path=LABELS_PATH, chunk_rows=1024, workers=4, chunk_nodes=64):
+		"""
+		:param thresholds: lista de (sp, n)
+		:param layers: layers sin solaparse, como data.reduced_layers
+		:param name: directorio de la sweep dentro de Data/Sweeps
+		:param source_path: embedding continuo, las medias y desviaciones son las de discretize.get_feature_stats
+		"""
+		sweep_dir = cls.sweep_dir(name)
+		if not path.exists(sweep_dir):
+			makedirs(sweep_dir)
+		thresholds = np.asarray(thresholds, dtype=np.float64).reshape(-1, 2)
+		edges, sp_bins, n_bins = threshold_edges(thresholds)
+		ids = get_id_tables()
+		n_labels = len(ids)
+		labels = np.load(labels_path)
+		reader = discretize.RowReader(source_path, key)
+		mean, std = discretize.get_feature_stats(reader, chunk_rows, workers)
+		n_features = reader.shape[1]
+
+		# la única pasada por los datos
+		histograms = np.lib.format.open_memmap(sweep_dir + 'histograms.npy', mode='w+', dtype=np.int32,
+		                                       shape=(n_labels, n_features, 2 * edges.shape[0] + 1))
+
+		def histogram(item):
+			start, chunk = item
+			return label_histograms(chunk, labels[start:start + chunk.shape[0]], mean, std, edges)
+
+		for chunk_histograms in discretize.bounded_map(histogram, reader.chunks(chunk_rows), workers):
+			for label, h in chunk_histograms.items():
+				histograms[label] += h.astype(np.int32)
+		histograms.flush()
+
+		label_counts = np.lib.format.open_memmap(sweep_dir + 'label_counts.npy', mode='w+', dtype=np.int32,
+		                                         shape=(thresholds.shape[0], n_labels, n_features, 3))
+		global_counts = np.zeros((thresholds.shape[0], n_features, 3), dtype=np.int64)
+		for label in range(n_labels):
+			counts = counts_from_histogram(np.asarray(histograms[label]), sp_bins, n_bins)
+			label_counts[:, label] = counts
+			global_counts += counts
+		label_counts.flush()
+		del histograms
+		os.remove(sweep_dir + 'histograms.npy')
+
+		layer_names = list(layers)
+		lookup, _ = outliers.layer_lookup(layers, n_features)
+		layer_counts = np.zeros((thresholds.shape[0], len(layer_names), 3), dtype=np.int64)
+		for i in range(len(layer_names)):
+			layer_counts[:, i] = global_counts[:, lookup == i].sum(axis=1)
+
+		offsets, _, membership = node_membership(ids, hierarchy.get_hyponym_dag())
+		representatives = np.lib.format.open_memmap(sweep_dir + 'representatives.npy', mode='w+', dtype=np.int8,
+		                                            shape=(thresholds.shape[0], offsets.shape[0], n_features))
+		for t in range(thresholds.shape[0]):
+			flat_counts = np.asarray(label_counts[t]).reshape(n_labels, -1).astype(np.float64)
+			for start in range(0, offsets.shape[0], chunk_nodes):
+				block = membership[start:start + chunk_nodes].astype(np.float64) @ flat_counts
+				block = np.rint(block).astype(np.int64).reshape(-1, n_features, 3)
+				representatives[t, start:start + chunk_nodes] = fne_core.representative_from_counts(block)
+		representatives.flush()
+
+		sweep = cls(thresholds, label_counts, global_counts, layer_counts, layer_names, offsets, representatives)
+		sweep.save(sweep_dir, skip=['label_counts', 'representatives'])
+		return sweep
+
+	def save(self, sweep_dir, skip=()):
+		for name in self._files:
+			if name not in skip:
+				np.save(sweep_dir + name + '.npy', getattr(self, name))
+		with open(sweep_dir + 'layer_names.json', 'w') as f:
+			json.dump(self.layer_names, f)
+
+	@classmethod
+	def load(cls, sweep_dir):
+		arrays = {}
+		for name in cls._files:
+			mode = 'r' if name in cls._mapped else None
+			arrays[name] = np.load(sweep_dir + name + '.npy', mmap_mode=mode)
+		with open(sweep_dir + 'layer_names.json') as f:
+			arrays['layer_names'] = json.load(f)
+		return cls(**arrays)
+
+	@classmethod
+	def load_or_build(cls, thresholds, layers, name='sweep', **kwargs):
+		sweep_dir = cls.sweep_dir(name)
+		if path.isfile(sweep_dir + 'layer_names.json'):
+			sweep = cls.load(sweep_dir)
+			if np.array_equal(sweep.thresholds, np.asarray(thresholds, dtype=np.float64).reshape(-1, 2)):
+				return sweep
+		return cls.build(thresholds, layers, name, **kwargs)
+
+	def threshold_index(self, sp, n):
+		found = np.flatnonzero((self.thresholds[:, 0] == sp) & (self.thresholds[:, 1] == n))
+		if found.shape[0] == 0:
+			raise KeyError('El umbral ' + str((sp, n)) + ' no está en la sweep')
+		return int(found[0])
+
+	def representative(self, offset, sp, n):
+		"""
+		:return: rep del synset con el umbral (sp, n), [] si no tiene imágenes
+		"""
+		i = int(np.searchsorted(self.offsets, offset))
+		if i >= self.offsets.shape[0] or self.offsets[i] != offset:
+			return []
+		return np.asarray(self.representatives[self.threshold_index(sp, n), i])
+
+	def proportions(self):
+		"""
+		:return: float [umbrales, 3] proporción global de -1, 0 y 1 de cada umbral
+		"""
+		totals = self.global_counts.sum(axis=1)
+		return totals / totals.sum(axis=1, keepdims=True)
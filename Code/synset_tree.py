@@ -1,95 +1,72 @@
 """
 In this code I explore the synsets trees of wordnet ussing a pseudometric defined ussing the FNE.
 """
-from nltk.corpus import wordnet as wn
+import numpy as np
 import time
 from datetime import timedelta
-import queue
 from Code.wordnet_imagenet_connections import Data
 from Code.wordnet_imagenet_connections import Distances as dis
-import pygraphviz as PG
+from Code.lazy_imports import wn, PG
+from Code.id_tables import get_wn_ss, get_in_id, get_wn_id, ss_to_text, get_id_tables
+from Code import hierarchy
+from Code import checkpoint
+from Code import tree_export
+from Code import bootstrap
 from os import path,makedirs
-import json
-
-
-def get_wn_ss(imagenet_id):
-	return wn.of2ss(imagenet_id[1:] + '-' + imagenet_id[0])
-
-
-def get_in_id(wordnet_ss):
-	wn_id = wn.ss2of(wordnet_ss)
-	return wn_id[-1] + wn_id[:8]
-
-
-def get_wn_id(imagenet_id):
-	return imagenet_id[1:] + '-' + imagenet_id[0]
-
-
-def ss_to_text(synset):
-	""" devuelve el string del nombre del synset en cuestion"""
-	return str(synset)[8:-7]
 
 
 def in_imagenet(synset, imagenet):
-	hypo = lambda s: s.hyponyms()
-
-	for thing in list(synset.closure(hypo)):
-		if thing in imagenet:
-			return True
-	return False
+	"""
+	:param imagenet: OffsetBitset con los synsets de imagenet y sus hiponimos
+	:return: True si algun hiponimo de synset esta en imagenet
+	"""
+	return hierarchy.get_hyponym_dag().has_hyponym_in(synset.offset(), imagenet)
 
 
 def breadth_first_search(synset, imagenet):
 	dat = Data('', 25)
 	mydis = dis(dat)
-	open_set = queue.Queue()
 	graph = PG.AGraph()
 	graph.node_attr.update(color='#3F7FBF', style="filled")
 	graph.edge_attr.update(color="blue", len="4.0", width="2.0")
 	# initialize
-	start = synset
-	open_set.put(start)
 	tree = {}
 	str_tree = {}
-	i = 0
-	distances = {}
-	hypo = lambda s: s.hyponyms()
-	for thing in list(synset.closure(hypo)):
-		distances[thing] = 9999
-	distances[synset] = 0
-	tree[i] = {}
-	str_tree[str(i)] = {}
-	tree[i][None] = [synset]
-	str_tree[str(i)][None] = [ss_to_text(synset)]
+	tree[0] = {}
+	str_tree[str(0)] = {}
+	# tree guarda offsets, como las aristas, para no tener que pasar por nltk en cada una
+	tree[0][None] = [synset.offset()]
+	str_tree[str(0)][None] = [ss_to_text(synset)]
 	graph.add_node(ss_to_text(synset))
-	i = 0
-	while not open_set.empty():
-		parent_state = open_set.get()
-		for child_synset in parent_state.hyponyms():
-			if distances[child_synset] == 9999:
-				open_set.put(child_synset)
-				distances[child_synset] = distances[parent_state] + 1
-				if not distances[child_synset] in list(tree.keys()):
-					tree[distances[child_synset]] = {}
-					str_tree[str(distances[child_synset])] ={}
-				if not parent_state in list(tree[distances[child_synset]].keys()):
-					tree[distances[child_synset]][parent_state] = []
-					str_tree[str(distances[child_synset])][ss_to_text(parent_state)] = []
-				if in_imagenet(child_synset, imagenet):
-					distance = mydis.NEW_distance_between_synsets_reps(parent_state, child_synset)*5
-
-					if distance < 9999:
-						if distance == 0:
-							distance += 0.1
-						graph.add_edge(ss_to_text(parent_state), ss_to_text(child_synset), len=distance)
-						if not path.isdir('../Data/Distances/plots/' + ss_to_text(synset)+'/'):
-							makedirs('../Data/Distances/plots/' + ss_to_text(synset)+'/')
-						graph.draw('../Data/Distances/plots/' + ss_to_text(synset)+'/' + ss_to_text(synset) + str(i) + '.png',  format='png', prog='neato')
-					i = i + 1
-					tree[distances[child_synset]][parent_state].append(child_synset)
-					str_tree[str(distances[child_synset])][ss_to_text(parent_state)].append(ss_to_text(child_synset))
+	plot_dir = '../Data/Distances/plots/' + ss_to_text(synset) + '/'
+	# el checkpoint guarda las aristas y cuántas ya están dibujadas, al reanudar se rehace el grafo sin dibujar
+	progress = checkpoint.Checkpoint(plot_dir + 'bfs.ckpt', None, name='bfs ' + ss_to_text(synset))
+	start, edges = progress.load()
+	if edges is None:
+		edges = mydis.subtree_edges(synset, imagenet)
+		progress.total = edges.shape[0]
+		progress.save(0, edges)
+	for i, edge in enumerate(edges):
+		parent_offset = int(edge['parent'])
+		child_offset = int(edge['child'])
+		# los nombres salen del snapshot de WordNet si está generado
+		parent_name = dat.synset_name(parent_offset)
+		child_name = dat.synset_name(child_offset)
+		depth = int(edge['depth'])
+		distance = edge['distance'] * 5
+		if distance < 9999:
+			if distance == 0:
+				distance += 0.1
+			graph.add_edge(parent_name, child_name, len=distance)
+			if i >= start:
+				graph.draw(plot_dir + ss_to_text(synset) + str(i) + '.png', format='png', prog='neato')
+		tree.setdefault(depth, {}).setdefault(parent_offset, []).append(child_offset)
+		str_tree.setdefault(str(depth), {}).setdefault(parent_name, []).append(child_name)
+		if i >= start:
+			progress.step(i + 1, edges)
 	_filename = '../Data/Distances/plots/' + ss_to_text(synset) + '.png'
 	graph.draw(_filename, format='png', prog='neato')
+	progress.done()
 	return tree, str_tree
 
 
@@ -151,20 +128,10 @@ def get_subtree_from_synset(synset, depht=4):
 
 def load_imagenet_synsets():
 	"""
-	:return:
+	:return: OffsetBitset con los synsets de imagenet y todos sus hiponimos
 	"""
-	with open("../Data/Distances/Common_Data/synsets_in_imagenet.txt") as f:
-		content = f.readlines()
-
-	imagenet_ids = [x.strip() for x in content]
-	synsets = []
-	for i in imagenet_ids:
-		synset = get_wn_ss(i)
-		synsets.append(synset)
-		hypo = lambda s: s.hyponyms()
-		for thing in list(synset.closure(hypo)):
-			synsets.append(thing)
-	return synsets
+	offsets = hierarchy.all_synsets_and_sons(get_id_tables().offsets)
+	return hierarchy.OffsetBitset(offsets)
 
 
 def testin_dog():
@@ -182,24 +149,43 @@ def testin_dog():
 	print('total time', timedelta(seconds=(time.time() - ini_time)))
 
 
+def export_tree(synset, base_path=None, imagenet=None, version=25, formats=tree_export.FORMATS):
+	"""
+	Recorre el subárbol de synset como breadth_first_search pero escribe los nodos y las aristas con su
+	distancia a medida que salen (jsonl, graphml y lista binaria de aristas), sin guardar el árbol en memoria.
+	:return: TreeReader para leer lo que se ha escrito
+	"""
+	if base_path is None:
+		base_path = '../Data/Distances/trees/' + ss_to_text(synset)
+	dat = Data('', version)
+	mydis = dis(dat)
+	with tree_export.TreeWriter(base_path, formats) as writer:
+		writer.node(synset.offset(), ss_to_text(synset), 0)
+		for edges in mydis.iter_subtree_edges(synset, imagenet):
+			writer.edges(edges, dat.synset_name)
+	print(writer.n_nodes, 'nodos y', writer.n_edges, 'aristas en', base_path)
+	return tree_export.TreeReader(base_path)
+
+
 def test_graph(synset):
-	syn_mammals, syn_str_mammals = get_hyponims(synset)
-	print(syn_str_mammals)
-	print(json.dumps(syn_str_mammals, indent=4, sort_keys=True))
+	tree = export_tree(synset)
+	for depth in range(1, 4):
+		level = tree.level(depth)
+		print('depth', depth, ':', len(level), 'aristas')
 
 
-def get_distance(synset):
-	ss_list = []
-	hypo = lambda s: s.hyponyms()
-	for thing in list(synset.closure(hypo)):
-		ss_list.append(thing)
+def get_distance(synset, n_boot=200):
+	# los hipónimos (synset.closure(hyponyms)) salen del DAG, que usa el snapshot de WordNet si está generado
+	offsets = hierarchy.get_hyponym_dag().hyponym_offsets(synset.offset())
 	data = Data('', 25)
-	distance = dis(data)
-	for ss1 in ss_list:
-		for ss2 in ss_list:
-			d = distance.NEW_distance_between_synsets_reps(ss1, ss2)
-			if d < 9999:
-				print(ss_to_text(ss1), ss_to_text(ss2), 'distance', d)
+	# la distancia es simétrica, cada par una vez
+	first_index, second_index = np.triu_indices(offsets.shape[0], 1)
+	first, second = offsets[first_index], offsets[second_index]
+	intervals = bootstrap.bootstrap_pairs(data.get_atlas(), first, second, n_boot=n_boot)
+	for interval in intervals:
+		if not np.isnan(interval['distance']):
+			print(data.synset_name(int(interval['first'])), data.synset_name(int(interval['second'])), 'distance',
+			      interval['distance'], 'CI', (interval['low'], interval['high']))
 
 
 def main():
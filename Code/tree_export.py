@@ -0,0 +1,207 @@
+"""
+Streaming export of WordNet subtrees with the FNE distances on their edges.
+
+TreeWriter writes the nodes and the weighted edges as they come out of the traversal, to any of:
+	<base>.jsonl    one JSON object per line, {"type": "node", ...} or {"type": "edge", ...}
+	<base>.graphml  GraphML, readable by networkx, Gephi, yEd or Cytoscape
+	<base>.edges    binary edge list, records with hierarchy.EDGE_DTYPE (parent, child, depth, distance)
+Nothing is kept in memory apart from a small write buffer for the binary file.
+
+TreeReader opens an export lazily: the binary edge list is memory-mapped, the per-parent index and the
+names are only built when they are first asked for.
+"""
+import json
+import numpy as np
+from os import path
+from os import makedirs
+from xml.sax.saxutils import escape, quoteattr
+from Code.hierarchy import EDGE_DTYPE
+
+FORMATS = ('jsonl', 'graphml', 'edges')
+_GRAPHML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n' \
+                  '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n' \
+                  '  <key id="name" for="node" attr.name="name" attr.type="string"/>\n' \
+                  '  <key id="depth" for="node" attr.name="depth" attr.type="int"/>\n' \
+                  '  <key id="distance" for="edge" attr.name="distance" attr.type="double"/>\n' \
+                  '  <graph id="G" edgedefault="directed">\n'
+_GRAPHML_FOOTER = '  </graph>\n</graphml>\n'
+
+
+class TreeWriter:
+	"""
+	Se usa como context manager:
+
+		with TreeWriter('../Data/Distances/trees/mammal') as writer:
+			writer.node(offset, name, depth)
+			writer.edges(edge_block, names)
+
+	Attributes:
+		base_path (str): path de los ficheros sin la extensión
+		formats (tuple): formatos que se escriben, de FORMATS
+		buffer_edges (int): aristas que se acumulan antes de escribirlas en el fichero binario
+	"""
+
+	def __init__(self, base_path, formats=FORMATS, buffer_edges=4096):
+		for f in formats:
+			if f not in FORMATS:
+				raise ValueError('Formato ' + str(f) + ' desconocido, tiene que ser uno de ' + str(FORMATS))
+		self.base_path = base_path
+		self.formats = tuple(formats)
+		self.buffer_edges = buffer_edges
+		self.files = {}
+		self.buffer = []
+		self.n_nodes = 0
+		self.n_edges = 0
+
+	def __enter__(self):
+		directory = path.dirname(self.base_path)
+		if directory and not path.exists(directory):
+			makedirs(directory)
+		for f in self.formats:
+			self.files[f] = open(self.base_path + '.' + f, 'wb' if f == 'edges' else 'w')
+		if 'graphml' in self.files:
+			self.files['graphml'].write(_GRAPHML_HEADER)
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.flush()
+		if 'graphml' in self.files:
+			self.files['graphml'].write(_GRAPHML_FOOTER)
+		for handle in self.files.values():
+			handle.close()
+		self.files = {}
+		return False
+
+	def node(self, offset, name, depth):
+		offset = int(offset)
+		if 'jsonl' in self.files:
+			self.files['jsonl'].write(json.dumps({'type': 'node', 'offset': offset, 'name': name,
+			                                      'depth': int(depth)}) + '\n')
+		if 'graphml' in self.files:
+			self.files['graphml'].write('    <node id="n' + str(offset) + '"><data key="name">' + escape(name) +
+			                            '</data><data key="depth">' + str(int(depth)) + '</data></node>\n')
+		self.n_nodes += 1
+
+	def edge(self, parent, child, depth, distance):
+		parent, child, depth, distance = int(parent), int(child), int(depth), float(distance)
+		if 'jsonl' in self.files:
+			self.files['jsonl'].write(json.dumps({'type': 'edge', 'parent': parent, 'child': child,
+			                                      'depth': depth, 'distance': distance}) + '\n')
+		if 'graphml' in self.files:
+			self.files['graphml'].write('    <edge source=' + quoteattr('n' + str(parent)) + ' target=' +
+			                            quoteattr('n' + str(child)) + '><data key="distance">' + repr(distance) +
+			                            '</data></edge>\n')
+		if 'edges' in self.files:
+			self.buffer.append((parent, child, depth, distance))
+			if len(self.buffer) >= self.buffer_edges:
+				self.flush()
+		self.n_edges += 1
+
+	def edges(self, block, name=None):
+		"""
+		Escribe un bloque de aristas (EDGE_DTYPE) y, si se da name, el nodo hijo de cada una.
+		:param name: name(offset) -> nombre del synset
+		"""
+		for edge in block:
+			if name is not None:
+				self.node(edge['child'], name(edge['child']), edge['depth'])
+			self.edge(edge['parent'], edge['child'], edge['depth'], edge['distance'])
+
+	def flush(self):
+		if self.buffer and 'edges' in self.files:
+			np.array(self.buffer, dtype=EDGE_DTYPE).tofile(self.files['edges'])
+		self.buffer = []
+
+
+class TreeReader:
+	"""
+	Lectura perezosa de un árbol exportado con TreeWriter.
+
+	Attributes:
+		base_path (str): path de los ficheros sin la extensión
+	"""
+
+	def __init__(self, base_path):
+		self.base_path = base_path
+		self._edges = None
+		self._order = None
+		self._sorted_parents = None
+		self._names = None
+		self._depths = None
+
+	@property
+	def edges(self):
+		"""
+		Todas las aristas, array con EDGE_DTYPE mapeado en memoria.
+		"""
+		if self._edges is None:
+			edges_path = self.base_path + '.edges'
+			if path.getsize(edges_path) == 0:
+				self._edges = np.zeros(0, dtype=EDGE_DTYPE)
+			else:
+				self._edges = np.memmap(edges_path, dtype=EDGE_DTYPE, mode='r')
+		return self._edges
+
+	def __len__(self):
+		return self.edges.shape[0]
+
+	def iter_records(self):
+		"""
+		Los registros del .jsonl uno a uno, sin cargar el fichero entero.
+		"""
+		with open(self.base_path + '.jsonl') as f:
+			for line in f:
+				yield json.loads(line)
+
+	def names(self):
+		"""
+		:return: dict offset -> nombre, de los nodos del .jsonl
+		"""
+		if self._names is None:
+			self._names = {}
+			self._depths = {}
+			for record in self.iter_records():
+				if record['type'] == 'node':
+					self._names[record['offset']] = record['name']
+					self._depths[record['offset']] = record['depth']
+		return self._names
+
+	def name(self, offset):
+		return self.names().get(int(offset), str(offset))
+
+	def children(self, offset):
+		"""
+		:return: aristas que salen de offset, con EDGE_DTYPE
+		"""
+		edges = self.edges
+		if self._order is None:
+			self._order = np.argsort(edges['parent'], kind='stable')
+			self._sorted_parents = np.asarray(edges['parent'][self._order])
+		start = np.searchsorted(self._sorted_parents, offset, side='left')
+		end = np.searchsorted(self._sorted_parents, offset, side='right')
+		return edges[self._order[start:end]]
+
+	def parent(self, offset):
+		"""
+		:return: el offset del padre en el árbol, None si es la raíz o no está
+		"""
+		found = np.flatnonzero(self.edges['child'] == offset)
+		if found.shape[0] == 0:
+			return None
+		return int(self.edges['parent'][found[0]])
+
+	def level(self, depth):
+		"""
+		:return: aristas cuyo hijo está a profundidad depth
+		"""
+		return self.edges[self.edges['depth'] == depth]
+
+	def str_tree(self):
+		"""
+		El str_tree de breadth_first_search: str_tree[str(depth)][nombre del padre] = [nombres de los hijos]
+		"""
+		tree = {}
+		for edge in self.edges:
+			tree.setdefault(str(int(edge['depth'])), {}).setdefault(self.name(edge['parent']), []).append(
+				self.name(edge['child']))
+		return tree
@@ -0,0 +1,112 @@
+"""
+Pool of embedding versions that share everything that does not depend on the version.
+
+The labels, the ImageNet id tables and the label index are loaded once (SharedTables) and every Data handed
+out by the pool uses them. The matrices are kept resident while they fit in the byte budget; the least
+recently used version that nobody is using is closed to make room, and a version that does not fit even
+alone is memory-mapped instead. Versions are taken with a context manager, so they are released when the
+block ends and not whenever the garbage collector calls __del__:
+
+	with VersionPool(budget_bytes=8 << 30) as pool:
+		with pool.version(19) as data19, pool.version(25) as data25:
+			...
+"""
+import threading
+import numpy as np
+from collections import OrderedDict
+from contextlib import contextmanager
+from Code import discretize
+from Code.wordnet_imagenet_connections import Data, SharedTables
+
+
+def embedding_bytes(version):
+	"""
+	Tamaño de dmatrix de la versión, leído de la cabecera del .npy.
+	"""
+	entry = discretize.version_entry(version)
+	if entry is None:
+		raise KeyError('La versión ' + str(version) + ' no está registrada')
+	return np.load(discretize.EMBEDDINGS_DIR + entry['file'], mmap_mode='r').nbytes
+
+
+class VersionPool:
+	"""
+	Attributes:
+		budget_bytes (int): bytes que pueden ocupar en memoria las versiones cargadas
+		backend (str): backend de los Data, ver Data
+		layout (str): orden de las filas de los Data, ver Data
+		shared (SharedTables): tablas compartidas, se cargan con la primera versión
+		loaded (OrderedDict): versión -> Data, de la usada hace más tiempo a la más reciente
+		users (dict): versión -> cuántos bloques with la están usando
+	"""
+
+	def __init__(self, budget_bytes=8 << 30, backend='auto', shared=None, layout='original'):
+		self.budget_bytes = budget_bytes
+		self.backend = backend
+		self.layout = layout
+		self.shared = shared
+		self.loaded = OrderedDict()
+		self.users = {}
+		self.lock = threading.RLock()
+
+	def resident_bytes(self):
+		return sum(data.resident_bytes() for data in self.loaded.values())
+
+	def _evict(self, needed):
+		"""
+		Cierra versiones sin usar, de la menos reciente a la más, hasta que caben needed bytes más.
+		"""
+		for version in list(self.loaded):
+			if self.resident_bytes() + needed <= self.budget_bytes:
+				break
+			if self.users.get(version, 0) == 0:
+				self.loaded.pop(version).close()
+
+	def acquire(self, version):
+		"""
+		:return: Data de la versión, hay que devolverlo con release (o usar version())
+		"""
+		with self.lock:
+			if self.shared is None:
+				self.shared = SharedTables()
+			if version in self.loaded:
+				self.loaded.move_to_end(version)
+			else:
+				size = embedding_bytes(version)
+				self._evict(size)
+				mmap = self.resident_bytes() + size > self.budget_bytes
+				self.loaded[version] = Data('', version, backend=self.backend, shared=self.shared, mmap=mmap,
+				                            layout=self.layout)
+			self.users[version] = self.users.get(version, 0) + 1
+			return self.loaded[version]
+
+	def release(self, version):
+		with self.lock:
+			self.users[version] -= 1
+			# si se ha pasado del presupuesto (p.ej. por el CSR) se libera lo que ya no se usa
+			self._evict(0)
+
+	@contextmanager
+	def version(self, version):
+		data = self.acquire(version)
+		try:
+			yield data
+		finally:
+			self.release(version)
+
+	def close(self):
+		"""
+		Cierra todas las versiones cargadas, las tablas compartidas se mantienen.
+		"""
+		with self.lock:
+			for data in self.loaded.values():
+				data.close()
+			self.loaded.clear()
+			self.users.clear()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+		return False
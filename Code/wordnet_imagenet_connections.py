@@ -1,13 +1,103 @@
 import numpy as np
-from nltk.corpus import wordnet as wn
-from itertools import combinations
 import _pickle as pickle
 from os import path
 from os import makedirs
-import matplotlib.pyplot as plt
 import gc
-from scipy import stats as st
 import json
+from Code import fne_core
+from Code import checkpoint
+from Code import outliers
+from Code import sparse_backend
+from Code import enrichment
+from Code import approximate
+from Code import bootstrap
+from Code import discretize
+from Code import row_layout
+from Code import id_tables
+from Code import hierarchy
+from Code.atlas import Atlas
+from Code.bitmap_index import BitmapIndex
+from Code.clustering import Clustering
+from Code.feature_correlation import FeatureCorrelation
+from Code.id_tables import get_id_tables
+from Code.lazy_imports import wn, plt
+
+# layers[string correspondiente al layer] = [inicio del layer, final del layer]
+LAYERS = {
+	'conv1_1': [0, 64],  # 1
+	'conv1_2': [64, 128],  # 2
+	'conv2_1': [128, 256],  # 3
+	'conv2_2': [256, 384],  # 4
+	'conv3_1': [384, 640],  # 5
+	'conv3_2': [640, 896],  # 6
+	'conv3_3': [896, 1152],  # 7
+	'conv4_1': [1152, 1664],  # 8
+	'conv4_2': [1664, 2176],  # 9
+	'conv4_3': [2176, 2688],  # 10
+	'conv5_1': [2688, 3200],  # 11
+	'conv5_2': [3200, 3712],  # 12
+	'conv5_3': [3712, 4224],  # 13
+	'fc6': [4224, 8320],  # 14
+	'fc7': [8320, 12416],  # 15
+	'conv1': [0, 128],  # 16
+	'conv2': [128, 384],  # 17
+	'conv3': [384, 1152],  # 18
+	'conv4': [1152, 2688],  # 19
+	'conv5': [2688, 4224],  # 20
+	'conv': [0, 4224],  # 21
+	'fc6tofc7': [4224, 12416],  # 23
+	# 'all':[0,12416]          # 24
+}
+# layers de la red sin solaparse
+REDUCED_LAYERS = {
+	'conv1': [0, 128],
+	'conv2': [128, 384],
+	'conv3': [384, 1152],
+	'conv4': [1152, 2688],
+	'conv5': [2688, 4224],
+	'fc6': [4224, 8320],
+	'fc7': [8320, 12416]
+}
+
+
+class SharedTables:
+	"""
+	Las partes de Data que no dependen de la versión del embedding, para compartirlas entre versiones
+	(ver version_pool).
+
+	Attributes:
+		labels (np.array): label de cada imagen
+		ids (IdTables): tablas de ids de imagenet
+		imagenet_all_ids (np.array): ids.imagenet_ids, imagenet_all_ids[label] = 'n01440764'
+		all_synsets_and_sons (np.array): offsets de los synsets de imagenet y sus hipónimos
+		all_synsets_and_sons_set (OffsetBitset): los mismos como bitset
+	"""
+
+	def __init__(self, imagenet_id_path="../Data/Distances/Common_Data/synsets_in_imagenet.txt",
+	             labels_path='../Data/Embeddings/labels.npy'):
+		self.imagenet_id_path = imagenet_id_path
+		self.labels = np.load(labels_path)
+		self.ids = get_id_tables(imagenet_id_path=self.imagenet_id_path)
+		# los ids de imagenet de cada label ya están en las tablas, no se vuelve a leer el txt
+		self.imagenet_all_ids = self.ids.imagenet_ids
+		self.all_synsets_and_sons = hierarchy.all_synsets_and_sons(self.ids.offsets)
+		self.all_synsets_and_sons_set = hierarchy.OffsetBitset(self.all_synsets_and_sons)
+		print(len(self.all_synsets_and_sons), 'synsets de imagenet y sus hiponimos')
+		self.label_rows = None
+		self.row_layout = None
+
+	def get_label_rows(self):
+		if self.label_rows is None:
+			self.label_rows = approximate.label_rows(self.labels, len(self.ids))
+		return self.label_rows
+
+	def get_row_layout(self):
+		"""
+		RowLayout con las filas ordenadas por label en orden DFS de WordNet, igual para todas las versiones.
+		"""
+		if self.row_layout is None:
+			self.row_layout = row_layout.RowLayout.load_or_build(self.labels, self.ids, hierarchy.get_hyponym_dag())
+		return self.row_layout
 
 
 class Data:
@@ -22,127 +112,276 @@ class Data:
 			layers[string correspondiente al layer] = [inicio del layer, final del layer]
 
 		 labels ()
+		backend (str): 'dense' o 'sparse', cómo se hacen los conteos sobre dmatrix (ver sparse_backend)
 
 		 :parameter version = Version del embedding que utilizo
 	"""
 
-	def __init__(self, my_path, version=25):
+	def __init__(self, my_path, version=25, backend='auto', shared=None, mmap=False, layout='original'):
 		"""
 
-		:param version: Es la versión del embedding que queremos cargar (25,31,19)
+		:param version: Es la versión del embedding que queremos cargar (25,31,19 o una generada con discretize)
+		:param backend: 'dense', 'sparse' o 'auto' para elegirlo según la densidad medida del embedding
+		:param shared: SharedTables con las partes que no dependen de la versión, se cargan si es None
+		:param mmap: mapear dmatrix en memoria en vez de cargarla entera (con el backend sparse se mapea siempre)
+		:param layout: 'original' o 'label' para usar las filas ordenadas por label (ver row_layout), así las
+			imágenes de un synset son unos pocos rangos contiguos de dmatrix
 		"""
-		self.version = version
-		_embedding_path = "../Data/Embeddings/vgg16_ImageNet_ALLlayers_C1avg_imagenet_train.npz"
-		self.imagenet_id_path = "../Data/Distances/Common_Data/synsets_in_imagenet.txt"
-		if version == 25:
-			_embedding = 'vgg16_ImageNet_imagenet_C1avg_E_FN_KSBsp0.15n0.25_Gall_train_.npy'
-		elif version == 19:
-			_embedding = 'vgg16_ImageNet_imagenet_C1avg_E_FN_KSBsp0.11n0.19_Gall_train_.npy'
-		elif version == 31:
-			_embedding = 'vgg16_ImageNet_imagenet_C1avg_E_FN_KSBsp0.19n0.31_Gall_train_.npy'
-		else:
-			_embedding = path
+		if shared is None:
+			shared = SharedTables()
+		self.imagenet_id_path = shared.imagenet_id_path
+		entry = discretize.version_entry(version)
+		if entry is None:
 			print('No has puesto un embedding válido, usando el de defoult (25)')
-		self.discretized_embedding_path = '../Data/Embeddings/' + _embedding
-		print('Estamos usando ' + _embedding[-20:-16])
-		# embedding = np.load(_embedding_path)
-		self.labels = np.load('../Data/Embeddings/labels.npy')
+			version = discretize.DEFAULT_VERSION
+			entry = discretize.version_entry(version)
+		self.version = version
+		self.discretized_embedding_path = discretize.EMBEDDINGS_DIR + entry['file']
+		print('Estamos usando la versión ' + str(version) + ' (sp ' + str(entry['sp']) + ', n ' + str(entry['n']) +
+		      ')')
+		# el embedding continuo (discretize.CONTINUOUS_PATH) se discretiza en nuevas versiones con discretize
+		self.shared = shared
+		self.layout = layout
+		self.labels = shared.labels
+		self.label_rows = None
+		# sufijo de los ficheros que guardan números de fila, que dependen del orden
+		self.layout_suffix = ''
+		if layout == 'label':
+			layout_rows = shared.get_row_layout()
+			self.layout_suffix = '_bylabel'
+			original_path = self.discretized_embedding_path
+			self.discretized_embedding_path = original_path[:-len('.npy')] + self.layout_suffix + '.npy'
+			if not path.isfile(self.discretized_embedding_path):
+				layout_rows.reorder(np.load(original_path, mmap_mode='r'), self.discretized_embedding_path)
+			self.labels = shared.labels[layout_rows.permutation]
+		elif layout != 'original':
+			raise ValueError("layout tiene que ser 'original' o 'label', no " + str(layout))
 		# self.matrix = self.embedding['data_matrix']
-		self.dmatrix = np.array(np.load(self.discretized_embedding_path))
-		self.imagenet_all_ids = np.genfromtxt(self.imagenet_id_path, dtype=np.str)
+		# el backend se decide sobre la matriz mapeada: con el sparse solo el CSR ocupa memoria y dmatrix se queda
+		# mapeada para lo que aún la recorre (bitmaps, correlaciones, layout)
+		self.dmatrix = np.load(self.discretized_embedding_path, mmap_mode='r')
+		if backend == 'auto':
+			backend = sparse_backend.choose_backend(self.dmatrix)
+		if not mmap and backend == 'dense':
+			self.dmatrix = np.array(self.dmatrix)
+		self.imagenet_all_ids = shared.imagenet_all_ids
+		self.ids = shared.ids
 		self.features_category = [-1, 0, 1]
 		self.colors = ['#3643D2', 'c', '#722672', '#BF3FBF']
-		self.layers = {
-			'conv1_1': [0, 64],  # 1
-			'conv1_2': [64, 128],  # 2
-			'conv2_1': [128, 256],  # 3
-			'conv2_2': [256, 384],  # 4
-			'conv3_1': [384, 640],  # 5
-			'conv3_2': [640, 896],  # 6
-			'conv3_3': [896, 1152],  # 7
-			'conv4_1': [1152, 1664],  # 8
-			'conv4_2': [1664, 2176],  # 9
-			'conv4_3': [2176, 2688],  # 10
-			'conv5_1': [2688, 3200],  # 11
-			'conv5_2': [3200, 3712],  # 12
-			'conv5_3': [3712, 4224],  # 13
-			'fc6': [4224, 8320],  # 14
-			'fc7': [8320, 12416],  # 15
-			'conv1': [0, 128],  # 16
-			'conv2': [128, 384],  # 17
-			'conv3': [384, 1152],  # 18
-			'conv4': [1152, 2688],  # 19
-			'conv5': [2688, 4224],  # 20
-			'conv': [0, 4224],  # 21
-			'fc6tofc7': [4224, 12416],  # 23
-			# 'all':[0,12416]          # 24
-		}
-		self.reduced_layers = {
-			'conv1': [0, 128],
-			'conv2': [128, 384],
-			'conv3': [384, 1152],
-			'conv4': [1152, 2688],
-			'conv5': [2688, 4224],
-			'fc6': [4224, 8320],
-			'fc7': [8320, 12416]
-		}
-		_all_synsets_and_sons_path = '../Data/Distances/Common_Data/all_synsets_and_sons.pkl'
-		self.all_synsets_and_sons = []
-		if path.isfile(_all_synsets_and_sons_path):
-			self.all_synsets_and_sons = pickle.load(open(_all_synsets_and_sons_path, 'rb'))
-			print(len(self.all_synsets_and_sons), self.all_synsets_and_sons)
-		else:
-			self.all_synsets_and_sons = self.all_synsets_and_sons_gen()
+		self.layers = dict(LAYERS)
+		self.reduced_layers = dict(REDUCED_LAYERS)
+		self.all_synsets_and_sons = shared.all_synsets_and_sons
+		self.all_synsets_and_sons_set = shared.all_synsets_and_sons_set
+		self.atlas = None
+		self.bitmap_index = None
+		self.feature_correlation = None
+		self.sparse = None
+		self.backend = backend
+		print('Usando el backend ' + backend)
 
 	def get_wn_ss(self, imagenet_id):
-		return wn.of2ss(imagenet_id[1:] + '-' + imagenet_id[0])
+		return id_tables.get_wn_ss(imagenet_id)
 
 	def get_in_id(self, wordnet_ss):
-		wn_id = wn.ss2of(wordnet_ss)
-		return wn_id[-1] + wn_id[:8]
+		return id_tables.get_in_id(wordnet_ss)
 
 	def get_wn_id(self, imagenet_id):
-		return imagenet_id[1:] + '-' + imagenet_id[0]
+		return id_tables.get_wn_id(imagenet_id)
 
 	def ss_to_text(self, synset):
 		""" returns the string of the name of the input synset"""
-		return str(synset)[8:-7]
+		return id_tables.ss_to_text(synset)
+
+	def matrix_shape(self):
+		return self.dmatrix.shape
 
 	def wn_id_to_label(self):
-		_path = '../Data/Distances/Common_Data/'
-		if path.isfile(_path + 'wordnet_to_label.pkl'):
-			wordnet_to_label = pickle.load(open(_path + 'wordnet_to_label.pkl', 'rb'))
+		"""
+		:return: dict wordnet_to_label[offset] = label
+		"""
+		return dict(zip(self.ids.offsets.tolist(), range(len(self.ids))))
 
-		else:
-			label_to_wordnet = pickle.load(open(_path + 'imagenet_label_to_wordnet_synset.pkl', 'rb'))
-			wordnet_to_label = {}
-			for i in range(0, 1000):
-				wordnet_to_label[label_to_wordnet[i]['id']] = i
-			with open(_path + 'wordnet_to_label.pkl', 'wb') as handle:
-				pickle.dump(wordnet_to_label, handle)
+	def synset_name(self, offset):
+		""" nombre del synset a partir de su offset de WordNet, del snapshot de WordNet si está generado """
+		snapshot = hierarchy.get_snapshot()
+		if snapshot is not None and offset in snapshot:
+			return snapshot.name(offset)
+		return self.ids.name(offset)
 
 	def all_synsets_and_sons_gen(self):
 		"""
-		This function calculates all the synsets and their hyponims presents in imagenet and saves it in a pickle.
-		:return: np array with the synsets and their hyponims
+		This function calculates all the synsets and their hyponims presents in imagenet, with one memoized pass
+		over the hyponym DAG, and saves them as a sorted array of offsets.
+		:return: np array with the offsets of the synsets and their hyponims
+		"""
+		synsets = hierarchy.get_hyponym_dag().closure_of(self.ids.offsets)
+		np.save('../Data/Distances/Common_Data/all_synsets_and_sons.npy', synsets)
+		return synsets
+
+	def get_atlas(self):
+		"""
+		Atlas con los conteos y representantes de todos los synsets con imagenes, se carga o se genera la
+		primera vez que se pide.
 		"""
-		with open("../Data/Distances/Common_Data/synsets_in_imagenet.txt") as f:
-			content = f.readlines()
+		if self.atlas is None:
+			self.atlas = Atlas.load_or_build(self)
+		return self.atlas
 
-		imagenet_ids = [x.strip() for x in content]
+	def get_sparse(self):
+		"""
+		dmatrix en CSR (+1 y -1), se carga del disco o se genera y se guarda la primera vez.
+		"""
+		if self.sparse is None:
+			csr_path = self.discretized_embedding_path[:-len('.npy')] + '_csr.npz'
+			if path.isfile(csr_path):
+				self.sparse = sparse_backend.TernaryCSR.load(csr_path)
+			else:
+				self.sparse = sparse_backend.TernaryCSR.from_dense(self.dmatrix)
+				self.sparse.save(csr_path)
+		return self.sparse
 
-		synsets = []
-		for i in imagenet_ids:
-			synset = self.get_wn_ss(i)
-			synsets.append(self.get_in_id(synset))
-			hypo = lambda s: s.hyponyms()
-			for thing in list(synset.closure(hypo)):
-				synsets.append(self.get_in_id(thing))
-		with open('../Data/Distances/Common_Data/all_synsets_and_sons.pkl', 'wb') as handle:
-			pickle.dump(synsets, handle)
-		return synsets
+	def count_features(self, rows=None):
+		"""
+		Cantidad de features de cada tipo de las filas rows de dmatrix (todas si es None).
+		:return: features[category] = cantidad
+		"""
+		if self.backend == 'sparse':
+			return self.get_sparse().count_features(rows)
+		if rows is None:
+			return fne_core.count_features(self.dmatrix)
+		return fne_core.count_features(self.dmatrix[rows, :])
+
+	def category_counts(self, rows=None):
+		"""
+		:return: array [features, 3] con los conteos de -1, 0 y 1 de las filas rows (todas si es None)
+		"""
+		if self.backend == 'sparse':
+			return self.get_sparse().category_counts(rows)
+		if rows is None:
+			return fne_core.category_counts(self.dmatrix)
+		return fne_core.category_counts(self.dmatrix[rows, :])
+
+	def label_category_counts(self):
+		"""
+		:return: int32 [labels, features, 3], los conteos de cada categoría por label y feature
+		"""
+		if self.backend == 'sparse':
+			return self.get_sparse().label_category_counts(self.labels, len(self.ids))
+		if self.layout == 'label':
+			# cada label es un rango contiguo de filas
+			layout_rows = self.shared.get_row_layout()
+			counts = np.zeros((len(self.ids), self.dmatrix.shape[1], 3), dtype=np.int32)
+			for k, label in enumerate(layout_rows.label_order.tolist()):
+				rows = slice(int(layout_rows.bounds[k]), int(layout_rows.bounds[k + 1]))
+				counts[label] = row_layout.slices_category_counts(self.dmatrix, [rows])
+			return counts
+		return fne_core.label_category_counts(self.dmatrix, self.labels, len(self.ids))
+
+	def get_label_rows(self):
+		"""
+		(order, bounds) de approximate.label_rows: las filas del label l son order[bounds[l]:bounds[l + 1]]
+		"""
+		if self.layout == 'original':
+			return self.shared.get_label_rows()
+		if self.label_rows is None:
+			self.label_rows = approximate.label_rows(self.labels, len(self.ids))
+		return self.label_rows
+
+	def synset_labels(self, offset, hyponyms_only=True):
+		dag = hierarchy.get_hyponym_dag()
+		offsets = dag.hyponym_offsets(offset) if hyponyms_only else dag.descendants(offset)
+		return self.ids.labels_of_offsets(offsets)
+
+	def synset_rows(self, offset, hyponyms_only=True):
+		"""
+		Filas de dmatrix de las imágenes del synset (en el orden de layout).
+		:param hyponyms_only: sin el label del propio synset, como get_index_from_ss
+		"""
+		if self.layout == 'label':
+			return row_layout.slice_rows(self.synset_slices(offset, hyponyms_only))
+		return fne_core.rows_of_labels(self.labels, self.synset_labels(offset, hyponyms_only), len(self.ids))
+
+	def synset_slices(self, offset, hyponyms_only=True):
+		"""
+		Las filas del synset como una lista de slices de dmatrix, solo con layout 'label'.
+		"""
+		if self.layout != 'label':
+			raise ValueError("synset_slices necesita layout='label'")
+		return self.shared.get_row_layout().label_slices(self.synset_labels(offset, hyponyms_only))
+
+	def synset_category_counts(self, offset, hyponyms_only=True):
+		"""
+		Conteos [features, 3] de las imágenes del synset. Con layout 'label' y el backend denso se suman los
+		de cada rango de filas sin copiar la submatriz.
+		"""
+		if self.layout == 'label' and self.backend == 'dense':
+			return row_layout.slices_category_counts(self.dmatrix, self.synset_slices(offset, hyponyms_only))
+		return self.category_counts(self.synset_rows(offset, hyponyms_only))
+
+	def approximate_representative(self, offset, hyponyms_only=True, **kwargs):
+		"""
+		Representante aproximado a partir de una muestra estratificada por label (ver approximate), sin
+		necesidad del atlas.
+		:param kwargs: fraction, min_per_label, target, max_rounds, seed de approximate_representative
+		:return: (rep, confidence) con confidence[feature] = confianza de que la moda de la muestra es la real
+		"""
+		order, bounds = self.get_label_rows()
+		rep, confidence, _ = approximate.approximate_representative(self.dmatrix, order, bounds,
+		                                                            self.synset_labels(offset, hyponyms_only),
+		                                                            **kwargs)
+		return rep, confidence
+
+	def get_bitmap_index(self):
+		"""
+		Índice de bitmaps de las features y los synsets para hacer consultas booleanas (ver bitmap_index),
+		se carga o se genera la primera vez que se pide.
+		"""
+		if self.bitmap_index is None:
+			self.bitmap_index = BitmapIndex.load_or_build(self)
+		return self.bitmap_index
+
+	def get_feature_correlation(self, **kwargs):
+		"""
+		Agreement y correlación entre todas las features (ver feature_correlation), mapeadas desde disco. Se
+		cargan o se calculan la primera vez que se piden.
+		:param kwargs: tile, workers, words_chunk de FeatureCorrelation.build
+		"""
+		if self.feature_correlation is None:
+			self.feature_correlation = FeatureCorrelation.load_or_build(self, **kwargs)
+		return self.feature_correlation
+
+	def resident_bytes(self):
+		"""
+		Bytes de esta versión que están en memoria: dmatrix si no está mapeada y el CSR si se ha cargado.
+		"""
+		total = 0
+		if self.dmatrix is not None and not isinstance(self.dmatrix, np.memmap):
+			total += self.dmatrix.nbytes
+		if self.sparse is not None:
+			for csr in (self.sparse.positive, self.sparse.negative):
+				total += csr.indptr.nbytes + csr.indices.nbytes
+		return total
+
+	def close(self):
+		"""
+		Suelta la matriz y los índices de esta versión. Las tablas compartidas (shared) no se tocan.
+		"""
+		self.__del__()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+		return False
 
 	def __del__(self):
+		self.atlas = None
+		self.bitmap_index = None
+		self.feature_correlation = None
+		self.sparse = None
+		self.shared = None
+		self.label_rows = None
 		self.embedding = None
 		self.dmatrix = None
 		self.version = None
@@ -154,12 +393,65 @@ class Data:
 		gc.collect()
 
 
+class AggregateData:
+	"""
+	Lo que necesitan los plots de Statistics sin cargar dmatrix: los conteos salen del atlas guardado (que tiene
+	que estar generado) y el resto de tablas pequeñas. Sirve para volver a hacer los plots y el latex a partir
+	de los agregados guardados, con render_report de experiments.
+
+	Attributes:
+		version (int): versión del embedding
+		atlas (Atlas): cargado del disco, con los arrays grandes mapeados
+	"""
+
+	def __init__(self, version=25):
+		atlas_dir = Atlas.atlas_dir(version)
+		if not path.isfile(atlas_dir + 'ones_proportion.npy'):
+			raise IOError('No hay atlas de la versión ' + str(version) + ' en ' + atlas_dir +
+			              ', hay que generarlo con Data(version).get_atlas()')
+		self.version = version
+		self.atlas = Atlas.load(atlas_dir)
+		self.ids = get_id_tables()
+		self.features_category = [-1, 0, 1]
+		self.colors = ['#3643D2', 'c', '#722672', '#BF3FBF']
+		self.layers = dict(LAYERS)
+		self.reduced_layers = dict(REDUCED_LAYERS)
+
+	def get_atlas(self):
+		return self.atlas
+
+	def synset_name(self, offset):
+		snapshot = hierarchy.get_snapshot()
+		if snapshot is not None and offset in snapshot:
+			return snapshot.name(offset)
+		return self.ids.name(offset)
+
+	def ss_to_text(self, synset):
+		return id_tables.ss_to_text(synset)
+
+	def matrix_shape(self):
+		label_sizes = np.asarray(self.atlas.label_counts[:, 0, :]).sum(axis=-1, dtype=np.int64)
+		return int(label_sizes.sum()), self.atlas.counts.shape[1]
+
+	def count_features(self, rows=None):
+		"""
+		Conteos de todo el embedding: los del nodo del atlas que tiene todos los labels (la raíz), o la suma de
+		los de cada label si no hay ninguno.
+		"""
+		if rows is not None:
+			raise ValueError('Sin dmatrix solo se pueden contar todas las filas')
+		root = int(np.argmax(self.atlas.sizes))
+		if self.atlas.membership[root].all():
+			return fne_core.counts_to_dict(self.atlas.counts[root])
+		return fne_core.counts_to_dict(np.asarray(self.atlas.label_counts).sum(axis=0, dtype=np.int64))
+
+
 class Statistics:
 	def __init__(self, synsets, data):
 		"""
 			Esta clase genera todas las estadísticas para un conjunto de synsets
 		:param synsets: conjunto de synset del que queremos calcualr las estadísticas
-		:param synset_in_data[ss_to_text(synset)] =  cantidad de elementos del synset en el total
+		:param synset_in_data[offset del synset] =  cantidad de elementos del synset en el total
 				synset_in_data['total']
 		:param dir_path es el path donde se guardaran todos los datos generados
 		:param plot_path es el path donde se guardaran los plots
@@ -167,7 +459,8 @@ class Statistics:
 		"""
 		self.data = data
 		self.synsets = synsets
-		self.textsynsets = [str(s)[8:-7] for s in synsets]
+		self.textsynsets = [self.ss_to_text(s) for s in synsets]
+		self.offsets = [s.offset() for s in synsets]
 		self.dir_path = '../Data/' + str(self.textsynsets) + str(data.version) + '/'
 		self.plot_path = self.dir_path + 'plots/'
 		if not path.exists(self.dir_path):
@@ -175,9 +468,9 @@ class Statistics:
 		if not path.exists(self.plot_path):
 			makedirs(self.plot_path)
 		self.stats_path = self.dir_path + str(self.textsynsets) + '_stats.txt'
-		self.matrix_size = self.data.dmatrix.shape
+		self.matrix_size = self.data.matrix_shape()
 		self.total_features = self.matrix_size[0] * self.matrix_size[1]
-		self.all_features = self.count_features(self.data.dmatrix)
+		self.all_features = self.data.count_features()
 		self.synset_in_data = {}
 		self.features_per_synset_path = self.dir_path + 'features_per_synset' + '.pkl'
 		self.features_per_synset = {}
@@ -194,6 +487,11 @@ class Statistics:
 		self.features_per_image = {}
 		self.intra_synset = {}
 		self.intra_synset_path = self.dir_path + 'intra_synset' + str(self.textsynsets) + '.pkl'
+		self.intra_synset_matrix_path = self.dir_path + 'intra_synset_matrix' + '.npy'
+		self.intra_agreement_path = self.dir_path + 'intra_agreement' + str(self.textsynsets) + '.pkl'
+		self.enrichment_path = self.dir_path + 'enrichment' + '.npy'
+		# representantes aproximados (approximate) en vez de los exactos del atlas
+		self.approximate = False
 		self.outlier_path = self.dir_path + 'outliers.txt'
 		pathu = self.dir_path + 'latex'
 		latex_file = open(pathu, 'w')
@@ -202,7 +500,6 @@ class Statistics:
 		stats_file = open(self.stats_path, 'w')
 		stats_file.write('')
 		stats_file.close()
-		plt.rcParams['figure.figsize'] = [8.0, 8.0]
 
 	def get_in_id(self, wordnet_ss):
 		"""
@@ -210,38 +507,29 @@ class Statistics:
 		:param wordnet_ss:
 		:return: imagenet id
 		"""
-		# Esta funcion genera la id de imagenet a partir del synset de wordnet
-		wn_id = wn.ss2of(wordnet_ss)
-		return wn_id[-1] + wn_id[:8]
+		return id_tables.get_in_id(wordnet_ss)
 
 	def ss_to_text(self, synset):
 		""" devuelve el string del nombre del synset en cuestion"""
-		return str(synset)[8:-7]
+		return id_tables.ss_to_text(synset)
+
+	def key_to_text(self, key):
+		""" nombre para mostrar de una clave de los diccionarios internos (offset o 'total') """
+		if isinstance(key, str):
+			return key
+		return self.data.synset_name(key)
 
 	def get_index_from_ss(self, synset):
 		"""
 		Esta función genera un archivo con los índices(0:999) de la aparición de un synset y sus hiponimos
 		y otro con los códigos imagenet de todos los hipónimos
 		"""
-		ss_path = self.dir_path + self.ss_to_text(synset) + '_index_hyponim' + '.npy'
+		ss_path = self.dir_path + self.ss_to_text(synset) + '_index_hyponim' + self.data.layout_suffix + '.npy'
 		if path.isfile(ss_path):
 			index = np.load(ss_path)
 			return index
 		else:
-			hypo = lambda s: s.hyponyms()
-			hyponim_file = open(ss_path, "w")
-			synset_list = []
-			for thing in list(synset.closure(hypo)):
-				hyponim_file.write(self.get_in_id(thing) + '\n')
-				synset_list.append(self.get_in_id(thing))
-
-			index = []
-			hyponim_file.close()
-			i = 0
-			for lab in self.data.labels:
-				if self.data.imagenet_all_ids[lab] in synset_list:
-					index.append(i)
-				i += 1
+			index = self.data.synset_rows(synset.offset(), hyponyms_only=True)
 			np.save(ss_path, index)
 			return index
 
@@ -295,7 +583,7 @@ class Statistics:
 		"""
 		This function generates a dictionary with the basic stats
 		devuelve synset_in_data donde:
-		synset_in_data[ss_to_text(synset)] = cantidad de elementos del synset en los datos
+		synset_in_data[offset del synset] = cantidad de elementos del synset en los datos
 		synset_in_data['total'] =  cantidad total de elementos
 
 		"""
@@ -304,14 +592,8 @@ class Statistics:
 		labels_size = self.data.labels.shape[0]
 		self.synset_in_data['total'] = labels_size
 		for synset in self.synsets:
-			synset_path = self.dir_path + self.ss_to_text(synset) + '.txt'
-			index_path = self.dir_path + self.ss_to_text(synset) + '_index' + '.txt'
-			if path.isfile(index_path):
-				index = np.genfromtxt(index_path, dtype=np.int)
-			else:
-				self.get_index_from_ss(synset)
-				index = np.genfromtxt(index_path, dtype=np.int)
-			self.synset_in_data[self.ss_to_text(synset)] = index.shape[0]
+			index = self.get_index_from_ss(synset)
+			self.synset_in_data[synset.offset()] = index.shape[0]
 			text = 'Tenemos ' + str(labels_size) + ' imagenes, de las cuales ' + str(float(index.shape[0])) + \
 			       ', el ' + str(float(index.shape[0]) / labels_size * 100) + ' son ' + self.ss_to_text(synset) + '\n'
 			stats_file.write(text)
@@ -326,9 +608,12 @@ class Statistics:
 		"""
 		plt.rcParams['figure.figsize'] = [12.0, 8.0]
 		if len(self.synset_in_data) == 0:
-			self.synset_in_data_gen()
+			if path.isfile(self.synset_in_data_path):
+				self.synset_in_data = pickle.load(open(self.synset_in_data_path, 'rb'))
+			else:
+				self.synset_in_data_gen()
 		plt.bar(range(len(self.synset_in_data)), self.synset_in_data.values(), align='center')
-		plt.xticks(range(len(self.synset_in_data)), self.synset_in_data.keys())
+		plt.xticks(range(len(self.synset_in_data)), [self.key_to_text(k) for k in self.synset_in_data.keys()])
 		plt.title('Distribution of the synsets in the data')
 		plt.xlabel('synsets')
 		plt.ylabel('Quantity of synsets')
@@ -344,7 +629,7 @@ class Statistics:
 			if k != 'total':
 				_aux[k] = self.synset_in_data[k]
 
-		plt.pie([float(v) for v in _aux.values()], labels=[k for k in _aux.keys()],
+		plt.pie([float(v) for v in _aux.values()], labels=[self.key_to_text(k) for k in _aux.keys()],
 		        autopct=None)
 		plt.title('Distribution of the synsets in the data')
 		plt.grid()
@@ -360,11 +645,7 @@ class Statistics:
 		Devuelve un diccionario con la cantidad de features de cada tipo de la matriz matrix
 		features[category] = cantidad de category de la matriz
 		"""
-		features = {-1: 0, 0: 0, 1: 0}
-		features[1] += np.sum(np.equal(matrix, 1))
-		features[-1] += np.sum(np.equal(matrix, -1))
-		features[0] += np.sum(np.equal(matrix, 0))
-		return features
+		return fne_core.count_features(matrix)
 
 	def plot_all_features(self):
 		"""
@@ -414,17 +695,10 @@ class Statistics:
 			self.all_features[1] / self.total_features * 100) + ' %'
 		stats_file.write(text)
 		for synset in self.synsets:
-			synset_path = self.dir_path + self.ss_to_text(synset) + '.txt'
-			index_path = self.dir_path + self.ss_to_text(synset) + '_index' + '.txt'
-			# TODO: ARREGLAR ESTO
-			if path.isfile(index_path):
-				index = np.genfromtxt(index_path, dtype=np.int)
-			else:
-				self.get_index_from_ss(synset)
-				index = np.genfromtxt(index_path, dtype=np.int)
-
-			self.features_per_synset[self.ss_to_text(synset)] = self.count_features(self.data.dmatrix[index, :])
-			synset_total_features = len(index) * self.matrix_size[1]
+			# con layout 'label' se cuenta sobre rangos contiguos de dmatrix, sin copiar la submatriz
+			counts = self.data.synset_category_counts(synset.offset(), hyponyms_only=True)
+			self.features_per_synset[synset.offset()] = fne_core.counts_to_dict(counts)
+			synset_total_features = int(counts[0].sum()) * self.matrix_size[1]
 			"""
 			Esta parte con el cambio que he hecho iba a petar
 			text = '\nEn el ' + self.ss_to_text(synset) + ' tenemos ' + str(synset_total_features) + 'features en total : ' \
@@ -449,10 +723,10 @@ class Statistics:
 			self.features_per_synset = pickle.load(open(self.features_per_synset_path, 'rb'))
 
 		for synset in self.synsets:
-			plt.bar(range(len(self.features_per_synset[self.ss_to_text(synset)])),
-			        self.features_per_synset[self.ss_to_text(synset)].values(), align='center')
-			plt.xticks(range(len(self.features_per_synset[self.ss_to_text(synset)])),
-			           self.features_per_synset[self.ss_to_text(synset)].keys())
+			plt.bar(range(len(self.features_per_synset[synset.offset()])),
+			        self.features_per_synset[synset.offset()].values(), align='center')
+			plt.xticks(range(len(self.features_per_synset[synset.offset()])),
+			           self.features_per_synset[synset.offset()].keys())
 			plt.title('Quantity of features per synset of ' + self.ss_to_text(synset))
 			plt.xlabel('Categories')
 			plt.ylabel('Quantity of features')
@@ -465,46 +739,81 @@ class Statistics:
 			plt.close()
 
 	def compare_intra_embedding(self, synset):
-		index_path = self.dir_path + self.ss_to_text(synset) + '_index' + '.txt'
-		syn_index = np.genfromtxt(index_path, dtype=np.int)
-		total = 0
-		for i, j in combinations(syn_index, 2):
-			total += np.sum(np.equal(self.data.dmatrix[i, :], self.data.dmatrix[j, :]))
-		return total
+		"""
+		Cantidad de coincidencias (mismo valor en la misma feature) entre todos los pares de imágenes del synset.
+		Se calcula a partir de los conteos por feature del atlas, ver fne_core.agreeing_pairs.
+		:return: total (int)
+		"""
+		counts = self.data.get_atlas().node_counts(synset.offset(), hyponyms_only=True)
+		if counts is None:
+			return 0
+		return int(fne_core.agreeing_pairs(counts).sum())
+
+	def intra_embedding_agreement(self, synset):
+		"""
+		compare_intra_embedding con el desglose por layer y normalizado entre 0 y 1:
+		score = coincidencias / (pares de imágenes * features)
+		:return: dict con 'images', 'pairs', 'agreeing', 'score' y 'layers'[layer] = {'agreeing', 'score'}
+		"""
+		counts = self.data.get_atlas().node_counts(synset.offset(), hyponyms_only=True)
+		n_images = 0 if counts is None else int(counts[0].sum())
+		pairs = n_images * (n_images - 1) // 2
+		per_feature = np.zeros(self.matrix_size[1], dtype=np.int64)
+		if counts is not None:
+			per_feature = fne_core.agreeing_pairs(counts)
+		agreement = {'images': n_images, 'pairs': pairs, 'agreeing': int(per_feature.sum()),
+		             'score': per_feature.sum() / (pairs * per_feature.shape[0]) if pairs else None, 'layers': {}}
+		for layer, (start, end) in self.data.reduced_layers.items():
+			agreeing = int(per_feature[start:end].sum())
+			agreement['layers'][layer] = {'agreeing': agreeing,
+			                              'score': agreeing / (pairs * (end - start)) if pairs else None}
+		return agreement
+
+	def intra_embedding_agreement_gen(self):
+		"""
+		intra_embedding_agreement de todos los synsets del grupo, se guarda en intra_agreement_path.
+		:return: dict agreement[offset del synset] = intra_embedding_agreement(synset)
+		"""
+		agreement = {}
+		stats_file = open(self.stats_path, 'a')
+		for synset in self.synsets:
+			agreement[synset.offset()] = self.intra_embedding_agreement(synset)
+			stats_file.write('Coincidencia interna de ' + self.ss_to_text(synset) + ': ' +
+			                 str(agreement[synset.offset()]['score']) + '\n')
+		stats_file.close()
+		with open(self.intra_agreement_path, 'wb') as handle:
+			pickle.dump(agreement, handle)
+		return agreement
 
 	def intra_synset_gen(self):
 		"""
 		Genera un diccionario con la relacion interna de los synsets:
 
 		dict[synset][synsethijo] = cantidad de synset hijo en synset
-		:return:
-		"""
-		j = 0
+		Todos los pares salen de un solo producto de matrices (fne_core.containment_matrix) con los labels de
+		cada synset (solo hipónimos, como get_index_from_ss). La matriz entera se guarda en intra_synset_matrix_path.
+		:return: containment [synsets, synsets], containment[i, j] = imágenes de synsets[j] que están en synsets[i]
+		"""
+		membership = self.data.get_atlas().membership_of(self.offsets, hyponyms_only=True)
+		label_sizes = np.bincount(self.data.labels, minlength=len(self.data.ids))
+		containment = fne_core.containment_matrix(membership, label_sizes)
+		np.save(self.intra_synset_matrix_path, containment)
 		stats_file = open(self.stats_path, 'a')
-		total_embeddings_communes = []
-		trol = 0
 		self.intra_synset = {}
-		for synset in self.synsets:
-			index_path = self.dir_path + self.ss_to_text(synset) + '_index' + '.txt'
-			syn_index = np.genfromtxt(index_path, dtype=np.int)
-			# np.sum(np.in1d(b, a))
-			syn_size = syn_index.shape[0]
-			self.intra_synset[self.ss_to_text(synset)] = {}
+		for j, synset in enumerate(self.synsets):
+			syn_size = containment[j, j]
+			self.intra_synset[synset.offset()] = {}
 			for i in range(j, len(self.synsets)):
-				child_path = self.dir_path + self.ss_to_text(self.synsets[i]) + '_index' + '.txt'
-				child_index = np.genfromtxt(child_path, dtype=np.int)
-				child_in_synset = np.sum(np.in1d(child_index, syn_index))
-				self.intra_synset[self.ss_to_text(synset)][self.ss_to_text(self.synsets[i])] = child_in_synset
+				child_in_synset = containment[j, i]
+				self.intra_synset[synset.offset()][self.synsets[i].offset()] = child_in_synset
 				text = 'Tenemos ' + str(syn_size) + ' ' + self.ss_to_text(synset) + ' de los cuales ' + str(
 					child_in_synset) \
 				       + ' son ' + str(self.synsets[i]) + ' el ' + str(child_in_synset / syn_size * 100) + ' % \n'
-				# print(text)
 				stats_file.write(text)
-			j = j + 1
-		# print('embedding común')
 		with open(self.intra_synset_path, 'wb') as handle:
 			pickle.dump(self.intra_synset, handle)
 		stats_file.close()
+		return containment
 
 	def plot_intra_synset(self):
 		"""
@@ -519,10 +828,10 @@ class Statistics:
 			self.intra_synset = pickle.load(open(self.intra_synset_path, 'rb'))
 
 		for synset in self.synsets:
-			plt.bar(range(len(self.intra_synset[self.ss_to_text(synset)])),
-			        self.intra_synset[self.ss_to_text(synset)].values(), align='center')
-			plt.xticks(range(len(self.intra_synset[self.ss_to_text(synset)])),
-			           self.intra_synset[self.ss_to_text(synset)].keys())
+			plt.bar(range(len(self.intra_synset[synset.offset()])),
+			        self.intra_synset[synset.offset()].values(), align='center')
+			plt.xticks(range(len(self.intra_synset[synset.offset()])),
+			           [self.key_to_text(k) for k in self.intra_synset[synset.offset()].keys()])
 			plt.title('Distribution of the synsets')
 			plt.xlabel('Synsets')
 			plt.ylabel('Quantity of images')
@@ -536,7 +845,6 @@ class Statistics:
 
 	def images_per_feature_per_synset_gen(self):
 		"""
-		TARDA INFINITO
 		Genera un archivo con el diccionario siguiente:
 			Para cada feature(0,...,12k):
 				Para cada tipo(-1,0,1)
@@ -545,20 +853,24 @@ class Statistics:
 			dict[feature][category][synset]
 
 		"""
-		print('Generando images_per_feature_per_synset, tarda varias horas :( ')
-		for feature in range(0, self.data.dmatrix.shape[1]):
+		print('Generando images_per_feature_per_synset')
+		# un conteo [features, 3] por synset (sus filas, como get_index_from_ss), el checkpoint va por synsets
+		progress = checkpoint.Checkpoint(self.images_per_feature_per_synset_path + '.ckpt', len(self.synsets),
+		                                 name='images_per_feature_per_synset')
+		start, synset_counts = progress.load(default={})
+		for i in range(start, len(self.synsets)):
+			offset = self.synsets[i].offset()
+			synset_counts[offset] = self.data.synset_category_counts(offset, hyponyms_only=True)
+			progress.step(i + 1, synset_counts)
+		self.images_per_feature_per_synset = {}
+		for feature in range(self.data.matrix_shape()[1]):
 			self.images_per_feature_per_synset[feature] = {}
-			feature_column = self.data.dmatrix[:, feature]
-			for i in self.data.features_category:
-				self.images_per_feature_per_synset[feature][i] = {}
-				feature_index = np.where(np.equal(feature_column, i))
-				for synset in self.synsets:
-					index_path = self.dir_path + self.ss_to_text(synset) + '_index' + '.txt'
-					synset_index = np.genfromtxt(index_path, dtype=np.int)
-					self.images_per_feature_per_synset[feature][i][self.ss_to_text(synset)] = np.sum(
-						np.in1d(synset_index, feature_index))
+			for c, category in enumerate(self.data.features_category):
+				self.images_per_feature_per_synset[feature][category] = {
+					offset: int(counts[feature, c]) for offset, counts in synset_counts.items()}
 		with open(self.images_per_feature_per_synset_path, 'wb') as handle:
 			pickle.dump(self.images_per_feature_per_synset, handle)
+		progress.done()
 		print('Ha generado images_per_feature_per_synset')
 
 	def is_in_layer(self, feature, layer):
@@ -582,9 +894,9 @@ class Statistics:
 			values['fc6tofc7'] = {}
 			for key in self.images_per_feature_per_synset.keys():
 				if self.is_in_layer(key, self.data.layers['conv']):
-					values['conv'][key] = self.images_per_feature_per_synset[key][category][self.ss_to_text(synset)]
+					values['conv'][key] = self.images_per_feature_per_synset[key][category][synset.offset()]
 				else:
-					values['fc6tofc7'][key] = self.images_per_feature_per_synset[key][category][self.ss_to_text(synset)]
+					values['fc6tofc7'][key] = self.images_per_feature_per_synset[key][category][synset.offset()]
 
 			plt.hist(list(values['conv'].values()), bins=50, color='#194C33')
 			plt.title('Images per feature of ' + str(category) + ' of the synset ' + self.ss_to_text(
@@ -631,18 +943,13 @@ class Statistics:
 	def find_image_without_zero(self):
 		"""
 		Quiero que me devuelva la posición de las imágenes que no tengan ningun cero
-		:return:
+		:return: np array con las filas de dmatrix
 		"""
-		if self.features_per_image == {}:
-			if path.isfile(self.features_per_image_path):
-				self.features_per_image = pickle.load(open(self.features_per_image_path, 'rb'))
-			else:
-				self.features_per_image_gen()
-				self.features_per_image = pickle.load(open(self.features_per_image, 'rb'))
-		for i in range(len(self.features_per_image.keys())):
-			if self.features_per_image[i][0] == 0:
-				print(i)
+		rows = self.data.get_bitmap_index().rows_without_zero()
+		for i in rows:
+			print(i)
 		print('end')
+		return rows
 
 	def images_per_feature_gen(self):
 		"""Genera un archivo con el diccionario siguiente:
@@ -744,66 +1051,24 @@ class Statistics:
 		"""
 		pass
 
-	def find_outlier_in_images_per_feature(self):
+	def find_outlier_in_images_per_feature(self, method='mean_std', k=4):
 		"""
 		Quiero que me defuelva las features outlier
-
-		:return:
+		:param method: 'mean_std' o 'median_mad', ver outliers.thresholds
+		:param k: cuántas desviaciones se alejan los outliers
+		:return: OutlierReport
 		"""
-		auxlayers = {
-			'conv1': [0, 128],
-			'conv2': [128, 384],
-			'conv3': [384, 1152],
-			'conv4': [1152, 2688],
-			'conv5': [2688, 4224],
-			'fc6': [4224, 8320],
-			'fc7': [8320, 12416]
-		}
+		counts = np.asarray(self.data.get_atlas().label_counts).sum(axis=0, dtype=np.int64)
+		report = outliers.OutlierReport.from_counts(counts, self.data.reduced_layers, method, k)
 
 		outlier_file = open(self.outlier_path, 'w')
-		if self.images_per_feature == {}:
-			if path.isfile(self.images_per_feature_path):
-				self.images_per_feature = pickle.load(open(self.images_per_feature_path, 'rb'))
-			else:
-				self.images_per_feature_gen()
-				self.images_per_feature = pickle.load(open(self.images_per_feature_path, 'rb'))
-
 		outlier_file.write('We are using the embedding ' + str(self.data.version) + '\n')
-		outlier_file.write('Outliers from the synsets ' + self.ss_to_text(self.synsets) + '\n')
+		outlier_file.write('Outliers from the synsets ' + str(self.textsynsets) + '\n')
 		for category in self.data.features_category:
-			vals = []
-			# print('\n' + str(category) + '\n')
-			for feature in range(len(self.images_per_feature.keys())):
-				vals.append(self.images_per_feature[feature][category])
-			mean = np.mean(vals)
-			std = np.std(vals)
-			# print('mean:' + str(mean) + '\n')
-			# print('std:' + str(std) + '\n')
-			downliers = [i for i in range(len(vals)) if vals[i] <= mean - 4 * std]
-			upliers = [i for i in range(len(vals)) if vals[i] >= mean + 4 * std]
-			outliers = [i for i in range(len(vals)) if vals[i] >= mean + 4 * std or vals[i] <= mean - 4 * std]
-			# print('lendown ' + str(len(downliers)) + '\n')
-			# print('down:' + str(downliers))
-			# print('lenup ' + str(len(upliers)) + '\n')
-			# print('up:' + str(upliers))
-			layeroutlier = {}
-			for k in list(auxlayers.keys()):
-				layeroutlier[k] = 0
-
-			for i in downliers:
-				for k in list(auxlayers.keys()):
-					if i in range(auxlayers[k][0], auxlayers[k][1]):
-						layeroutlier[k] += 1
-
-			for i in upliers:
-				for k in list(auxlayers.keys()):
-					if i in range(auxlayers[k][0], auxlayers[k][1]):
-						layeroutlier[k] += 1
-
+			layeroutlier = report.layer_outliers(category)
 			outlier_file.write('category ' + str(category) + '\n')
-			outlier_file.write(str(outliers) + '\n Distribution in the layers: \n')
+			outlier_file.write(str(report.outliers(category)) + '\n Distribution in the layers: \n')
 			outlier_file.write(str(layeroutlier) + '\n')
-			# print(layeroutlier)
 			plt.bar(range(len(layeroutlier)), layeroutlier.values(), align='center')
 			plt.xticks(range(len(layeroutlier)), layeroutlier.keys())
 			plt.title('Outliers images per features of ' + str(category))
@@ -815,6 +1080,68 @@ class Statistics:
 			plt.cla()
 			plt.clf()
 		outlier_file.close()
+		return report
+
+	def find_outlier_per_synset(self, method='mean_std', k=4):
+		"""
+		Outliers de cada synset de self.synsets, calculados todos a la vez sobre los conteos del atlas
+		(hipónimos del synset, como get_index_from_ss). Los escribe en outliers_per_synset.txt.
+		:return: OutlierReport con un primer eje de synsets
+		"""
+		counts = outliers.synset_counts(self.data.get_atlas(), self.offsets)
+		report = outliers.OutlierReport.from_counts(counts, self.data.reduced_layers, method, k)
+		with open(self.dir_path + 'outliers_per_synset.txt', 'w') as outlier_file:
+			outlier_file.write('We are using the embedding ' + str(self.data.version) + ', ' + method + '\n')
+			for i, synset in enumerate(self.synsets):
+				outlier_file.write('synset ' + self.ss_to_text(synset) + '\n')
+				for category in self.data.features_category:
+					outlier_file.write('category ' + str(category) + '\n')
+					outlier_file.write(str(report.outliers(category, i)) + '\n Distribution in the layers: \n')
+					outlier_file.write(str(report.layer_outliers(category, i)) + '\n')
+		return report
+
+	def feature_redundancy_gen(self, threshold=0.99, metric='correlation'):
+		"""
+		Grupos de features redundantes de cada layer, las que tienen |correlación| (o el mismo valor en la
+		proporción de imágenes) de al menos threshold. Los escribe en feature_redundancy.txt.
+		:param metric: 'correlation' (en valor absoluto) o 'agreement', ver FeatureCorrelation.duplicate_groups
+		:return: groups[layer] = lista de grupos de features
+		"""
+		groups = self.data.get_feature_correlation().duplicate_groups(self.data.reduced_layers, threshold, metric)
+		with open(self.dir_path + 'feature_redundancy.txt', 'w') as redundancy_file:
+			redundancy_file.write('We are using the embedding ' + str(self.data.version) + ', ' + metric + ' >= ' +
+			                      str(threshold) + '\n')
+			for layer, layer_groups in groups.items():
+				start, end = self.data.reduced_layers[layer]
+				redundant = sum(len(g) - 1 for g in layer_groups)
+				redundancy_file.write('layer ' + layer + ': ' + str(len(layer_groups)) + ' grupos, ' + str(redundant) +
+				                      ' de ' + str(end - start) + ' features sobran\n')
+				for group in layer_groups:
+					redundancy_file.write(str(group) + '\n')
+		return groups
+
+	def enrichment_gen(self, test='hypergeom', alpha=0.05):
+		"""
+		Features sobrerrepresentadas o infrarrepresentadas en cada synset respecto al resto de los datos, todos
+		los synsets a la vez (ver enrichment). Guarda la tabla de features significativas en enrichment_path y
+		escribe en el fichero de estadísticas cuántas hay por layer.
+		:param test: 'chi2' o 'hypergeom'
+		:param alpha: umbral de los q-values de Benjamini-Hochberg
+		:return: tabla con enrichment.ENRICHMENT_DTYPE
+		"""
+		atlas = self.data.get_atlas()
+		synset_counts = outliers.synset_counts(atlas, self.offsets)
+		global_counts = np.asarray(atlas.label_counts).sum(axis=0, dtype=np.int64)
+		table = enrichment.enrichment(synset_counts, global_counts, self.offsets, self.data.reduced_layers, test,
+		                              alpha)
+		np.save(self.enrichment_path, table)
+		summary = enrichment.layer_summary(table, list(self.data.reduced_layers))
+		stats_file = open(self.stats_path, 'a')
+		for synset in self.synsets:
+			stats_file.write('Features significativas (' + test + ', q < ' + str(alpha) + ') de ' +
+			                 self.ss_to_text(synset) + ': ' + str(summary.get(synset.offset(), {})) + '\n')
+		stats_file.close()
+		return table
 
 	def features_per_layer_gen(self):
 		"""
@@ -910,7 +1237,7 @@ class Statistics:
 		for category in self.data.features_category:
 			values = {}
 			for key in self.images_per_feature_per_synset.keys():
-				values[key] = self.images_per_feature_per_synset[key][category][self.ss_to_text(synset)]
+				values[key] = self.images_per_feature_per_synset[key][category][synset.offset()]
 			plt.hist(list(values.values()), bins=50)
 			plt.title('Images per feature of ' + str(category) + ' of the synset ' + self.ss_to_text(synset))
 			plt.xlabel('Quantity of ' + str(category))
@@ -948,10 +1275,8 @@ class Statistics:
 		siendo proporcion1 la proporción de 1 del representante.
 		:return: distance (float)
 		"""
-		index1 = self.get_index_from_ss(synset1)
-		cf1 = self.count_features(self.data.dmatrix[index1, :])
-		index2 = self.get_index_from_ss(synset2)
-		cf2 = self.count_features(self.data.dmatrix[index2, :])
+		cf1 = fne_core.counts_to_dict(self.data.synset_category_counts(synset1.offset(), hyponyms_only=True))
+		cf2 = fne_core.counts_to_dict(self.data.synset_category_counts(synset2.offset(), hyponyms_only=True))
 		prop1 = cf1[1] / (cf1[-1] + cf1[0])
 		prop2 = cf2[1] / (cf2[-1] + cf2[0])
 		distance = np.abs(prop1 - prop2)
@@ -971,10 +1296,10 @@ class Statistics:
 		negones = []
 		for synset in self.synsets:
 			rep = self.get_represention_fast(synset)
-			changes_in_synset[self.ss_to_text(synset)] = self.count_features(rep)
-			negones.append(changes_in_synset[self.ss_to_text(synset)][-1])
-			zeros.append(changes_in_synset[self.ss_to_text(synset)][0])
-			ones.append(changes_in_synset[self.ss_to_text(synset)][1])
+			changes_in_synset[synset.offset()] = self.count_features(rep)
+			negones.append(changes_in_synset[synset.offset()][-1])
+			zeros.append(changes_in_synset[synset.offset()][0])
+			ones.append(changes_in_synset[synset.offset()][1])
 
 		plot_index = np.arange(len(self.synsets))
 		p_negones = plt.bar(plot_index, negones, color='#4C194C')
@@ -1005,13 +1330,13 @@ class Statistics:
 		ones = []
 		zeros = []
 		negones = []
+		atlas = self.data.get_atlas()
 		for synset in self.synsets:
-			index = self.get_index_from_ss(synset)
-			rep = self.data.dmatrix[index, :]
-			changes_in_synset[self.ss_to_text(synset)] = self.count_features(rep)
-			negones.append(changes_in_synset[self.ss_to_text(synset)][-1])
-			zeros.append(changes_in_synset[self.ss_to_text(synset)][0])
-			ones.append(changes_in_synset[self.ss_to_text(synset)][1])
+			counts = atlas.node_counts(synset.offset(), hyponyms_only=True)
+			changes_in_synset[synset.offset()] = fne_core.counts_to_dict(counts if counts is not None else [0, 0, 0])
+			negones.append(changes_in_synset[synset.offset()][-1])
+			zeros.append(changes_in_synset[synset.offset()][0])
+			ones.append(changes_in_synset[synset.offset()][1])
 
 		plot_index = np.arange(len(self.synsets))
 		p_negones = plt.bar(plot_index, negones, color='#4C194C')
@@ -1077,11 +1402,12 @@ class Statistics:
 			zeros = []
 			negones = []
 			plot_index = np.arange(len(self.data.reduced_layers))
-			index = self.get_index_from_ss(synset)
-			sub_matrix = self.data.dmatrix[index, :]
+			counts = self.data.get_atlas().node_counts(synset.offset(), hyponyms_only=True)
+			if counts is None:
+				counts = np.zeros((self.matrix_size[1], 3), dtype=np.int64)
 			for layer in self.data.reduced_layers:
-				rep = sub_matrix[:, self.data.reduced_layers[layer][0]:self.data.reduced_layers[layer][1]]
-				changes_in_synset[layer] = self.count_features(rep)
+				section = counts[self.data.reduced_layers[layer][0]:self.data.reduced_layers[layer][1]]
+				changes_in_synset[layer] = fne_core.counts_to_dict(section)
 				negones.append(changes_in_synset[layer][-1])
 				zeros.append(changes_in_synset[layer][0])
 				ones.append(changes_in_synset[layer][1])
@@ -1210,13 +1536,13 @@ class Statistics:
 		"""
 		Quiero que me devuelva un vector tal que el valor i sea el que tiene mayor proporción dentro del synset.
 		rep[feature] = 1, -1 o 0 según el valor que se repite más veces.
+		Con self.approximate a True se estima de una muestra de las imágenes en vez de leerlo del atlas.
 		:param synset:
 		:return: rep
 		"""
-		index = self.get_index_from_ss(synset)
-		sub_matrix = self.data.dmatrix[index, :]
-		rep = st.mode(sub_matrix, axis=0)[0]
-		return rep
+		if self.approximate:
+			return self.data.approximate_representative(synset.offset(), hyponyms_only=True)[0]
+		return self.data.get_atlas().representative(synset.offset(), hyponyms_only=True)
 
 	def bad_get_representive(self, synset):
 		"""
@@ -1243,7 +1569,7 @@ class Statistics:
 		for feature in self.images_per_feature_per_synset.keys():
 			aux[feature] = {}
 			for category in self.images_per_feature_per_synset[feature].keys():
-				aux[feature][category] = self.images_per_feature_per_synset[feature][category][self.ss_to_text(synset)]
+				aux[feature][category] = self.images_per_feature_per_synset[feature][category][synset.offset()]
 		for feature in aux:
 			representative.append(max(aux[feature], key=aux[feature].get))
 		return representative
@@ -1252,32 +1578,17 @@ class Statistics:
 		"""
 		Quiero que me devuelva un vector tal que el valor i sea el que tiene mayor proporción dentro del synset.
 		representative[feature] = 1, -1 o 0 según el valor que se repite más veces.
-		Utilizo como valor auxiliar un diccionario de la siguiente forma, que obtengo de images_per_feature_per_synset
-		dict[feature] = {1: cantidad de 1, -1: cantidad de -1, 0: cantidad de 0}
+		Los conteos por feature salen del atlas, así que solo hay que buscar la fila del synset.
 
 		:param synset:
 		:param layer:
 		:return: representative
 		"""
-		if self.images_per_feature_per_synset == {}:
-			if path.isfile(self.images_per_feature_per_synset_path):
-				self.images_per_feature_per_synset = pickle.load(open(self.images_per_feature_per_synset_path, 'rb'))
-			else:
-				print('Generando images_per_feature_per_synset')
-				self.images_per_feature_per_synset_gen()
-				self.images_per_feature_per_synset = pickle.load(open(self.images_per_feature_per_synset_path, 'rb'))
-
-		representative = []
-		# aux[feature][category] = cantidad de valores de la category en cuestion para la feature tal
-		aux = {}
-		# section = self.data.dmatrix[:, range(self.data.layers[layer][0], self.data.layers[layer][1])]
-		for feature in range(self.data.layers[layer][0], self.data.layers[layer][1]):
-			aux[feature] = {}
-			for category in self.images_per_feature_per_synset[feature].keys():
-				aux[feature][category] = self.images_per_feature_per_synset[feature][category][self.ss_to_text(synset)]
-		for feature in aux:
-			representative.append(max(aux[feature], key=aux[feature].get))
-		return representative
+		counts = self.data.get_atlas().node_counts(synset.offset(), hyponyms_only=True)
+		if counts is None:
+			return []
+		section = counts[self.data.layers[layer][0]:self.data.layers[layer][1]]
+		return fne_core.representative_from_counts(section)
 
 	def changes_matrix(self, synset1, synset2):
 		"""
@@ -1297,8 +1608,8 @@ class Statistics:
 		:param synset2:
 		:return: cambios
 		"""
-		rep1 = self.get_representive(synset1)
-		rep2 = self.get_representive(synset2)
+		rep1 = self.get_represention_fast(synset1)
+		rep2 = self.get_represention_fast(synset2)
 		changes = np.zeros([3, 3])
 		for feature in range(0, len(rep1)):
 			r1 = rep1[feature]
@@ -1442,6 +1753,10 @@ class Distances:
 			makedirs(self.dir_path)
 		if not path.exists(self.plot_path):
 			makedirs(self.plot_path)
+		# index_cache[offset] = índices de las imágenes del synset
+		self.index_cache = {}
+		# representantes aproximados (approximate) en vez de los exactos del atlas
+		self.approximate = False
 
 	def get_in_id(self, wordnet_ss):
 		"""
@@ -1449,74 +1764,130 @@ class Distances:
 		:param wordnet_ss:
 		:return: imagenet id
 		"""
-		# Esta funcion genera la id de imagenet a partir del synset de wordnet
-		wn_id = wn.ss2of(wordnet_ss)
-		return wn_id[-1] + wn_id[:8]
+		return id_tables.get_in_id(wordnet_ss)
 
 	def ss_to_text(self, synset):
 		""" devuelve el string del nombre del synset en cuestion"""
-		return str(synset)[8:-7]
+		return id_tables.ss_to_text(synset)
 
 	def ss_to_label(self):
-		_path = '../Data/Distances/Common_Data/'
-		label_to_wordnet = json.load(_path + 'imagenet_label_to_wordnet_synset.txt')
-		wordnet_to_label = {}
-		for i in range(0, 999):
-			wordnet_to_label[label_to_wordnet[i]] = i
-		print(wordnet_to_label)
+		"""
+		:return: dict wordnet_to_label[offset] = label
+		"""
+		return self.data.wn_id_to_label()
 
 	def get_index_from_ss(self, synset):
 		"""
 		Esta función genera un archivo con los índices(0:999) de la aparición de un synset y sus hiponimos
 		y otro con los códigos imagenet de todos los hipónimos
 		"""
-		ss_path = self.dir_path + self.ss_to_text(synset) + '_index_hyponim' + '.npy'
+		offset = synset.offset()
+		if offset in self.index_cache:
+			return self.index_cache[offset]
+		ss_path = self.dir_path + self.ss_to_text(synset) + '_index_hyponim' + self.data.layout_suffix + '.npy'
 		if path.isfile(ss_path):
 			index = np.load(ss_path)
-			return index
 		else:
-			hypo = lambda s: s.hyponyms()
-			hyponim_file = open(ss_path, "w")
-			synset_list = []
-			for thing in list(synset.closure(hypo)):
-				hyponim_file.write(self.get_in_id(thing) + '\n')
-				synset_list.append(self.get_in_id(thing))
-
-			index = []
-			hyponim_file.close()
-			i = 0
-			for lab in self.data.labels:
-				if self.data.imagenet_all_ids[lab] in synset_list:
-					index.append(i)
-				i += 1
+			index = self.data.synset_rows(synset.offset(), hyponyms_only=True)
 			np.save(ss_path, index)
-			return index
+		self.index_cache[offset] = index
+		return index
 
 	def count_features(self, matrix):
 		"""
 		Devuelve un diccionario con la cantidad de features de cada tipo de la matriz matrix
 		features[category] = cantidad de category de la matriz
 		"""
-		features = {-1: 0, 0: 0, 1: 0}
-		features[1] += np.sum(np.equal(matrix, 1))
-		features[-1] += np.sum(np.equal(matrix, -1))
-		features[0] += np.sum(np.equal(matrix, 0))
-		return features
+		return fne_core.count_features(matrix)
 
 	def get_represention_fast(self, synset):
 		"""
 		Quiero que me devuelva un vector tal que el valor i sea el que tiene mayor proporción dentro del synset.
 		rep[feature] = 1, -1 o 0 según el valor que se repite más veces.
+		Con self.approximate a True se estima de una muestra de las imágenes en vez de leerlo del atlas.
 		:param synset:
 		:return: rep
 		"""
-		index = self.get_index_from_ss(synset)
-		if index != []:
-			sub_matrix = self.data.dmatrix[index, :]
-			rep = st.mode(sub_matrix, axis=0)[0]
-			# print(self.ss_to_text(synset), sub_matrix.shape)
-			return rep
-		return []
+		if self.approximate:
+			return self.data.approximate_representative(synset.offset(), hyponyms_only=True)[0]
+		return self.data.get_atlas().representative(synset.offset(), hyponyms_only=True)
+
+	def representatives_of(self, offsets):
+		"""
+		Representantes de varios synsets a la vez, uno por fila.
+		:param offsets: offsets de los synsets
+		:return: (reps [synsets, features] int8, valid [synsets] bool, False si el synset no tiene imagenes)
+		"""
+		atlas = self.data.get_atlas()
+		reps = np.zeros((len(offsets), atlas.representatives.shape[1]), dtype=np.int8)
+		valid = np.zeros(len(offsets), dtype=bool)
+		for i, offset in enumerate(offsets):
+			rep = atlas.representative(offset, hyponyms_only=True)
+			if len(rep) > 0:
+				reps[i] = rep
+				valid[i] = True
+		return reps, valid
+
+	def subtree_edges(self, synset, imagenet=None):
+		"""
+		Todas las aristas hiperónimo -> hipónimo del subárbol de synset (recorrido en anchura, como
+		breadth_first_search) cuyo hipónimo tiene imágenes debajo, con NEW_distance_between_synsets_reps.
+		Los representantes se buscan una vez por synset y las distancias se calculan todas juntas.
+		:param synset: raíz del subárbol
+		:param imagenet: OffsetBitset con los synsets de imagenet y sus hipónimos, por defecto el de data
+		:return: np array con dtype hierarchy.EDGE_DTYPE (parent, child, depth, distance)
+		"""
+		blocks = list(self.iter_subtree_edges(synset, imagenet, batch=None))
+		if len(blocks) == 0:
+			return np.zeros(0, dtype=hierarchy.EDGE_DTYPE)
+		return np.concatenate(blocks)
+
+	def iter_subtree_edges(self, synset, imagenet=None, batch=4096):
+		"""
+		Las mismas aristas que subtree_edges, por bloques de como mucho batch aristas a medida que se
+		recorre el subárbol, con las distancias de cada bloque ya calculadas.
+		:param batch: None para un solo bloque con todo el subárbol
+		"""
+		if imagenet is None:
+			imagenet = self.data.all_synsets_and_sons_set
+		dag = hierarchy.get_hyponym_dag()
+		keep = lambda o: dag.has_hyponym_in(o, imagenet)
+		if batch is None:
+			blocks = [dag.bfs_edges(synset.offset(), keep=keep)]
+		else:
+			blocks = dag.iter_bfs_edges(synset.offset(), keep=keep, batch=batch)
+		for edges in blocks:
+			n_edges = edges.shape[0]
+			nodes, inverse = np.unique(np.concatenate([edges['parent'], edges['child']]), return_inverse=True)
+			reps, valid = self.representatives_of(nodes)
+			edges['distance'] = fne_core.ones_distance_pairs(reps, valid, inverse[:n_edges], inverse[n_edges:])
+			yield edges
+
+	def subtree_edges_ci(self, synset, imagenet=None, **kwargs):
+		"""
+		subtree_edges con un intervalo de confianza bootstrap de cada distancia (ver bootstrap.bootstrap_pairs).
+		:param kwargs: n_boot, method, alpha, workers, batch, seed
+		:return: (edges con EDGE_DTYPE, intervals con bootstrap.CI_DTYPE en el mismo orden)
+		"""
+		edges = self.subtree_edges(synset, imagenet)
+		return edges, bootstrap.bootstrap_edges(self.data.get_atlas(), edges, **kwargs)
+
+	def distance_ci(self, first, second, **kwargs):
+		"""
+		NEW_distance_between_synsets_reps de cada par (first[i], second[i]) con su intervalo de confianza bootstrap.
+		:param first, second: listas de synsets
+		:return: array con bootstrap.CI_DTYPE
+		"""
+		return bootstrap.bootstrap_pairs(self.data.get_atlas(), [s.offset() for s in first],
+		                                 [s.offset() for s in second], **kwargs)
+
+	def cluster_representatives(self):
+		"""
+		Clustering jerárquico (average linkage) de los representantes de todos los synsets del atlas con la
+		distancia de NEW_distance_between_synsets_reps, comparado con WordNet (ver clustering).
+		:return: Clustering con linkage y metrics
+		"""
+		return Clustering.load_or_build(self.data)
 
 	def distance_between_synsets_reps(self, synset1, synset2):
 		"""
@@ -1528,34 +1899,13 @@ class Distances:
 		"""
 		r1 = self.get_represention_fast(synset1)
 		r2 = self.get_represention_fast(synset2)
-		cf1 = self.count_features(r1)
-		cf2 = self.count_features(r2)
-		if (cf1[-1] + cf1[0] + cf1[1]) == 0 or (cf2[-1] + cf2[0] + cf2[1]) == 0:
-			return 9999
-		prop1 = cf1[1] / (cf1[-1] + cf1[0] + cf1[1])
-		prop2 = cf2[1] / (cf2[-1] + cf2[0] + cf2[1])
-		# print('prop1: ', prop1)
-		# print(synset1)
-		# print(r1)
-		# print('prop2: ', prop2)
-		# print(synset2)
-		# print(r2)
-		distance = np.abs(prop1 - prop2) * 100
-		return distance
+		return fne_core.ones_proportion_distance(r1, r2)
 
 	def NEW_distance_between_synsets_reps(self, synset1, synset2):
 		# print(self.ss_to_text(synset1), self.ss_to_text(synset2))
 		r1 = self.get_represention_fast(synset1)
 		r2 = self.get_represention_fast(synset2)
-		cf1 = self.count_features(r1)
-		cf2 = self.count_features(r2)
-		if (cf1[-1] + cf1[0] + cf1[1]) == 0 or (cf2[-1] + cf2[0] + cf2[1]) == 0:
-			return 9999
-		sharedones = np.sum(np.equal(r1, 1) & np.equal(r1, r2))
-		totalones = cf1[1] + cf2[1]
-		d = 1 - (sharedones / (totalones - sharedones))
-		# print(self.ss_to_text(synset1), self.ss_to_text(synset2), 'distance', d)
-		return d
+		return fne_core.ones_distance(r1, r2)
 
 	def plot_changes_between_synset_reps(self, synsets):
 		"""
@@ -1573,14 +1923,14 @@ class Distances:
 		textsynsets = []
 		for synset in synsets:
 			rep = self.get_represention_fast(synset)
-			if rep == []:
+			if len(rep) == 0:
 				continue
 			l += 1
-			textsynsets.append(str(synset)[8:-7])
-			changes_in_synset[self.ss_to_text(synset)] = self.count_features(rep)
-			negones.append(changes_in_synset[self.ss_to_text(synset)][-1])
-			zeros.append(changes_in_synset[self.ss_to_text(synset)][0])
-			ones.append(changes_in_synset[self.ss_to_text(synset)][1])
+			textsynsets.append(self.ss_to_text(synset))
+			changes_in_synset[synset.offset()] = self.count_features(rep)
+			negones.append(changes_in_synset[synset.offset()][-1])
+			zeros.append(changes_in_synset[synset.offset()][0])
+			ones.append(changes_in_synset[synset.offset()][1])
 
 		plot_index = np.arange(l)
 		p_negones = plt.bar(plot_index, negones, color='#4C194C')
@@ -0,0 +1,227 @@
+"""
+Offline snapshot of the WordNet noun hierarchy.
+
+The only parts of WordNet the code uses are the noun hypernym/hyponym DAG, the offsets and the names. The
+snapshot keeps them in flat arrays, in one file that is memory-mapped when it is opened:
+	offsets                 sorted offsets of all the noun synsets; node i is offsets[i]
+	child_ptr, child_idx    CSR of the hyponyms: the children of node i are child_idx[child_ptr[i]:child_ptr[i + 1]]
+	parent_ptr, parent_idx  the same for the hypernyms
+	depth                   shortest number of hypernym links from a root
+	name_ptr, name_bytes    UTF-8 names (the text of ss_to_text), name i is name_bytes[name_ptr[i]:name_ptr[i + 1]]
+
+Building it needs nltk once; afterwards hierarchy.get_hyponym_dag and the names run on the arrays.
+
+File layout: 8 bytes of magic, the length of a JSON header (uint64), the header with the dtype, shape and
+position of every array, and the arrays, each aligned to 64 bytes.
+"""
+import json
+import os
+import numpy as np
+from os import path
+from Code.id_tables import ss_to_text
+from Code.lazy_imports import wn
+
+SNAPSHOT_PATH = '../Data/Distances/Common_Data/wordnet_nouns.snapshot'
+_MAGIC = b'WNSNAP1\n'
+_ALIGN = 64
+_ARRAYS = ['offsets', 'child_ptr', 'child_idx', 'parent_ptr', 'parent_idx', 'depth', 'name_ptr', 'name_bytes']
+
+
+def write_arrays(file_path, arrays):
+	"""
+	Guarda un dict nombre -> array en un solo fichero que se puede mapear con map_arrays.
+	"""
+	header = {}
+	position = 0
+	for name, array in arrays.items():
+		position = (position + _ALIGN - 1) // _ALIGN * _ALIGN
+		header[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': position}
+		position += array.nbytes
+	header_bytes = json.dumps(header).encode('utf-8')
+	start = (len(_MAGIC) + 8 + len(header_bytes) + _ALIGN - 1) // _ALIGN * _ALIGN
+	tmp_path = file_path + '.tmp'
+	with open(tmp_path, 'wb') as f:
+		f.write(_MAGIC)
+		f.write(np.uint64(len(header_bytes)).tobytes())
+		f.write(header_bytes)
+		for name, array in arrays.items():
+			f.seek(start + header[name]['offset'])
+			f.write(np.ascontiguousarray(array).tobytes())
+	os.replace(tmp_path, file_path)
+
+
+def map_arrays(file_path):
+	"""
+	:return: dict nombre -> np.memmap de solo lectura
+	"""
+	with open(file_path, 'rb') as f:
+		if f.read(len(_MAGIC)) != _MAGIC:
+			raise IOError(file_path + ' no es un snapshot de WordNet')
+		length = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+		header = json.loads(f.read(length).decode('utf-8'))
+	start = (len(_MAGIC) + 8 + length + _ALIGN - 1) // _ALIGN * _ALIGN
+	arrays = {}
+	for name, entry in header.items():
+		shape = tuple(entry['shape'])
+		if int(np.prod(shape)) == 0:
+			arrays[name] = np.zeros(shape, dtype=entry['dtype'])
+		else:
+			arrays[name] = np.memmap(file_path, dtype=entry['dtype'], mode='r', offset=start + entry['offset'],
+			                         shape=shape)
+	return arrays
+
+
+def _csr(lists, n):
+	ptr = np.zeros(n + 1, dtype=np.int64)
+	np.cumsum([len(l) for l in lists], out=ptr[1:])
+	idx = np.array([i for l in lists for i in l], dtype=np.int32)
+	return ptr, idx
+
+
+def gather_ranges(ptr, idx, nodes):
+	"""
+	Concatenación de idx[ptr[n]:ptr[n + 1]] para todos los nodes, sin bucle en Python.
+	"""
+	starts = ptr[nodes]
+	lengths = ptr[nodes + 1] - starts
+	total = int(lengths.sum())
+	if total == 0:
+		return np.zeros(0, dtype=idx.dtype)
+	# posición de cada elemento dentro de su rango más el inicio del rango
+	steps = np.ones(total, dtype=np.int64)
+	ends = np.cumsum(lengths)
+	non_empty = lengths > 0
+	steps[0] = starts[non_empty][0]
+	jumps = starts[non_empty][1:] - (starts[non_empty][:-1] + lengths[non_empty][:-1]) + 1
+	steps[ends[non_empty][:-1]] = jumps
+	return idx[np.cumsum(steps)]
+
+
+class WordNetSnapshot:
+	"""
+	Attributes: los arrays descritos en el docstring del módulo
+	"""
+
+	def __init__(self, offsets, child_ptr, child_idx, parent_ptr, parent_idx, depth, name_ptr, name_bytes):
+		self.offsets = offsets
+		self.child_ptr = child_ptr
+		self.child_idx = child_idx
+		self.parent_ptr = parent_ptr
+		self.parent_idx = parent_idx
+		self.depth = depth
+		self.name_ptr = name_ptr
+		self.name_bytes = name_bytes
+
+	@classmethod
+	def build(cls):
+		"""
+		Recorre todos los sustantivos de WordNet con nltk, es lo único que lo necesita.
+		"""
+		synsets = sorted(wn.all_synsets('n'), key=lambda s: s.offset())
+		offsets = np.array([s.offset() for s in synsets], dtype=np.int64)
+		index = dict(zip(offsets.tolist(), range(offsets.shape[0])))
+		n = offsets.shape[0]
+		# los hijos en el orden de synset.hyponyms(), como HyponymDag con nltk
+		child_ptr, child_idx = _csr([[index[h.offset()] for h in s.hyponyms()] for s in synsets], n)
+		parent_ptr, parent_idx = _csr([[index[h.offset()] for h in s.hypernyms()] for s in synsets], n)
+		names = [ss_to_text(s).encode('utf-8') for s in synsets]
+		name_ptr = np.zeros(n + 1, dtype=np.int64)
+		np.cumsum([len(b) for b in names], out=name_ptr[1:])
+		name_bytes = np.frombuffer(b''.join(names), dtype=np.uint8)
+		depth = np.full(n, -1, dtype=np.int32)
+		frontier = np.flatnonzero(parent_ptr[1:] == parent_ptr[:-1])
+		level = 0
+		while frontier.shape[0] > 0:
+			depth[frontier] = level
+			children = np.unique(gather_ranges(child_ptr, child_idx, frontier))
+			frontier = children[depth[children] < 0]
+			level += 1
+		return cls(offsets, child_ptr, child_idx, parent_ptr, parent_idx, depth, name_ptr, name_bytes)
+
+	def save(self, snapshot_path=SNAPSHOT_PATH):
+		write_arrays(snapshot_path, {name: np.asarray(getattr(self, name)) for name in _ARRAYS})
+
+	@classmethod
+	def load(cls, snapshot_path=SNAPSHOT_PATH):
+		return cls(**map_arrays(snapshot_path))
+
+	@classmethod
+	def load_or_build(cls, snapshot_path=SNAPSHOT_PATH):
+		if path.isfile(snapshot_path):
+			return cls.load(snapshot_path)
+		snapshot = cls.build()
+		snapshot.save(snapshot_path)
+		return snapshot
+
+	def __len__(self):
+		return self.offsets.shape[0]
+
+	def __contains__(self, offset):
+		return self.index(offset) >= 0
+
+	def index(self, offset):
+		"""
+		:return: nodo del offset, -1 si no es un sustantivo de WordNet
+		"""
+		i = int(np.searchsorted(self.offsets, offset))
+		if i < self.offsets.shape[0] and self.offsets[i] == offset:
+			return i
+		return -1
+
+	def node(self, offset):
+		"""
+		:return: nodo del offset, KeyError si no es un sustantivo de WordNet
+		"""
+		i = self.index(offset)
+		if i < 0:
+			raise KeyError('El offset ' + str(offset) + ' no es un sustantivo de WordNet')
+		return i
+
+	def indices(self, offsets):
+		"""
+		Vectorizado, -1 para los offsets que no están.
+		"""
+		offsets = np.asarray(offsets, dtype=np.int64)
+		pos = np.minimum(np.searchsorted(self.offsets, offsets), self.offsets.shape[0] - 1)
+		return np.where(self.offsets[pos] == offsets, pos, -1)
+
+	def children(self, offset):
+		"""
+		Offsets de los hipónimos directos, como una lista (lo que espera HyponymDag).
+		"""
+		i = self.node(offset)
+		return self.offsets[self.child_idx[self.child_ptr[i]:self.child_ptr[i + 1]]].tolist()
+
+	def parents(self, offset):
+		i = self.node(offset)
+		return self.offsets[self.parent_idx[self.parent_ptr[i]:self.parent_ptr[i + 1]]].tolist()
+
+	def name(self, offset):
+		i = self.node(offset)
+		return bytes(self.name_bytes[self.name_ptr[i]:self.name_ptr[i + 1]]).decode('utf-8')
+
+	def depth_of(self, offset):
+		return int(self.depth[self.node(offset)])
+
+	def descendants(self, offset):
+		"""
+		El offset y todos sus hipónimos, ordenados, recorriendo el CSR por niveles.
+		"""
+		seen = np.zeros(len(self), dtype=bool)
+		frontier = np.array([self.node(offset)], dtype=np.int64)
+		seen[frontier] = True
+		while frontier.shape[0] > 0:
+			children = np.unique(gather_ranges(self.child_ptr, self.child_idx, frontier))
+			frontier = children[~seen[children]]
+			seen[frontier] = True
+		return self.offsets[np.flatnonzero(seen)]
+
+
+def main():
+	snapshot = WordNetSnapshot.build()
+	snapshot.save()
+	print(len(snapshot), 'sustantivos guardados en', SNAPSHOT_PATH)
+
+
+if __name__ == "__main__":
+	main()